@@ -16,7 +16,7 @@ class Base_Agent(object):
     """
 
     def __init__(self, env, epsilon_decay_steps=10000, memory_length=int(1e6),
-                 discount_rate=0.95, verbose=0):
+                 discount_rate=0.95, verbose=0, memory_kwargs=None):
         self.env = env
         self.action_space = self.env.action_space
         self.observation_space = self.env.observation_space
@@ -33,21 +33,30 @@ class Base_Agent(object):
                                              verbose=0)
 
         #  object to hold all of the agents experience
+        #  memory_kwargs are optional args for Agent_Memory (i.e. lazy_scaling)
+        if memory_kwargs is None:
+            memory_kwargs = {}
         self.memory = Agent_Memory(memory_length=self.memory_length,
                                    observation_space=env.observation_space,
                                    action_space=env.action_space,
                                    reward_space=env.reward_space,
-                                   discount_rate=discount_rate)
+                                   discount_rate=discount_rate,
+                                   **memory_kwargs)
 
         return None
 
     #  assign errors for the Base_Agent methods
     def _reset(self): raise NotImplementedError
     def _act(self, observation): raise NotImplementedError
+    def _act_batch(self, observations, session, epsilon): raise NotImplementedError
     def _learn(self, observation): raise NotImplementedError
-    def _load_brain(self): raise NotImplementedError
+    def _load_brain(self, path, session): raise NotImplementedError
     def _output_results(self): raise NotImplementedError
 
+    #  agents without learnt parameters have no state to checkpoint
+    def _get_brain_state(self, session): return {}
+    def _set_brain_state(self, state, session): return None
+
     def reset(self):
         """
         """
@@ -69,6 +78,28 @@ class Base_Agent(object):
 
         return self._act(observation, session, epsilon)
 
+    def act_batch(self, observations,
+                        session = None):
+        """
+        Selects actions for a batch of observations (i.e. one per env)
+
+        Epsilon is decayed by one step per observation.
+
+        Calls the ._act_batch method - each agent child class implements it
+        with vectorized operations over the whole batch (i.e. one network
+        forward pass & one exploration draw per row).
+
+        Args:
+            observations (np.array) : shape (num_observations, observation_dim)
+
+        Returns:
+            actions (np.array) : shape (num_observations, num_actions)
+        """
+        observations = np.asarray(observations).reshape(-1, self.observation_dim)
+        epsilon = self.epsilon_greedy.get_epsilon(steps=observations.shape[0])
+
+        return self._act_batch(observations, session, epsilon)
+
     def learn(self, observations       = None,
                     actions            = None,
                     discounted_returns = None,
@@ -87,10 +118,25 @@ class Base_Agent(object):
 
         return self._learn(observations, actions, discounted_returns, session)
 
-    def load_brain(self):
+    def load_brain(self, path=None, session=None):
         """
+        Loads learnt parameters (i.e. a policy artifact) into the agent
         """
-        return self._load_brain()
+        return self._load_brain(path, session)
+
+    def get_brain_state(self, session=None):
+        """
+        Learnt parameters & optimizer state as name -> np.array
+
+        Used to checkpoint the agent
+        """
+        return self._get_brain_state(session)
+
+    def set_brain_state(self, state, session=None):
+        """
+        Restores the output of get_brain_state
+        """
+        return self._set_brain_state(state, session)
 
     def output_results(self):
         """
@@ -133,8 +179,11 @@ class Epsilon_Greedy(object):
         self.epsilon = self.epsilon_start
         self.mode    = 'training'
 
-    def get_epsilon(self):
+    def get_epsilon(self, steps=1):
         """
+        Args:
+            steps (int) : number of steps to decay by (i.e. one per env when
+                          acting for many envs at once)
         """
 
         if self.verbose:
@@ -151,7 +200,6 @@ class Epsilon_Greedy(object):
         else:
             self.epsilon = self.epsilon_end
 
-        self.steps += 1
-
+        self.steps += steps
 
         return self.epsilon
@@ -3,15 +3,35 @@
 """
 
 import collections
-import itertools
+import functools
+import json
 import os
+import threading
+import weakref
 
 import numpy as np
 import pandas as pd
 
+from energy_py.agents.prefetch import Batch_Prefetcher
+from energy_py.agents.returns import discounted_returns
+from energy_py.agents.ring_buffer import Memmap_Ring_Buffer, Ring_Buffer
+from energy_py.agents.sum_tree import Sum_Tree
+from energy_py.main.scripts.spaces import scaling_bounds
 from energy_py.main.scripts.utils import ensure_dir
 from energy_py.main.scripts.visualizers import Agent_Memory_Visualizer
 
+
+def locked(method):
+    """
+    Decorator - runs a method of Agent_Memory holding the memory lock
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Agent_Memory(Agent_Memory_Visualizer):
     """
     inherits from Visualizer!
@@ -19,38 +39,221 @@ class Agent_Memory(Agent_Memory_Visualizer):
     A class to hold the memory of an agent
 
     Contains functions to process the memory for an agent to learn from
+
+    Experience is held in a Ring_Buffer of preallocated arrays - memory use
+    is fixed at construction & the oldest experience is overwritten once
+    memory_length steps have been added.
+
+    backend = 'array'  : arrays are held in RAM
+              'memmap' : arrays are memory-mapped files in scratch_dir -
+                         for memories larger than RAM.  A temporary
+                         scratch_dir is removed by close()
+
+    With lazy_scaling observations are only stored raw & are scaled when
+    a batch is sampled - otherwise a scaled copy is stored alongside.
+
+    Each episode must be added as a contiguous run of steps.  We keep an
+    index of episode -> (start, end) absolute rows so that we never search
+    the buffer for an episode.
+
+    With prioritized experience is sampled using a Sum_Tree of priorities -
+    see get_prioritized_batch & update_priorities.  New experience is given
+    the maximum priority seen so far.
+
+    Observations are stored as observation_dtype (i.e. np.float32).  The
+    compact layout stores a single observation stream:
+        - next_observation[t] is rebuilt from observation[t+1] - only the
+          final next_observation of each episode is kept separately
+        - dummy variables (discrete spaces) are stored as uint8
+        - implies lazy_scaling
+
+    Methods that change the memory hold a lock, as does the sampling done
+    by prefetch in its background thread - so a prefetched batch never
+    holds a half written row.  prefetch also only samples experience from
+    processed episodes (see get_processed_batch).
     """
     def __init__(self, memory_length,
                        observation_space,
                        action_space,
                        reward_space,
-                       discount_rate):
+                       discount_rate,
+                       lazy_scaling = False,
+                       prioritized  = False,
+                       alpha        = 0.6,
+                       beta         = 0.4,
+                       backend      = 'array',
+                       scratch_dir  = None,
+                       compact      = False,
+                       observation_dtype = np.float64):
 
         super().__init__()
-        self.memory_length     = memory_length
+        self.memory_length     = int(memory_length)
         self.observation_space = observation_space
         self.action_space      = action_space
         self.reward_space      = reward_space
         self.discount_rate     = discount_rate
 
+        self.compact           = compact
+        self.observation_dtype = np.dtype(observation_dtype)
+        self.lazy_scaling      = lazy_scaling or compact
+        self.prioritized       = prioritized
+        self.alpha             = alpha
+        self.beta              = beta
+
+        self.observation_dim = len(self.observation_space)
+        self.action_dim      = len(self.action_space)
+
+        #  precomputed vectors to scale observations with one broadcast
+        self.observation_low, self.observation_inv_range = scaling_bounds(self.observation_space)
+
+        #  the compact layout splits continuous & dummy variables
+        types = np.array([space.type for space in self.observation_space])
+        self.continuous_idx = np.flatnonzero(types == 'continuous')
+        self.dummy_idx = np.flatnonzero(types == 'discrete')
+        if self.compact:
+            for idx in self.dummy_idx:
+                space = self.observation_space[idx]
+                if space.low < 0 or space.high > 255:
+                    raise ValueError('discrete observation {} cannot be '
+                                     'stored as uint8'.format(idx))
+
         #  a named tuple to hold experience
         self.Experience = collections.namedtuple('experience', 'observation, action, reward, next_observation, step, episode')
         self.Scaled_Experience = collections.namedtuple('scaled_experience', 'observation, action, reward, next_observation, step, episode, discounted_return')
 
+        #  preallocated arrays to hold the experience
+        self.finalizer = None
+        if backend == 'array':
+            self.set_buffer(Ring_Buffer(capacity=self.memory_length,
+                                        fields=self.make_fields()))
+        elif backend == 'memmap':
+            self.set_buffer(Memmap_Ring_Buffer(capacity=self.memory_length,
+                                               fields=self.make_fields(),
+                                               scratch_dir=scratch_dir))
+        else:
+            raise ValueError('unknown memory backend {}'.format(backend))
+
+        #  priorities (raised to alpha) for each position in the buffer
+        if self.prioritized:
+            self.priorities = Sum_Tree(self.memory_length)
+
+        #  set when a saved memory is memory-mapped by load()
+        self.read_only = False
+
         self.training_data = []  #  TODO
 
+        #  see locked - reentrant as locked methods call each other
+        self.lock = threading.RLock()
         self.reset()
 
+    def make_fields(self):
+        """
+        The (shape, dtype) of a single row for each field of the buffer
+        """
+        obs_shape = (self.observation_dim,)
+        obs_dtype = self.observation_dtype
+        fields = collections.OrderedDict([
+                 ('observation',        (obs_shape, obs_dtype)),
+                 ('scaled_observation', (obs_shape, obs_dtype)),
+                 ('action',             ((self.action_dim,), np.float64)),
+                 ('reward',             ((), np.float64)),
+                 ('scaled_reward',      ((), np.float64)),
+                 ('next_observation',   (obs_shape, obs_dtype)),
+                 ('done',               ((), np.bool_)),
+                 ('discounted_return',  ((), np.float64)),
+                 ('step',               ((), np.int64)),
+                 ('episode',            ((), np.int64))])
+
+        if self.lazy_scaling:
+            del fields['scaled_observation']
+
+        if self.compact:
+            del fields['next_observation']
+            fields['observation'] = ((self.continuous_idx.shape[0],), obs_dtype)
+            fields['observation_dummies'] = ((self.dummy_idx.shape[0],), np.uint8)
+
+        return fields
+
+    def set_buffer(self, buffer):
+        """
+        Replaces the buffer - closing the previous one
+
+        The buffer is also closed when the memory is garbage collected or
+        the interpreter exits (i.e. removing a temporary memmap directory)
+        """
+        if self.finalizer is not None:
+            self.finalizer()
+        self.buffer = buffer
+        self.finalizer = weakref.finalize(self, buffer.close)
+        return None
+
+    def close(self):
+        """
+        Releases the buffer - removes the files of a temporary memmap buffer
+
+        The memory can't be used afterwards
+        """
+        with self.lock:
+            self.finalizer()
+        return None
+
+    @locked
     def reset(self):
         """
         Resets the memory object
         """
-        self.experiences        = []
-        self.scaled_experiences = []
-        self.discounted_returns = np.array([])
+        self.buffer.reset()
+        if self.prioritized:
+            self.priorities.reset()
+            self.max_priority = 1.0
+        #  episode -> [start, end) absolute rows in the buffer
+        self.episode_index = collections.OrderedDict()
+        #  episode -> the last next_observation seen (compact layout only)
+        self.final_observations = {}
+        #  episode -> statistics recorded when the episode is processed
+        self.episode_stats = collections.OrderedDict()
+        #  absolute row after the newest processed episode
+        self.processed_total = 0
         self.outputs  = collections.defaultdict(list)
         self.losses = []
 
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def experiences(self):
+        """
+        The held experience as a list of Experience tuples (oldest first)
+
+        Expensive - only intended for creating outputs
+        """
+        positions = self.buffer.chronological()
+        rows = self.buffer.gather(positions, ['action', 'reward', 'step', 'episode'])
+        return [self.Experience(*args) for args in zip(self.get_observations(positions),
+                                                        rows['action'],
+                                                        rows['reward'],
+                                                        self.get_next_observations(positions),
+                                                        rows['step'],
+                                                        rows['episode'])]
+
+    @property
+    def scaled_experiences(self):
+        """
+        The held experience as a list of Scaled_Experience tuples (oldest first)
+
+        Expensive - only intended for creating outputs
+        """
+        positions = self.buffer.chronological()
+        rows = self.buffer.gather(positions, ['action', 'scaled_reward', 'step',
+                                              'episode', 'discounted_return'])
+        return [self.Scaled_Experience(*args) for args in zip(self.get_scaled_observations(positions),
+                                                               rows['action'],
+                                                               rows['scaled_reward'],
+                                                               [None] * len(rows['step']),
+                                                               rows['step'],
+                                                               rows['episode'],
+                                                               rows['discounted_return'])]
+
     def normalize(self, value, low, high):
         """
         Helper function
@@ -83,177 +286,746 @@ class Agent_Memory(Agent_Memory_Visualizer):
 
     def scale_array(self, array, space):
         """
-        Helper function for scale_experience()
-        Uses the space & a given function to scale an array
+        Uses the space to scale an array
         Default scaler is to normalize
 
-        Used to scale the observation and action
+        Works on a single array or a batch of shape (num_samples, len(space))
+
+        Used to scale the observation
+        """
+        if space is self.observation_space:
+            low, inv_range = self.observation_low, self.observation_inv_range
+        else:
+            low, inv_range = scaling_bounds(space)
+
+        return (np.asarray(array, dtype=np.float64) - low) * inv_range
+
+    def scale_reward(self, reward, space):
+        """
+        Helper function for add_experience()
+        Uses a space to scale the reward
+        """
+        return self.normalize(reward, space.low, space.high)
+
+    @locked
+    def add_experience(self, observation, action, reward, next_observation, step, episode,
+                       done=False):
         """
+        Adds a single step of experience to the buffer
 
-        #  empty numpy array
-        scaled_array = np.array([])
+        The discounted return is unknown until the episode is processed
 
-        #  iterate across the array values & corresponding space object
-        for value, spc in itertools.zip_longest(array, space):
-            if spc.type == 'continuous':  #  normalize continuous variables
-                scaled = self.normalize(value,
-                                     spc.low,
-                                     spc.high)
+        done marks the final step of an episode - there is no next
+        observation to bootstrap from (see get_transition_batch)
+        """
+        if self.read_only:
+            raise ValueError('memory was loaded with mmap=True & is read only')
 
-            elif spc.type == 'discrete':  #  shouldn't need to do anything
-                #  check value is already dummy
-                assert (value == 0) or (value == 1)
-            else:
-                assert 1 == 0
+        #  envs signal the terminal next_observation with False
+        if next_observation is False or next_observation is None:
+            next_observation = 0
 
-            #  appending the scaled value onto the scaled array
-            scaled_array = np.append(scaled_array, scaled)
+        self.index_experience(episode)
 
-        scaled_array = scaled_array.reshape(-1)
+        row = dict(observation=observation,
+                   action=action,
+                   reward=reward,
+                   scaled_reward=self.scale_reward(reward, self.reward_space),
+                   done=bool(done),
+                   discounted_return=np.nan,
+                   step=step,
+                   episode=episode)
 
-        return scaled_array
+        if self.compact:
+            observation = np.asarray(observation)
+            row['observation'] = observation[self.continuous_idx]
+            row['observation_dummies'] = observation[self.dummy_idx]
+            #  only needed once this episode is over - overwritten each step
+            final = np.zeros(self.observation_dim, dtype=self.observation_dtype)
+            final[:] = next_observation
+            self.final_observations[episode] = final
+        else:
+            row['next_observation'] = next_observation
 
-    def scale_reward(self, reward, space):
+        if not self.lazy_scaling:
+            row['scaled_observation'] = self.scale_array(observation,
+                                                         self.observation_space)
+        position = self.buffer.add(**row)
+
+        #  new experience is made likely to be sampled
+        if self.prioritized:
+            self.priorities.update(position, self.max_priority ** self.alpha)
+        return None
+
+    @locked
+    def add_episode(self, observations, actions, rewards, next_observations, episode,
+                    dones=None):
         """
-        Helper function for scale_experience()
-        Uses a space to scale the reward
+        Adds many steps of experience for one episode at once
+
+        Much faster than calling add_experience for each step (i.e. for a
+        learner receiving whole episodes from actor processes).  The
+        discounted returns are unknown until the episode is processed.
+
+        Args:
+            observations      (np.array) : (num_steps, observation_dim)
+            actions           (np.array) : (num_steps, action_dim)
+            rewards           (np.array) : (num_steps,)
+            next_observations (np.array) : (num_steps, observation_dim) - zeros
+                                           for the terminal step
+            episode           (int)      :
+            dones             (np.array) : (num_steps,) - default is only the
+                                           last step is done
         """
-        return self.normalize(reward, space.low, space.high)
+        if self.read_only:
+            raise ValueError('memory was loaded with mmap=True & is read only')
+
+        rewards = np.asarray(rewards, dtype=np.float64).reshape(-1)
+        num_steps = rewards.shape[0]
+        if num_steps > self.buffer.capacity:
+            raise ValueError('episode of {} steps is longer than the '
+                             'memory'.format(num_steps))
+
+        observations = np.asarray(observations).reshape(num_steps, self.observation_dim)
+        next_observations = np.asarray(next_observations).reshape(num_steps, self.observation_dim)
+        if dones is None:
+            dones = np.arange(num_steps) == num_steps - 1
+
+        #  the first step of this call within the episode
+        first_step = 0
+        if episode in self.episode_index:
+            start, end = self.episode_index[episode]
+            first_step = end - start
+
+        self.index_experience(episode, num_steps)
+
+        rows = dict(action=np.asarray(actions).reshape(num_steps, self.action_dim),
+                    reward=rewards,
+                    scaled_reward=self.scale_reward(rewards, self.reward_space),
+                    done=dones,
+                    discounted_return=np.nan,
+                    step=first_step + np.arange(num_steps),
+                    episode=episode)
+
+        if self.compact:
+            rows['observation'] = observations[:, self.continuous_idx]
+            rows['observation_dummies'] = observations[:, self.dummy_idx]
+            self.final_observations[episode] = next_observations[-1].astype(self.observation_dtype)
+        else:
+            rows['observation'] = observations
+            rows['next_observation'] = next_observations
+
+        if not self.lazy_scaling:
+            rows['scaled_observation'] = self.scale_array(observations,
+                                                          self.observation_space)
+        positions = self.buffer.extend(num_steps, **rows)
+
+        if self.prioritized:
+            self.priorities.update(positions, self.max_priority ** self.alpha)
+        return None
+
+    def get_observations(self, positions):
+        """
+        Gets raw observations from the buffer as float64
+        """
+        if not self.compact:
+            raw = self.buffer.gather(positions, ['observation'])['observation']
+            return raw.astype(np.float64, copy=False)
 
-    def scale_experience(self, exp, discounted_return=None):
+        rows = self.buffer.gather(positions, ['observation', 'observation_dummies'])
+        observations = np.empty((rows['observation'].shape[0], self.observation_dim))
+        observations[:, self.continuous_idx] = rows['observation']
+        observations[:, self.dummy_idx] = rows['observation_dummies']
+        return observations
+
+    def get_next_observations(self, positions):
         """
-        Helper function for add_experience
-        Scales a given experience tuple
+        Gets raw next observations from the buffer as float64
 
-        Discounted return is an optimal arg so that the scaled_exp array can
-        be created at any time
+        The compact layout rebuilds these from the following row of the
+        same episode - or the stored final next_observation of the episode
         """
-        scaled_obs = self.scale_array(exp.observation, self.observation_space)
-        scaled_reward = self.scale_reward(exp.reward, self.reward_space)
+        if not self.compact:
+            raw = self.buffer.gather(positions, ['next_observation'])['next_observation']
+            return raw.astype(np.float64, copy=False)
+
+        positions = np.arange(self.buffer.capacity)[positions]
+        oldest, total = self.buffer.oldest, self.buffer.total
 
-        #  making a named tuple for the scaled experience
-        scaled_exp = self.Scaled_Experience(scaled_obs,
-                                            exp.action,
-                                            scaled_reward,
-                                            None,
-                                            exp.step,
-                                            exp.episode,
-                                            discounted_return)
-        return scaled_exp
+        #  the absolute index tells us if the following row is newer
+        absolute = oldest + (positions - oldest) % self.buffer.capacity
+        following = (positions + 1) % self.buffer.capacity
+        episodes = self.buffer.arrays['episode'][positions]
+        has_next = ((absolute + 1) < total) & (self.buffer.arrays['episode'][following] == episodes)
 
-    def add_experience(self, observation, action, reward, next_observation, step, episode):
+        next_observations = np.empty((positions.shape[0], self.observation_dim))
+        next_observations[has_next] = self.get_observations(following[has_next])
+        for i in np.flatnonzero(~has_next):
+            next_observations[i] = self.final_observations[episodes[i]]
+        return next_observations
+
+    def get_scaled_observations(self, positions):
         """
-        Adds a single step of experience to the two experiences lists
+        Gets scaled observations from the buffer
+
+        With lazy scaling the raw observations are scaled here - the result
+        is always a copy rather than a view into the buffer
         """
-        exp = self.Experience(observation, action, reward, next_observation, step, episode)
-        self.experiences.append(exp)
+        if self.lazy_scaling:
+            return self.scale_array(self.get_observations(positions),
+                                    self.observation_space)
+
+        scaled = self.buffer.gather(positions, ['scaled_observation'])['scaled_observation']
+        return scaled.astype(np.float64, copy=False)
+
+    def index_experience(self, episode, num_rows=1):
+        """
+        Helper function for add_experience & add_episode
+
+        Updates the episode index for rows about to be added & drops
+        episodes that have been completely overwritten
+        """
+        row = self.buffer.total
+
+        if episode in self.episode_index:
+            start, end = self.episode_index[episode]
+            if end != row:
+                raise ValueError('experience for episode {} must be added '
+                                 'contiguously'.format(episode))
+            self.episode_index[episode] = (start, row + num_rows)
+        else:
+            self.episode_index[episode] = (row, row + num_rows)
+
+        #  the oldest row once these rows have been added
+        oldest = max(0, row + num_rows - self.buffer.capacity)
+        while True:
+            first = next(iter(self.episode_index))
+            if self.episode_index[first][1] > oldest:
+                break
+            del self.episode_index[first]
+            self.final_observations.pop(first, None)
 
-        scaled_exp = self.scale_experience(exp)
-        self.scaled_experiences.append(scaled_exp)
         return None
 
+    def episode_positions(self, episode_number):
+        """
+        Positions in the buffer of the held experience for one episode
+
+        A slice (so indexing gives views) unless the episode wraps around
+        the end of the buffer
+        """
+        if episode_number not in self.episode_index:
+            return slice(0, 0)
+
+        start, end = self.episode_index[episode_number]
+        return self.buffer.span(start, end)
+
+    @locked
     def process_episode(self, episode_number):
 
         """
         Calculates the discounted returns
 
-        Inefficient as we loop over the entire episode list.
-
         TODO some sort of check that episode is actually over
         """
-        #  gather the scaled experiences from the last episode
-        #  we want to get access to the scaled reward
-        episode_experiences, indicies, idx = [], [], 0
-        for idx, exp in enumerate(self.scaled_experiences, 0):
-            if exp.episode == episode_number:
-                episode_experiences.append(exp)
-                indicies.append(idx)
+        positions = self.episode_positions(episode_number)
 
-        #  we reverse our experience list so we can do an efficient backup
-        episode_experiences.reverse()
+        #  we want to use the scaled reward
+        rewards = self.buffer.arrays['scaled_reward'][positions]
 
-        #  blank array to hold the returns
-        rtns = np.zeros(len(episode_experiences))
-        scaled_episode_experiences = []
+        self.buffer.arrays['discounted_return'][positions] = discounted_returns(rewards,
+                                                                               self.discount_rate)
+        self.record_episode_stats(episode_number, positions)
+        self.mark_processed([episode_number])
+        return None
 
-        for j, exp in enumerate(episode_experiences):
+    @locked
+    def process_episodes(self, episode_numbers):
+        """
+        Calculates the discounted returns for many episodes at once
+        """
+        positions = [self.episode_positions(ep) for ep in episode_numbers]
+        rewards = [self.buffer.arrays['scaled_reward'][pos] for pos in positions]
+        lengths = [rew.shape[0] for rew in rewards]
 
-            if j == 0:
-                total_return = exp.reward
+        returns = discounted_returns(np.concatenate(rewards),
+                                     self.discount_rate,
+                                     lengths=lengths)
 
-            else:
-                total_return = exp.reward + self.discount_rate * rtns[j-1]
+        for ep, pos, rtns in zip(episode_numbers, positions,
+                                 np.split(returns, np.cumsum(lengths)[:-1])):
+            self.buffer.arrays['discounted_return'][pos] = rtns
+            self.record_episode_stats(ep, pos)
 
-            rtns[j] = total_return
+        self.mark_processed(episode_numbers)
+        return None
 
-            scaled_exp = self.Scaled_Experience(exp.observation,
-                                                exp.action,
-                                                exp.reward,
-                                                exp.next_observation,
-                                                exp.step,
-                                                exp.episode,
-                                                total_return)
+    def mark_processed(self, episode_numbers):
+        """
+        Helper function for process_episode(s) - moves processed_total past
+        the processed episodes
 
-            scaled_episode_experiences.append(scaled_exp)
+        Episodes are assumed to be processed in the order they were added
+        """
+        ends = [self.episode_index[ep][1] for ep in episode_numbers
+                if ep in self.episode_index]
+        self.processed_total = max([self.processed_total] + ends)
+        return None
 
-        #  now we use our original indicies to reindex
-        scaled_episode_experiences.reverse()
+    #  the statistics kept for each processed episode
+    episode_stat_names = ['reward', 'scaled_reward', 'length', 'discounted_return']
 
-        for k, idx in enumerate(indicies):
-            self.scaled_experiences[idx] = scaled_episode_experiences[k]
+    def record_episode_stats(self, episode_number, positions):
+        """
+        Helper function for process_episode()
 
-        assert len(self.experiences) == len(self.scaled_experiences)
+        Keeps per episode statistics as episodes finish so that episodic
+        outputs don't need all of the step level experience
+        """
+        rows = self.buffer.gather(positions, ['reward', 'scaled_reward',
+                                              'discounted_return'])
+        length = rows['reward'].shape[0]
+        first_return = rows['discounted_return'][0] if length else np.nan
 
+        self.episode_stats[episode_number] = [float(rows['reward'].sum()),
+                                              float(rows['scaled_reward'].sum()),
+                                              length,
+                                              float(first_return)]
         return None
 
     def get_random_batch(self, batch_size):
         """
         Gets a random batch of experiences.
-        """
-        sample_size = min(batch_size, len(self.scaled_experiences))
 
-        #  limiting the scaled_experiences list to the memory length
-        memory = self.experiences[-self.memory_length:]
-        scaled_memory = self.scaled_experiences[-self.memory_length:]
+        Only experience still held in the buffer (the last memory_length
+        steps) can be sampled.
+        """
+        sample_size = min(batch_size, len(self.buffer))
 
-        assert len(memory) == len(scaled_memory
-                                  )
-        #  indicies for the batch
-        indicies = np.random.randint(low=0,
-                                     high=len(memory),
-                                     size=sample_size)
+        #  all positions below len(buffer) hold experience
+        positions = np.random.randint(low=0,
+                                      high=len(self.buffer),
+                                      size=sample_size)
 
-        #  randomly sample from the memory & returns
-        memory_batch = [memory[i] for i in indicies]
-        scaled_memory_batch = [scaled_memory[i] for i in indicies]
+        batch = self.buffer.gather(positions, fields=['action',
+                                                      'discounted_return'])
 
-        observations = np.array([exp.observation for exp in scaled_memory_batch]).reshape(-1, self.observation_dim)
-        actions = np.array([exp.action for exp in memory_batch]).reshape(-1, len(self.action_space))
-        returns = np.array([exp.discounted_return for exp in scaled_memory_batch]).reshape(-1, 1)
+        observations = self.get_scaled_observations(positions).reshape(-1, self.observation_dim)
+        actions = batch['action'].reshape(-1, self.action_dim)
+        returns = batch['discounted_return'].reshape(-1, 1)
 
         assert observations.shape[0] == actions.shape[0]
         assert observations.shape[0] == returns.shape[0]
 
         return observations, actions, returns
 
+    @locked
+    def get_processed_batch(self, batch_size, prioritized=False):
+        """
+        Helper function for prefetch - a batch of experience from only
+        processed episodes (the discounted returns are known)
+
+        Uniform batches are sampled from the rows before processed_total.
+        Prioritized batches drop any sampled rows after it - so can be
+        smaller than batch_size.
+        """
+        oldest = self.buffer.oldest
+        if self.processed_total <= oldest:
+            raise ValueError('no processed experience to sample')
+
+        if prioritized:
+            batch = self.get_prioritized_batch(batch_size)
+            positions = batch[-1]
+            absolute = oldest + (positions - oldest) % self.buffer.capacity
+            keep = absolute < self.processed_total
+            return tuple(arr[keep] for arr in batch)
+
+        positions = self.buffer.position(np.random.randint(oldest, self.processed_total,
+                                                           size=batch_size))
+        batch = self.buffer.gather(positions, fields=['action',
+                                                      'discounted_return'])
+
+        observations = self.get_scaled_observations(positions).reshape(-1, self.observation_dim)
+        actions = batch['action'].reshape(-1, self.action_dim)
+        returns = batch['discounted_return'].reshape(-1, 1)
+        return observations, actions, returns
+
+    def get_prioritized_batch(self, batch_size, beta=None):
+        """
+        Gets a batch of experiences sampled in proportion to their priority.
+
+        Sampling is stratified over the total priority.  Importance sampling
+        weights correct for the non-uniform sampling & are normalized so the
+        largest weight in the batch is 1.
+
+        Args:
+            batch_size (int)   :
+            beta       (float) : importance sampling exponent (default self.beta)
+
+        Returns:
+            observations, actions, returns
+            weights   (np.array) : importance sampling weights - shape (batch_size, 1)
+            positions (np.array) : buffer positions - pass back to update_priorities
+        """
+        assert self.prioritized
+        if beta is None:
+            beta = self.beta
+
+        positions = self.priorities.sample(batch_size)
+
+        probs = self.priorities.get(positions) / self.priorities.total
+        weights = np.power(len(self.buffer) * probs, -beta)
+        weights = weights / weights.max()
+
+        batch = self.buffer.gather(positions, fields=['action',
+                                                      'discounted_return'])
+
+        observations = self.get_scaled_observations(positions).reshape(-1, self.observation_dim)
+        actions = batch['action'].reshape(-1, self.action_dim)
+        returns = batch['discounted_return'].reshape(-1, 1)
+
+        return observations, actions, returns, weights.reshape(-1, 1), positions
+
+    def get_transition_batch(self, batch_size, prioritized=False, beta=None, scaled=True):
+        """
+        Gets a batch of single step transitions for bootstrapped (TD)
+        learning - i.e. Q-Learning
+
+        Sampled uniformly or (with prioritized) in proportion to priority.
+        Uniform batches have weights of 1.
+
+        Args:
+            batch_size  (int)   :
+            prioritized (bool)  : sample using the priorities
+            beta        (float) : importance sampling exponent (default self.beta)
+            scaled      (bool)  : scale the observations
+
+        Returns:
+            observations, actions, rewards, next_observations, dones - see get_transitions
+            weights   (np.array) : importance sampling weights - (batch_size,)
+            positions (np.array) : buffer positions - pass back to update_priorities
+        """
+        if prioritized:
+            assert self.prioritized
+            if beta is None:
+                beta = self.beta
+            positions = self.priorities.sample(batch_size)
+
+            probs = self.priorities.get(positions) / self.priorities.total
+            weights = np.power(len(self.buffer) * probs, -beta)
+            weights = weights / weights.max()
+        else:
+            positions = np.random.randint(low=0,
+                                          high=len(self.buffer),
+                                          size=min(batch_size, len(self.buffer)))
+            weights = np.ones(positions.shape[0])
+
+        return self.get_transitions(positions, scaled) + (weights, positions)
+
+    def get_transitions(self, positions, scaled=True):
+        """
+        Gets the single step transitions held at positions in the buffer
+
+        Args:
+            positions (np.array) : i.e. from buffer.chronological()
+            scaled    (bool)     : scale the observations
+
+        Returns:
+            observations      (np.array) : (num_samples, observation_dim)
+            actions           (np.array) : (num_samples, action_dim)
+            rewards           (np.array) : scaled - (num_samples,)
+            next_observations (np.array) : (num_samples, observation_dim)
+            dones             (np.array) : bool - (num_samples,)
+        """
+        batch = self.buffer.gather(positions, fields=['action',
+                                                      'scaled_reward',
+                                                      'done'])
+
+        if scaled:
+            observations = self.get_scaled_observations(positions)
+            next_observations = self.scale_array(self.get_next_observations(positions),
+                                                 self.observation_space)
+        else:
+            observations = self.get_observations(positions)
+            next_observations = self.get_next_observations(positions)
+
+        return (observations.reshape(-1, self.observation_dim),
+                batch['action'].reshape(-1, self.action_dim),
+                batch['scaled_reward'],
+                next_observations.reshape(-1, self.observation_dim),
+                batch['done'])
+
+    @locked
+    def update_priorities(self, positions, errors, epsilon=1e-6):
+        """
+        Sets the priority of sampled experience from its error (i.e. TD error)
+
+        Args:
+            positions (np.array) : positions returned by get_prioritized_batch
+            errors    (np.array) : errors for each position
+            epsilon   (float)    : keeps all priorities above zero
+        """
+        priorities = np.abs(np.asarray(errors, dtype=np.float64)).reshape(-1) + epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.priorities.update(positions, np.power(priorities, self.alpha))
+        return None
+
     def get_episode_batch(self, episode_number):
         """
         Gets the experiences for a given episode.
 
-        Quite inefficient as we loop over the entire scaled experiences list.
+        The arrays returned are views into the buffer unless the episode
+        wraps around the end of the buffer - copy them before modifying.
         """
-        scl_episode_experiences = []
+        positions = self.episode_positions(episode_number)
 
-        for scl_exp in self.scaled_experiences:
-            if scl_exp.episode == episode_number:
-                scl_episode_experiences.append(scl_exp)
-                assert scl_exp.episode == episode_number
+        batch = self.buffer.gather(positions, fields=['action',
+                                                      'discounted_return'])
 
-        observations = np.array([exp.observation for exp in scl_episode_experiences]).reshape(-1, len(self.observation_space))
-        actions = np.array([exp.action for exp in scl_episode_experiences]).reshape(-1, len(self.action_space))
-        returns = np.array([exp.discounted_return for exp in scl_episode_experiences]).reshape(-1, 1)
+        observations = self.get_scaled_observations(positions).reshape(-1, self.observation_dim)
+        actions = batch['action'].reshape(-1, self.action_dim)
+        returns = batch['discounted_return'].reshape(-1, 1)
 
         assert observations.shape[0] == actions.shape[0]
         assert observations.shape[0] == returns.shape[0]
 
         return observations, actions, returns
+
+    def prefetch(self, batch_size, queue_size=4, num_batches=None,
+                 prioritized=False, dtype=np.float32):
+        """
+        Starts a background thread sampling batches - see Batch_Prefetcher
+
+        Safe while experience is added & processed - batches are sampled
+        holding the memory lock & only from processed episodes (see
+        get_processed_batch)
+
+        Args:
+            batch_size  (int)   :
+            queue_size  (int)   : number of batches held ready
+            num_batches (int)   : stop after this many batches (None = never)
+            prioritized (bool)  : use get_prioritized_batch
+            dtype       (dtype) : dtype for the floating point arrays
+
+        Returns:
+            batches (Batch_Prefetcher) : iterator over batches
+        """
+        sample = functools.partial(self.get_processed_batch, prioritized=prioritized)
+        return Batch_Prefetcher(sample,
+                                batch_size,
+                                queue_size=queue_size,
+                                num_batches=num_batches,
+                                dtype=dtype)
+
+    @locked
+    def dump(self):
+        """
+        The state needed to write the held experience - see write_dump
+
+        The rows are not copied, so this is cheap for any memory_length.
+        Only the small per episode state is copied.
+
+        Returns:
+            dump (dict) : start & end absolute rows held, metadata (JSON
+                          serializable) & final_observations
+        """
+        dump = {'start': self.buffer.oldest,
+                'end': self.buffer.total,
+                'episode_index': list(self.episode_index.items()),
+                'metadata': {'memory_length': self.memory_length,
+                             'discount_rate': self.discount_rate,
+                             'compact': self.compact,
+                             'lazy_scaling': self.lazy_scaling,
+                             'fields': {name: {'shape': list(shape),
+                                               'dtype': np.dtype(dtype).str}
+                                        for name, (shape, dtype) in self.buffer.fields.items()},
+                             'losses': [float(loss) for loss in self.losses],
+                             'episode_stats': [[int(ep)] + list(stats)
+                                               for ep, stats in self.episode_stats.items()]}}
+
+        if self.compact:
+            episodes = [int(ep) for ep in self.episode_index]
+            dump['metadata']['final_episodes'] = episodes
+            dump['final_observations'] = np.array([self.final_observations[ep] for ep in episodes],
+                                                  dtype=self.observation_dtype).reshape(-1, self.observation_dim)
+
+        if self.prioritized:
+            dump['metadata']['max_priority'] = float(self.max_priority)
+
+        return dump
+
+    def write_dump(self, path, dump, chunk_rows=2 ** 16):
+        """
+        Writes the experience of a dump into the directory path
+
+        The rows are copied chunk by chunk, holding the lock only while a
+        chunk is copied - so experience can still be added while a
+        background thread writes (i.e. a Checkpointer).  Rows are written
+        newest first.  Rows overwritten before they are written (a full
+        buffer that is still being added to) are dropped, so the saved
+        memory starts at the oldest row written.
+
+        Args:
+            path       (str)  :
+            dump       (dict) : from dump()
+            chunk_rows (int)  : rows copied per chunk
+        """
+        ensure_dir(os.path.join(path, 'metadata.json'))
+        start, end = dump['start'], dump['end']
+        metadata = dict(dump['metadata'])
+
+        names = list(metadata['fields'])
+        if self.prioritized:
+            names.append('priorities')
+
+        files = {}
+        for name in names:
+            if name == 'priorities':
+                shape, dtype = (), np.float64
+            else:
+                shape, dtype = metadata['fields'][name]['shape'], metadata['fields'][name]['dtype']
+            file_path = os.path.join(path, '{}.npy'.format(name))
+            if end == start:
+                #  an empty file can't be memory-mapped
+                np.save(file_path, np.zeros((0,) + tuple(shape), dtype=dtype))
+                continue
+            files[name] = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype,
+                                                    shape=(end - start,) + tuple(shape))
+
+        first = end
+        while first > start:
+            with self.lock:
+                chunk_start = max(first - chunk_rows, start, self.buffer.oldest)
+                if chunk_start >= first:
+                    break
+                positions = self.buffer.span(chunk_start, first)
+                rows = {name: np.array(arr) for name, arr in
+                        self.buffer.gather(positions, metadata['fields']).items()}
+                if self.prioritized:
+                    rows['priorities'] = self.priorities.get(self.buffer.position(np.arange(chunk_start, first)))
+
+            for name, arr in rows.items():
+                files[name][chunk_start - start:first - start] = arr
+            first = chunk_start
+
+        for arr in files.values():
+            arr.flush()
+        del files
+
+        if 'final_observations' in dump:
+            np.save(os.path.join(path, 'final_observations.npy'), dump['final_observations'])
+
+        #  rows before first were overwritten - read_memory skips them
+        metadata['skip'] = int(first - start)
+        metadata['count'] = int(end - first)
+        metadata['episode_index'] = [[int(ep), int(max(ep_start, first) - first), int(ep_end - first)]
+                                     for ep, (ep_start, ep_end) in dump['episode_index']
+                                     if ep_end > first]
+
+        with open(os.path.join(path, 'metadata.json'), 'w') as handle:
+            json.dump(metadata, handle, indent=2)
+        return None
+
+    def save(self, path):
+        """
+        Saves the held experience into the directory path
+
+        Columnar layout - one .npy file per field with rows ordered oldest
+        to newest, plus metadata.json.  See read_memory to use a saved
+        memory as a dataset outside of Agent_Memory.
+        """
+        return self.write_dump(path, self.dump())
+
+    @locked
+    def load(self, path, mmap=True):
+        """
+        Loads experience saved with save() - replacing the held experience
+
+        The saved memory must have the same layout (fields, shapes & dtypes).
+        If it was saved without priorities a prioritized memory gives every
+        loaded row the maximum priority.
+
+        Args:
+            path (str)  : directory the memory was saved into
+            mmap (bool) : True  = memory-map the saved files without copying.
+                                  The memory is read only - it can be sampled
+                                  but not added to.
+                          False = copy the saved rows into the buffer (only
+                                  the newest memory_length rows are kept)
+        """
+        metadata, arrays = read_memory(path, mmap=mmap)
+
+        fields = {name: {'shape': list(shape), 'dtype': np.dtype(dtype).str}
+                  for name, (shape, dtype) in self.make_fields().items()}
+        if fields != metadata['fields']:
+            raise ValueError('saved memory at {} has a different layout'.format(path))
+
+        count = metadata['count']
+        self.reset()
+
+        if mmap and count > 0:
+            self.set_buffer(Ring_Buffer(capacity=count,
+                                        fields=self.make_fields(),
+                                        arrays=arrays))
+            self.buffer.total = count
+            self.read_only = True
+            first = 0
+        else:
+            #  only the newest rows fit into the buffer
+            first = max(0, count - self.buffer.capacity)
+            for name, arr in arrays.items():
+                if name in self.buffer.arrays:
+                    self.buffer.arrays[name][:count - first] = arr[first:]
+            self.buffer.total = count - first
+
+        for ep, start, end in metadata['episode_index']:
+            if end > first:
+                self.episode_index[ep] = (max(start, first) - first, end - first)
+
+        if self.compact:
+            for ep, final in zip(metadata['final_episodes'], arrays['final_observations']):
+                if ep in self.episode_index:
+                    self.final_observations[ep] = np.array(final)
+
+        if self.prioritized:
+            self.priorities = Sum_Tree(max(self.memory_length, self.buffer.capacity))
+            if 'priorities' in arrays:
+                self.priorities.update(np.arange(count - first), arrays['priorities'][first:])
+                self.max_priority = metadata['max_priority']
+            else:
+                #  saved without prioritized replay - like new experience
+                self.priorities.update(np.arange(count - first), self.max_priority ** self.alpha)
+
+        self.losses = list(metadata['losses'])
+        for row in metadata['episode_stats']:
+            self.episode_stats[row[0]] = row[1:]
+        self.mark_processed([ep for ep in self.episode_index if ep in self.episode_stats])
+        return None
+
+
+def read_memory(path, mmap=True):
+    """
+    Reads a memory saved by Agent_Memory.save() as a dataset
+
+    Args:
+        path (str)  : directory the memory was saved into
+        mmap (bool) : memory-map the files (read only) rather than reading
+
+    Returns:
+        metadata (dict) :
+        arrays   (dict) : name -> array for each saved file
+    """
+    with open(os.path.join(path, 'metadata.json')) as handle:
+        metadata = json.load(handle)
+
+    mmap_mode = 'r' if mmap else None
+    arrays = collections.OrderedDict()
+    for name in list(metadata['fields']) + ['final_observations', 'priorities']:
+        file_path = os.path.join(path, '{}.npy'.format(name))
+        if os.path.exists(file_path):
+            arrays[name] = np.load(file_path, mmap_mode=mmap_mode)
+            #  leading rows overwritten while the memory was written
+            if name != 'final_observations':
+                arrays[name] = arrays[name][metadata.get('skip', 0):]
+
+    return metadata, arrays
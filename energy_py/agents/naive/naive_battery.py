@@ -55,12 +55,26 @@ class Naive_Battery_Agent(Base_Agent):
 
         return np.array(action)
 
+    def _act_batch(self, observations, session=None, epsilon=None):
+        """
+        The same rules as _act for many observations at once
+
+        Args:
+            observations (np.array) : shape (num_observations, observation_dim)
+        """
+        hour = observations[:, 4]
+        discharge = ((hour >= 6) & (hour < 10)) | ((hour >= 15) & (hour < 21))
+
+        charge_action = np.array([self.action_space[0].high, self.action_space[1].low])
+        discharge_action = np.array([self.action_space[0].low, self.action_space[1].high])
+        return np.where(discharge[:, np.newaxis], discharge_action, charge_action)
+
     def _learn(self):
         print('I am an agent based on a human desgined heuristic')
         print('I cannot learn anything')
         return None
 
-    def _load_brain(self):
+    def _load_brain(self, path=None, session=None):
         print('I am an agent based on a human desgined heuristic')
         print('I have no brain')
         return None
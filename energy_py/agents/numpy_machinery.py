@@ -0,0 +1,359 @@
+"""
+NumPy versions of the TensorFlow machinery.
+
+A Gaussian policy network & a Q-network with hand written gradients & an
+Adam optimizer.  For small networks on CPU this avoids the overhead of a TensorFlow session
+(and of importing TensorFlow at all).
+"""
+
+import collections
+
+import numpy as np
+
+#  the layers of the policy network - same names as the TensorFlow graph
+LAYERS = ['input_layer', 'hidden_layer_1', 'hidden_layer_2', 'output_layer']
+
+
+def make_network_params(input_dim, output_dim, hidden_dim=None):
+    """
+    Creates the parameters of a fully connected network
+
+    Same architecture & initialization as the TensorFlow graphs
+        input_layer    : input_dim -> input_dim (relu)
+        hidden_layer_1 : input_dim -> hidden_dim (relu)
+        hidden_layer_2 : hidden_dim -> hidden_dim (relu)
+        output_layer   : hidden_dim -> output_dim (linear)
+
+    Args:
+        input_dim  (int) :
+        output_dim (int) :
+        hidden_dim (int) : default is 2 * input_dim
+
+    Returns:
+        params (OrderedDict) : 'layer/W' & 'layer/b' -> np.array
+    """
+    if hidden_dim is None:
+        hidden_dim = 2 * input_dim
+
+    sizes = [input_dim, input_dim, hidden_dim, hidden_dim, output_dim]
+    params = collections.OrderedDict()
+    for layer, n_in, n_out in zip(LAYERS, sizes[:-1], sizes[1:]):
+        params['{}/W'.format(layer)] = np.random.uniform(-1, 1, size=(n_in, n_out))
+        params['{}/b'.format(layer)] = np.zeros(n_out)
+    return params
+
+
+def network_forward(params, inputs):
+    """
+    Forward pass of a network made by make_network_params
+
+    Returns:
+        output      (np.array) : (num_samples, output_dim)
+        activations (list)     : input of each layer - for network_backward
+    """
+    activations = [inputs]
+    hidden = inputs
+    for layer in LAYERS[:-1]:
+        hidden = np.maximum(hidden.dot(params['{}/W'.format(layer)]) + params['{}/b'.format(layer)], 0)
+        activations.append(hidden)
+
+    output = hidden.dot(params['output_layer/W']) + params['output_layer/b']
+    return output, activations
+
+
+def network_backward(params, activations, d_output):
+    """
+    Backpropagates the gradient of a loss wrt the network output
+
+    Returns:
+        gradients (dict) : name -> gradient of the loss for each param
+    """
+    gradients = {}
+    d_hidden = d_output
+    for i, layer in reversed(list(enumerate(LAYERS))):
+        layer_input = activations[i]
+        gradients['{}/W'.format(layer)] = layer_input.T.dot(d_hidden)
+        gradients['{}/b'.format(layer)] = d_hidden.sum(axis=0)
+        if i > 0:
+            #  back through the relu of the previous layer
+            d_hidden = d_hidden.dot(params['{}/W'.format(layer)].T) * (layer_input > 0)
+    return gradients
+
+
+def adam_update(params, gradients, m, v, t, learning_rate,
+                beta1=0.9, beta2=0.999, epsilon=1e-8):
+    """
+    A single Adam step - params, m & v are updated in place
+
+    Defaults are the TensorFlow defaults.  t is the step count including
+    this step.
+    """
+    lr = learning_rate * np.sqrt(1 - beta2 ** t) / (1 - beta1 ** t)
+    for name, grad in gradients.items():
+        m[name] = beta1 * m[name] + (1 - beta1) * grad
+        v[name] = beta2 * v[name] + (1 - beta2) * np.square(grad)
+        params[name] -= lr * m[name] / (np.sqrt(v[name]) + epsilon)
+    return None
+
+
+def make_policy_params(observation_dim, num_actions, hidden_dim=None):
+    """
+    Creates the parameters of a Gaussian policy network
+
+    The output layer has 2 * num_actions units (mean, stdev pairs) - see
+    make_network_params
+
+    Returns:
+        params (OrderedDict) : 'layer/W' & 'layer/b' -> np.array
+    """
+    return make_network_params(observation_dim, 2 * num_actions, hidden_dim)
+
+
+def policy_forward(params, observations, cache=False):
+    """
+    Forward pass of the policy network
+
+    Args:
+        params       (dict)     : from make_policy_params
+        observations (np.array) : scaled observations (num_obs, observation_dim)
+        cache        (bool)     : also return the activations for backprop
+
+    Returns:
+        means  (np.array) : (num_obs, num_actions)
+        stdevs (np.array) : (num_obs, num_actions) - clipped above zero
+    """
+    output, activations = network_forward(params, observations)
+
+    means = output[:, 0::2]
+    raw_stdevs = output[:, 1::2]
+    stdevs = np.clip(raw_stdevs, 1e-10, max(raw_stdevs.max(), 1e-10))
+
+    if cache:
+        return means, stdevs, (activations, raw_stdevs)
+    return means, stdevs
+
+
+def gaussian_log_prob(actions, means, stdevs):
+    """
+    log of the Gaussian probability density - clipped to [1e-10, 1] as in
+    the TensorFlow loss
+    """
+    probs = np.exp(-0.5 * np.square((actions - means) / stdevs)) / (stdevs * np.sqrt(2 * np.pi))
+    return np.log(np.clip(probs, 1e-10, 1)), probs
+
+
+class Numpy_Gaussian_Policy(object):
+    """
+    A Gaussian policy network trained with the score function (REINFORCE)
+
+        loss = mean(-log(prob(taken_action)) * discounted_return)
+
+    Args:
+        observation_dim (int)      :
+        num_actions     (int)      :
+        action_low      (np.array) : actions are clipped to these bounds
+        action_high     (np.array) :
+        learning_rate   (float)    : Adam learning rate
+        hidden_dim      (int)      : default is 2 * observation_dim
+    """
+    def __init__(self, observation_dim,
+                       num_actions,
+                       action_low,
+                       action_high,
+                       learning_rate = 0.01,
+                       hidden_dim    = None):
+
+        self.observation_dim = observation_dim
+        self.num_actions     = num_actions
+        self.action_low      = np.asarray(action_low, dtype=np.float64)
+        self.action_high     = np.asarray(action_high, dtype=np.float64)
+        self.learning_rate   = learning_rate
+
+        self.params = make_policy_params(observation_dim, num_actions, hidden_dim)
+
+        #  Adam optimizer state - TensorFlow defaults
+        self.beta1, self.beta2, self.epsilon = 0.9, 0.999, 1e-8
+        self.m = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self.v = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self.t = 0
+
+    def sample(self, observations):
+        """
+        Samples actions for a batch of scaled observations
+        """
+        means, stdevs = policy_forward(self.params, observations)
+        actions = means + stdevs * np.random.standard_normal(means.shape)
+        return np.clip(actions, self.action_low, self.action_high)
+
+    def loss_and_gradients(self, observations, actions, discounted_returns):
+        """
+        Returns:
+            loss      (float) :
+            gradients (dict)  : name -> gradient of the loss for each param
+        """
+        means, stdevs, (activations, raw_stdevs) = policy_forward(self.params,
+                                                                  observations,
+                                                                  cache=True)
+        log_probs, probs = gaussian_log_prob(actions, means, stdevs)
+        returns = np.asarray(discounted_returns).reshape(-1, 1)
+        loss = np.mean(-log_probs * returns)
+
+        #  d loss / d log_prob - zero where the probability was clipped
+        d_log_prob = -returns / log_probs.size * ((probs > 1e-10) & (probs < 1))
+
+        z = (actions - means) / stdevs
+        d_means = d_log_prob * z / stdevs
+        d_stdevs = d_log_prob * (np.square(z) - 1) / stdevs
+        d_stdevs = d_stdevs * (raw_stdevs > 1e-10)
+
+        d_output = np.empty((means.shape[0], 2 * self.num_actions))
+        d_output[:, 0::2] = d_means
+        d_output[:, 1::2] = d_stdevs
+
+        gradients = network_backward(self.params, activations, d_output)
+        return loss, gradients
+
+    def train_step(self, observations, actions, discounted_returns):
+        """
+        A single Adam step - returns the loss
+        """
+        loss, gradients = self.loss_and_gradients(observations, actions, discounted_returns)
+
+        self.t += 1
+        adam_update(self.params, gradients, self.m, self.v, self.t,
+                    self.learning_rate, self.beta1, self.beta2, self.epsilon)
+
+        return loss
+
+    def get_state(self):
+        """
+        Copies of the parameters & optimizer state - name -> np.array
+        """
+        state = collections.OrderedDict()
+        for name in self.params:
+            state[name] = self.params[name].copy()
+            state['adam_m/{}'.format(name)] = self.m[name].copy()
+            state['adam_v/{}'.format(name)] = self.v[name].copy()
+        state['adam_t'] = np.array(self.t)
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the output of get_state
+        """
+        for name in self.params:
+            self.params[name][...] = state[name]
+            self.m[name][...] = state['adam_m/{}'.format(name)]
+            self.v[name][...] = state['adam_v/{}'.format(name)]
+        self.t = int(state['adam_t'])
+
+
+class Numpy_Q_Network(object):
+    """
+    A Q-network over a discrete set of actions with a target network
+
+    One forward pass gives the Q values of every action.  Trained on the
+    Huber loss of the TD error for the taken action, weighted by importance
+    sampling weights when learning from prioritized experience.
+
+    Args:
+        observation_dim (int)   :
+        num_outputs     (int)   : number of discrete actions
+        learning_rate   (float) : Adam learning rate
+        hidden_dim      (int)   : default is 2 * observation_dim
+    """
+    def __init__(self, observation_dim,
+                       num_outputs,
+                       learning_rate = 0.001,
+                       hidden_dim    = None):
+
+        self.observation_dim = observation_dim
+        self.num_outputs     = num_outputs
+        self.learning_rate   = learning_rate
+
+        self.params = make_network_params(observation_dim, num_outputs, hidden_dim)
+        self.target_params = collections.OrderedDict((name, p.copy())
+                                                     for name, p in self.params.items())
+
+        #  Adam optimizer state - TensorFlow defaults
+        self.beta1, self.beta2, self.epsilon = 0.9, 0.999, 1e-8
+        self.m = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self.v = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self.t = 0
+
+    def predict(self, observations, target=False):
+        """
+        Q values for a batch of scaled observations - (num_obs, num_outputs)
+        """
+        params = self.target_params if target else self.params
+        return network_forward(params, observations)[0]
+
+    def train_step(self, observations, action_indexes, targets, weights=None):
+        """
+        A single Adam step
+
+        Args:
+            observations   (np.array) : scaled observations (num_obs, observation_dim)
+            action_indexes (np.array) : index of the taken action (num_obs,)
+            targets        (np.array) : TD targets (num_obs,)
+            weights        (np.array) : importance sampling weights (num_obs,)
+
+        Returns:
+            loss      (float)    :
+            td_errors (np.array) : (num_obs,)
+        """
+        num_obs = observations.shape[0]
+        rows = np.arange(num_obs)
+        if weights is None:
+            weights = np.ones(num_obs)
+        weights = np.asarray(weights).reshape(-1)
+
+        q_values, activations = network_forward(self.params, observations)
+        td_errors = q_values[rows, action_indexes] - np.asarray(targets).reshape(-1)
+
+        #  Huber loss - quadratic inside [-1, 1], linear outside
+        abs_errors = np.abs(td_errors)
+        huber = np.where(abs_errors < 1, 0.5 * np.square(td_errors), abs_errors - 0.5)
+        loss = np.mean(weights * huber)
+
+        d_output = np.zeros_like(q_values)
+        d_output[rows, action_indexes] = weights * np.clip(td_errors, -1, 1) / num_obs
+
+        gradients = network_backward(self.params, activations, d_output)
+        self.t += 1
+        adam_update(self.params, gradients, self.m, self.v, self.t,
+                    self.learning_rate, self.beta1, self.beta2, self.epsilon)
+
+        return loss, td_errors
+
+    def update_target(self):
+        """
+        Copies the online network parameters into the target network
+        """
+        for name, p in self.params.items():
+            self.target_params[name][...] = p
+        return None
+
+    def get_state(self):
+        """
+        Copies of the parameters & optimizer state - name -> np.array
+        """
+        state = collections.OrderedDict()
+        for name in self.params:
+            state[name] = self.params[name].copy()
+            state['target/{}'.format(name)] = self.target_params[name].copy()
+            state['adam_m/{}'.format(name)] = self.m[name].copy()
+            state['adam_v/{}'.format(name)] = self.v[name].copy()
+        state['adam_t'] = np.array(self.t)
+        return state
+
+    def set_state(self, state):
+        """
+        Restores the output of get_state
+        """
+        for name in self.params:
+            self.params[name][...] = state[name]
+            self.target_params[name][...] = state['target/{}'.format(name)]
+            self.m[name][...] = state['adam_m/{}'.format(name)]
+            self.v[name][...] = state['adam_v/{}'.format(name)]
+        self.t = int(state['adam_t'])
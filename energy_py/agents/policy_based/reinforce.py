@@ -13,11 +13,35 @@ This algorithm requires lots of episodes to run:
 
 """
 
+import collections
+
 import numpy as np
-import tensorflow as tf
 
 from energy_py.agents.agent_core import Base_Agent
-from energy_py.agents.tensorflow_machinery import fc_layer
+from energy_py.agents.numpy_machinery import Numpy_Gaussian_Policy
+from energy_py.agents.policy_export import export_policy, load_policy
+
+#  set by _tf - TensorFlow is only imported by the tensorflow backend
+tf = None
+fc_layer = None
+
+
+def _tf():
+    """
+    Imports TensorFlow on first use
+
+    The numpy backend never imports it - i.e. a spawned worker running a
+    numpy agent starts without the TensorFlow import
+    """
+    global tf, fc_layer
+    if tf is None:
+        try:
+            import tensorflow
+            from energy_py.agents.tensorflow_machinery import fc_layer as tf_fc_layer
+        except ImportError:
+            raise ImportError('TensorFlow is not installed - use backend=\'numpy\'')
+        tf, fc_layer = tensorflow, tf_fc_layer
+    return tf
 
 
 class REINFORCE_Agent(Base_Agent):
@@ -25,17 +49,50 @@ class REINFORCE_Agent(Base_Agent):
     REINFORCE agent.
 
     Able to control over a single continuous action space.
+
+    backend = 'tensorflow' : policy network is a TensorFlow graph
+              'numpy'      : the same network in NumPy (Numpy_Gaussian_Policy)
+                             - no TensorFlow needed, the session args are
+                             ignored.  Much lower latency for small networks
+                             on CPU.
+
+    hidden_dim is the width of the hidden layers (default 2 * observation_dim)
+
+    memory_kwargs are optional args for Agent_Memory (i.e. lazy_scaling,
+    compact, prioritized, backend='memmap' or observation_dtype)
     """
     def __init__(self, env,
                        epsilon_decay_steps,
                        learning_rate = 0.01,
-                       batch_size    = 64):
+                       batch_size    = 64,
+                       backend       = 'tensorflow',
+                       hidden_dim    = None,
+                       memory_kwargs = None):
 
         #  passing the environment to the Base_Agent class
-        super().__init__(env, epsilon_decay_steps)
+        super().__init__(env, epsilon_decay_steps, memory_kwargs=memory_kwargs)
 
         self.learning_rate   = learning_rate
         self.batch_size      = batch_size
+        self.backend         = backend
+        self.hidden_dim      = hidden_dim or 2 * self.observation_dim
+
+        #  bounds used to clip & randomly sample actions
+        self.action_low = np.array([space.low for space in self.action_space])
+        self.action_high = np.array([space.high for space in self.action_space])
+
+        if self.backend == 'numpy':
+            self.policy = Numpy_Gaussian_Policy(self.observation_dim,
+                                                self.num_actions,
+                                                self.action_low,
+                                                self.action_high,
+                                                learning_rate=self.learning_rate,
+                                                hidden_dim=self.hidden_dim)
+            return None
+
+        if self.backend != 'tensorflow':
+            raise ValueError('unknown backend {}'.format(self.backend))
+        _tf()
 
         #  initialize the TensorFlow machinery
         with tf.name_scope('policy_network'):
@@ -61,16 +118,16 @@ class REINFORCE_Agent(Base_Agent):
                 input_layer = fc_layer(self.observation, [self.observation_dim, self.observation_dim], [self.observation_dim], tf.nn.relu)
 
             with tf.variable_scope('hidden_layer_1'):
-                hidden_layer_1 = fc_layer(input_layer, [self.observation_dim, self.observation_dim * 2], [self.observation_dim*2], tf.nn.relu)
+                hidden_layer_1 = fc_layer(input_layer, [self.observation_dim, self.hidden_dim], [self.hidden_dim], tf.nn.relu)
 
             with tf.variable_scope('hidden_layer_2'):
-                hidden_layer_2 = fc_layer(hidden_layer_1, [self.observation_dim*2, self.observation_dim*2], [self.observation_dim*2], tf.nn.relu)
+                hidden_layer_2 = fc_layer(hidden_layer_1, [self.hidden_dim, self.hidden_dim], [self.hidden_dim], tf.nn.relu)
 
             #with tf.variable_scope('hidden_layer_3'):
                 #hidden_layer_3 = fc_layer(hidden_layer_2, [self.obser, 2000], [2000], tf.nn.relu)
 
             with tf.variable_scope('output_layer'):
-                self.output_layer = fc_layer(hidden_layer_2, [self.observation_dim*2, output_dim], [output_dim])
+                self.output_layer = fc_layer(hidden_layer_2, [self.hidden_dim, output_dim], [output_dim])
 
             #  parameterizing normal distributions
             #  indexes for the output layer
@@ -89,9 +146,7 @@ class REINFORCE_Agent(Base_Agent):
             self.action = self.norm_dist.sample(1)
 
             #  clipping the action
-            lows = np.array([space.low for space in self.action_space])
-            highs = np.array([space.high for space in self.action_space])
-            self.action = tf.clip_by_value(self.action, lows, highs)
+            self.action = tf.clip_by_value(self.action, self.action_low, self.action_high)
 
         #  using the score function to calculate the loss
         with tf.variable_scope('learning'):
@@ -110,7 +165,7 @@ class REINFORCE_Agent(Base_Agent):
 
             #  creating the training step
             self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
-            self.train_step = self.optimizer.minimize(self.loss)
+            self.train_step_op = self.optimizer.minimize(self.loss)
 
         return None
 
@@ -150,10 +205,55 @@ class REINFORCE_Agent(Base_Agent):
         assert scaled_observation.shape[0] == 1
 
         #  generating an action from the policy network
-        action = session.run(self.action, {self.observation : scaled_observation})
+        action = self.policy_actions(scaled_observation, session)
         action = action.reshape(self.num_actions)
         return action
 
+    def _act_batch(self, observations, session, epsilon):
+        """
+        Selects actions for a batch of observations with a single
+        session.run
+
+        Exploration is decided per observation - rows that explore have
+        their greedy action replaced with a random action.
+
+        Args:
+            observations (np.array) : shape (num_observations, observation_dim)
+
+        Returns:
+            actions (np.array) : shape (num_observations, num_actions)
+        """
+        num_obs = observations.shape[0]
+        scaled_observations = self.memory.scale_array(observations,
+                                                      self.observation_space)
+
+        actions = self.policy_actions(scaled_observations, session)
+        actions = actions.reshape(num_obs, self.num_actions)
+
+        explore = np.random.uniform(size=num_obs) <= epsilon
+        if explore.any():
+            actions[explore] = self.random_actions(int(explore.sum()))
+        return actions
+
+    def policy_actions(self, scaled_observations, session):
+        """
+        Samples actions from the policy network for scaled observations
+        """
+        if self.backend == 'numpy':
+            return self.policy.sample(scaled_observations)
+
+        return session.run(self.action, {self.observation : scaled_observations})
+
+    def random_actions(self, num_actions):
+        """
+        Helper function for _act_batch
+
+        Samples many random actions at once
+        """
+        return np.random.uniform(low=self.action_low,
+                                 high=self.action_high,
+                                 size=(num_actions, self.num_actions))
+
     def random_action(self):
         """
         Helper function for _act
@@ -170,15 +270,156 @@ class REINFORCE_Agent(Base_Agent):
         assert len(self.action_space) == action.shape[0]
         return action
 
-    def _learn(self, observations, actions, discounted_returns, session):
+    def train_step(self, observations, actions, discounted_returns, session):
+        """
+        A single gradient step - returns the loss
+        """
+        if self.backend == 'numpy':
+            return self.policy.train_step(observations, actions, discounted_returns)
 
         feed_dict = {self.observation : observations,
                      self.taken_action : actions,
                      self.discounted_return : discounted_returns}
 
-        _, loss = session.run([self.train_step, self.loss], feed_dict)
+        _, loss = session.run([self.train_step_op, self.loss], feed_dict)
+        return loss
+
+    def _learn(self, observations, actions, discounted_returns, session):
+
+        loss = self.train_step(observations, actions, discounted_returns, session)
         self.memory.losses.append(loss)
 
         print('loss is {} - mean discounted returns were {}'.format(float(loss), np.mean(discounted_returns)))
-        
+
         return loss
+
+    def learn_episodes(self, episode_numbers,
+                             session,
+                             epochs    = 4,
+                             max_steps = None,
+                             normalize = True):
+        """
+        Learns from many episodes (i.e. from run_parallel_episodes) using
+        shuffled minibatches of batch_size.
+
+        Returns are normalized across all of the episodes - the mean return
+        is used as a baseline & we divide by the standard deviation.
+
+        Args:
+            episode_numbers (list)       : episodes held in memory
+            session         (tf.Session) :
+            epochs          (int)        : passes over the experience
+            max_steps       (int)        : budget of gradient steps (None = no limit)
+            normalize       (bool)       : normalize the returns
+
+        Returns:
+            losses (list) : loss for each gradient step
+        """
+        batches = [self.memory.get_episode_batch(ep) for ep in episode_numbers]
+        observations = np.concatenate([batch[0] for batch in batches])
+        actions = np.concatenate([batch[1] for batch in batches])
+        returns = np.concatenate([batch[2] for batch in batches])
+
+        assert not np.any(np.isnan(returns))
+        if normalize:
+            returns = (returns - returns.mean()) / (returns.std() + 1e-8)
+
+        num_samples = observations.shape[0]
+        losses = []
+        for epoch in range(epochs):
+            order = np.random.permutation(num_samples)
+            for start in range(0, num_samples, self.batch_size):
+                if max_steps is not None and len(losses) >= max_steps:
+                    break
+                idx = order[start:start + self.batch_size]
+                losses.append(self.train_step(observations[idx],
+                                              actions[idx],
+                                              returns[idx],
+                                              session))
+
+        #  memory keeps one loss per episode
+        mean_loss = float(np.mean(losses)) if losses else np.nan
+        self.memory.losses.extend([mean_loss] * len(episode_numbers))
+
+        print('{} gradient steps over {} episodes - mean loss is {}'.format(len(losses),
+                                                                            len(episode_numbers),
+                                                                            mean_loss))
+        return losses
+
+    def get_policy_params(self, session=None):
+        """
+        The policy network parameters as 'layer/W' & 'layer/b' -> np.array
+        """
+        if self.backend == 'numpy':
+            return collections.OrderedDict((name, value.copy())
+                                           for name, value in self.policy.params.items())
+
+        variables = self.policy_variables()
+        names = [var.op.name.replace('prediction/', '', 1) for var in variables]
+        return collections.OrderedDict(zip(names, session.run(variables)))
+
+    def set_policy_params(self, params, session=None):
+        """
+        Sets the policy network parameters from 'layer/W' & 'layer/b' arrays
+        """
+        if self.backend == 'numpy':
+            for name, value in params.items():
+                self.policy.params[name][...] = value
+            return None
+
+        for var in self.policy_variables():
+            var.load(params[var.op.name.replace('prediction/', '', 1)], session)
+        return None
+
+    def policy_variables(self):
+        """
+        The W & b variables of the policy network - the optimizer slots
+        (i.e. Adam moments) in the same scope are not policy parameters
+        """
+        return tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope='prediction/')
+
+    def export_policy(self, path, session=None):
+        """
+        Writes the trained policy to a self-contained artifact
+
+        The artifact can be loaded with policy_export.load_policy for fast
+        NumPy inference without TensorFlow, the env or the agent.
+        """
+        export_policy(path,
+                      params=self.get_policy_params(session),
+                      observation_low=self.memory.observation_low,
+                      observation_inv_range=self.memory.observation_inv_range,
+                      action_low=self.action_low,
+                      action_high=self.action_high,
+                      metadata={'agent': 'REINFORCE_Agent',
+                                'observation_dim': self.observation_dim,
+                                'hidden_dim': self.hidden_dim,
+                                'num_actions': self.num_actions})
+        return None
+
+    def _get_brain_state(self, session):
+        """
+        All parameters including the optimizer state
+        """
+        if self.backend == 'numpy':
+            return self.policy.get_state()
+
+        variables = tf.global_variables()
+        return collections.OrderedDict(zip([var.op.name for var in variables],
+                                           session.run(variables)))
+
+    def _set_brain_state(self, state, session):
+        if self.backend == 'numpy':
+            return self.policy.set_state(state)
+
+        for var in tf.global_variables():
+            var.load(state[var.op.name], session)
+        return None
+
+    def _load_brain(self, path, session):
+        """
+        Loads the policy network parameters from an artifact
+        """
+        artifact = load_policy(path)
+        self.set_policy_params(artifact.params, session)
+        return None
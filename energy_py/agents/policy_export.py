@@ -0,0 +1,136 @@
+"""
+Export of trained policies to a self-contained artifact & a standalone
+NumPy inference path - no TensorFlow, env or agent needed to act.
+
+The artifact is a single .npz file holding
+    - the policy network parameters
+    - the observation scaling bounds (low & 1/range)
+    - the action clipping bounds
+    - a JSON metadata string
+"""
+
+import json
+
+import numpy as np
+
+from energy_py.agents.numpy_machinery import LAYERS, policy_forward
+
+#  format version of the artifact
+ARTIFACT_VERSION = 1
+
+
+def export_policy(path,
+                  params,
+                  observation_low,
+                  observation_inv_range,
+                  action_low,
+                  action_high,
+                  metadata=None):
+    """
+    Writes a policy artifact
+
+    Args:
+        path                  (str)      : file to write (.npz)
+        params                (dict)     : 'layer/W' & 'layer/b' -> np.array
+        observation_low       (np.array) : see spaces.scaling_bounds
+        observation_inv_range (np.array) :
+        action_low            (np.array) : actions are clipped to these bounds
+        action_high           (np.array) :
+        metadata              (dict)     : extra info to keep with the policy
+    """
+    info = {'version': ARTIFACT_VERSION,
+            'layers': LAYERS}
+    info.update(metadata or {})
+
+    arrays = {'param__{}'.format(name.replace('/', '__')): np.asarray(value, dtype=np.float64)
+              for name, value in params.items()}
+
+    with open(path, 'wb') as handle:
+        np.savez(handle,
+                 observation_low=np.asarray(observation_low, dtype=np.float64),
+                 observation_inv_range=np.asarray(observation_inv_range, dtype=np.float64),
+                 action_low=np.asarray(action_low, dtype=np.float64),
+                 action_high=np.asarray(action_high, dtype=np.float64),
+                 metadata=np.array(json.dumps(info)),
+                 **arrays)
+    return None
+
+
+class Policy_Artifact(object):
+    """
+    A policy loaded from an artifact - acts on raw (unscaled) observations
+
+    Actions are the mean of the Gaussian policy (clipped) unless
+    stochastic=True, in which case they are sampled.
+
+    Args:
+        path (str) : artifact written by export_policy
+    """
+    def __init__(self, path):
+        with np.load(path) as artifact:
+            self.metadata = json.loads(str(artifact['metadata']))
+            if self.metadata['version'] != ARTIFACT_VERSION:
+                raise ValueError('unsupported policy artifact version {}'.format(self.metadata['version']))
+
+            self.observation_low = artifact['observation_low']
+            self.observation_inv_range = artifact['observation_inv_range']
+            self.action_low = artifact['action_low']
+            self.action_high = artifact['action_high']
+
+            self.params = {}
+            for key in artifact.files:
+                if key.startswith('param__'):
+                    name = key[len('param__'):].replace('__', '/')
+                    self.params[name] = artifact[key]
+
+        #  transposed contiguous weights for the single observation path
+        self.layers = [(np.ascontiguousarray(self.params['{}/W'.format(layer)].T),
+                        self.params['{}/b'.format(layer)]) for layer in LAYERS]
+        self.num_actions = self.action_low.shape[0]
+
+    def act(self, observation, stochastic=False):
+        """
+        Action for a single observation - shape (observation_dim,)
+
+        Returns:
+            action (np.array) : shape (num_actions,)
+        """
+        hidden = (observation - self.observation_low) * self.observation_inv_range
+        for W_T, b in self.layers[:-1]:
+            hidden = W_T.dot(hidden) + b
+            np.maximum(hidden, 0, out=hidden)
+
+        W_T, b = self.layers[-1]
+        output = W_T.dot(hidden) + b
+        action = output[0::2]
+
+        if stochastic:
+            #  same stdev clipping as the network - max taken over this observation
+            stdevs = output[1::2]
+            stdevs = np.clip(stdevs, 1e-10, max(stdevs.max(), 1e-10))
+            action = action + stdevs * np.random.standard_normal(action.shape)
+
+        return np.minimum(np.maximum(action, self.action_low), self.action_high)
+
+    def act_batch(self, observations, stochastic=False):
+        """
+        Actions for a batch of observations - shape (num_obs, observation_dim)
+
+        Returns:
+            actions (np.array) : shape (num_obs, num_actions)
+        """
+        scaled = (np.asarray(observations, dtype=np.float64) - self.observation_low) * self.observation_inv_range
+        means, stdevs = policy_forward(self.params, scaled.reshape(-1, self.observation_low.shape[0]))
+
+        actions = means
+        if stochastic:
+            actions = means + stdevs * np.random.standard_normal(means.shape)
+
+        return np.clip(actions, self.action_low, self.action_high)
+
+
+def load_policy(path):
+    """
+    Loads a policy artifact for inference
+    """
+    return Policy_Artifact(path)
@@ -0,0 +1,121 @@
+"""
+Module for Batch_Prefetcher - builds minibatches in a background thread so
+that learning overlaps with sampling.
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+
+class Batch_Prefetcher(object):
+    """
+    An iterator over minibatches that are sampled by a background thread.
+
+    The thread keeps a bounded queue of ready batches.  Floating point
+    arrays are cast to dtype (i.e. float32 for TensorFlow placeholders) -
+    other arrays (i.e. buffer positions from a prioritized batch) are
+    passed through unchanged.
+
+    Batches are sampled from the memory as it is when the batch is made -
+    experience added later only appears in later batches.  sample runs in
+    the background thread, so it must be safe to call while the memory is
+    written to - Agent_Memory.prefetch samples holding the memory lock.
+
+    Usage
+        with memory.prefetch(batch_size=64) as batches:
+            for _ in range(steps):
+                observations, actions, returns = next(batches)
+
+    Args:
+        sample      (callable) : sample(batch_size) -> tuple of arrays
+        batch_size  (int)      :
+        queue_size  (int)      : number of batches held ready
+        num_batches (int)      : stop after this many batches (None = never)
+        dtype       (dtype)    : dtype for floating point arrays
+    """
+    def __init__(self, sample,
+                       batch_size,
+                       queue_size  = 4,
+                       num_batches = None,
+                       dtype       = np.float32):
+
+        self.sample      = sample
+        self.batch_size  = batch_size
+        self.num_batches = num_batches
+        self.dtype       = dtype
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.finished = False
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def cast(self, batch):
+        """
+        Helper function for worker
+        """
+        return tuple(np.ascontiguousarray(arr, dtype=self.dtype)
+                     if np.issubdtype(np.asarray(arr).dtype, np.floating) else arr
+                     for arr in batch)
+
+    def put(self, item):
+        """
+        Helper function for worker - a put that gives up if we are closed
+        """
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(self):
+        """
+        The background thread
+        """
+        made = 0
+        try:
+            while self.num_batches is None or made < self.num_batches:
+                if not self.put(self.cast(self.sample(self.batch_size))):
+                    return None
+                made += 1
+        except Exception as error:
+            #  raised again in the consuming thread
+            self.put(error)
+            return None
+
+        self.put(StopIteration())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+
+        item = self.queue.get()
+        if isinstance(item, StopIteration):
+            self.finished = True
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        return item
+
+    def close(self):
+        """
+        Stops the background thread
+        """
+        self.stop_event.set()
+        self.thread.join()
+        self.finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
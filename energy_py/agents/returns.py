@@ -0,0 +1,192 @@
+"""
+Vectorized calculation of returns & advantages.
+
+All functions work along the last axis - a 1D array is a single episode,
+a 2D array of shape (num_episodes, episode_length) is many episodes of the
+same length.  discounted_returns also accepts ragged episodes packed into
+a flat array (see the lengths arg).
+
+The recursion
+    G[t] = x[t] + discount_rate * G[t+1]
+
+is a first order linear filter run backwards in time.  We use
+scipy.signal.lfilter when scipy is available, otherwise we fall back to a
+loop over time that is vectorized across episodes.
+"""
+
+import numpy as np
+
+try:
+    from scipy.signal import lfilter
+except ImportError:
+    lfilter = None
+
+
+def discount(x, discount_rate):
+    """
+    Discounted cumulative sum of x along the last axis
+
+    Args:
+        x             (np.array) : rewards (or TD errors)
+        discount_rate (float)    :
+
+    Returns:
+        G (np.array) : same shape as x
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if x.shape[-1] == 0:
+        return x.copy()
+
+    if lfilter is not None:
+        reversed_x = x[..., ::-1]
+        return lfilter([1], [1, -discount_rate], reversed_x, axis=-1)[..., ::-1]
+
+    G = np.empty_like(x)
+    running = np.zeros(x.shape[:-1])
+    for t in reversed(range(x.shape[-1])):
+        running = x[..., t] + discount_rate * running
+        G[..., t] = running
+    return G
+
+
+def pad_episodes(x, lengths, fill=0):
+    """
+    Packs a flat array of ragged episodes into a 2D array
+
+    Args:
+        x       (np.array) : flat array of consecutive episodes
+        lengths (list)     : the length of each episode
+        fill    (float)    : value for the padding after an episode ends
+
+    Returns:
+        padded (np.array) : shape (num_episodes, max(lengths))
+        mask   (np.array) : True where padded holds a value from x
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    x = np.asarray(x, dtype=np.float64)
+    assert lengths.sum() == x.shape[0]
+
+    max_length = lengths.max() if lengths.size else 0
+    mask = np.arange(max_length) < lengths.reshape(-1, 1)
+
+    padded = np.full(mask.shape, fill, dtype=np.float64)
+    padded[mask] = x
+    return padded, mask
+
+
+def discounted_returns(rewards, discount_rate, lengths=None):
+    """
+    Monte Carlo returns - no bootstrapping
+
+    Args:
+        rewards       (np.array) : 1D, 2D or flat ragged episodes
+        discount_rate (float)    :
+        lengths       (list)     : episode lengths when rewards is a flat
+                                   array of many ragged episodes
+
+    Returns:
+        returns (np.array) : same shape as rewards
+    """
+    if lengths is None:
+        return discount(rewards, discount_rate)
+
+    #  zero padding after the end of an episode adds nothing to the return
+    padded, mask = pad_episodes(rewards, lengths)
+    return discount(padded, discount_rate)[mask]
+
+
+def n_step_returns(rewards, values, discount_rate, n, last_value=0):
+    """
+    n-step bootstrapped targets
+
+        G[t] = r[t] + ... + gamma^(n-1) r[t+n-1] + gamma^n V[t+n]
+
+    Near the end of the episode we bootstrap from last_value instead.
+
+    Args:
+        rewards       (np.array) : r[t]
+        values        (np.array) : V[t] - value of the observation at t
+        discount_rate (float)    :
+        n             (int)      : number of steps before bootstrapping
+        last_value    (float)    : value after the last step (0 if terminal)
+
+    Returns:
+        targets (np.array) : same shape as rewards
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    assert rewards.shape == values.shape
+    assert n >= 1
+    T = rewards.shape[-1]
+
+    #  full returns without any bootstrap
+    G = discount(rewards, discount_rate)
+
+    #  value after the last step appended onto the values
+    last = np.broadcast_to(np.asarray(last_value, dtype=np.float64),
+                           rewards.shape[:-1] + (1,))
+    ext_values = np.concatenate([values, last], axis=-1)
+    ext_G = np.concatenate([G, np.zeros(rewards.shape[:-1] + (1,))], axis=-1)
+
+    #  the step we bootstrap from & the number of rewards before it
+    t = np.arange(T)
+    boot = np.minimum(t + n, T)
+    steps = boot - t
+
+    #  G[t] - gamma^k G[t+k] is the k-step sum of discounted rewards
+    scale = np.power(discount_rate, steps)
+    return G - scale * ext_G[..., boot] + scale * ext_values[..., boot]
+
+
+def generalized_advantage_estimate(rewards, values, discount_rate, lambd,
+                                   last_value=0):
+    """
+    GAE(gamma, lambda) - Schulman et al. (2015)
+
+        delta[t] = r[t] + gamma * V[t+1] - V[t]
+        A[t]     = sum_k (gamma * lambda)^k delta[t+k]
+
+    Args:
+        rewards       (np.array) : r[t]
+        values        (np.array) : V[t] - value of the observation at t
+        discount_rate (float)    :
+        lambd         (float)    : 0 = one step TD error, 1 = Monte Carlo
+        last_value    (float)    : value after the last step (0 if terminal)
+
+    Returns:
+        advantages (np.array) : same shape as rewards
+    """
+    rewards = np.asarray(rewards, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    assert rewards.shape == values.shape
+
+    last = np.broadcast_to(np.asarray(last_value, dtype=np.float64),
+                           rewards.shape[:-1] + (1,))
+    next_values = np.concatenate([values[..., 1:], last], axis=-1)
+
+    deltas = rewards + discount_rate * next_values - values
+    return discount(deltas, discount_rate * lambd)
+
+
+def td_lambda_returns(rewards, values, discount_rate, lambd, last_value=0):
+    """
+    TD(lambda) returns - the targets for a critic
+
+        G[t] = r[t] + gamma * ((1 - lambda) V[t+1] + lambda G[t+1])
+
+    Equal to the GAE advantage plus the value.
+
+    Args:
+        rewards       (np.array) : r[t]
+        values        (np.array) : V[t] - value of the observation at t
+        discount_rate (float)    :
+        lambd         (float)    : 0 = one step TD target, 1 = Monte Carlo
+        last_value    (float)    : value after the last step (0 if terminal)
+
+    Returns:
+        targets (np.array) : same shape as rewards
+    """
+    advantages = generalized_advantage_estimate(rewards, values,
+                                                discount_rate, lambd,
+                                                last_value)
+    return advantages + np.asarray(values, dtype=np.float64)
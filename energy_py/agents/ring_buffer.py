@@ -0,0 +1,217 @@
+"""
+Module for the Ring_Buffer storage used by Agent_Memory.
+"""
+
+import collections
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class Ring_Buffer(object):
+    """
+    A fixed size store of experience.
+
+    Each field is held in a single preallocated numpy array of shape
+    (capacity, *field_shape).  Adding a row is O(1) - once the buffer is full
+    the oldest row is overwritten in place.
+
+    Rows are addressed in two ways
+        absolute index = count of rows added before this one (never wraps)
+        position       = absolute index % capacity (the row in the arrays)
+
+    Args:
+        capacity (int)  : maximum number of rows held
+        fields   (dict) : field name -> (row shape, dtype)
+        arrays   (dict) : existing arrays (i.e. loaded from disk) to use
+                          rather than allocating new ones
+    """
+    def __init__(self, capacity, fields, arrays=None):
+        self.capacity = int(capacity)
+        assert self.capacity > 0
+
+        self.fields = collections.OrderedDict(fields)
+        self.arrays = collections.OrderedDict()
+        for name, (shape, dtype) in self.fields.items():
+            full_shape = (self.capacity,) + tuple(shape)
+            if arrays is None:
+                self.arrays[name] = self.allocate(name, full_shape, dtype)
+            else:
+                assert arrays[name].shape == full_shape
+                self.arrays[name] = arrays[name]
+        self.reset()
+
+    def allocate(self, name, shape, dtype):
+        """
+        Creates the array for a single field
+
+        Override in child classes to change where the arrays live
+        """
+        return np.zeros(shape, dtype=dtype)
+
+    def reset(self):
+        """
+        Empties the buffer - the arrays are kept & reused
+        """
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the arrays - fixed at construction
+        """
+        return sum(arr.nbytes for arr in self.arrays.values())
+
+    @property
+    def cursor(self):
+        """
+        The position the next row will be written to
+        """
+        return self.total % self.capacity
+
+    @property
+    def oldest(self):
+        """
+        The absolute index of the oldest row still held
+        """
+        return max(0, self.total - self.capacity)
+
+    def position(self, absolute):
+        """
+        Converts absolute indicies into positions in the arrays
+        """
+        return np.asarray(absolute) % self.capacity
+
+    def add(self, **row):
+        """
+        Writes a single row at the cursor, overwriting the oldest row if full
+
+        Returns the position the row was written to
+        """
+        pos = self.cursor
+        for name, value in row.items():
+            self.arrays[name][pos] = value
+        self.total += 1
+        return pos
+
+    def extend(self, num_rows, **rows):
+        """
+        Writes num_rows rows starting at the cursor - values are arrays of
+        num_rows rows (or broadcast against them)
+
+        Returns the positions the rows were written to
+        """
+        assert num_rows <= self.capacity
+        span = self.span(self.total, self.total + num_rows)
+        for name, value in rows.items():
+            self.arrays[name][span] = value
+        self.total += num_rows
+        return np.arange(self.capacity)[span]
+
+    def chronological(self):
+        """
+        Positions of all held rows ordered from oldest to newest
+        """
+        return self.position(np.arange(self.oldest, self.total))
+
+    def span(self, start, end):
+        """
+        Positions of the held rows with absolute indicies in [start, end)
+
+        Returns a slice when the rows don't wrap around the end of the
+        arrays - indexing with a slice gives views rather than copies
+        """
+        start = max(start, self.oldest)
+        if end <= start:
+            return slice(0, 0)
+
+        first = start % self.capacity
+        last = first + (end - start)
+        if last <= self.capacity:
+            return slice(first, last)
+
+        return self.position(np.arange(start, end))
+
+    def gather(self, positions, fields=None):
+        """
+        Gathers rows with a single fancy index per field
+
+        Gathering with a slice (see span) returns views
+
+        Args:
+            positions (np.array) : positions of the rows to gather
+            fields    (list)     : fields to gather (default is all)
+        """
+        if fields is None:
+            fields = self.fields.keys()
+        return {name: self.arrays[name][positions] for name in fields}
+
+    def close(self):
+        """
+        Releases the arrays - the buffer can't be used afterwards
+        """
+        self.arrays = collections.OrderedDict()
+
+
+class Memmap_Ring_Buffer(Ring_Buffer):
+    """
+    A Ring_Buffer with each field held in a memory-mapped .npy file.
+
+    Allows memories far larger than RAM - the OS page cache keeps the
+    recently used parts of the files in memory.  Gathers are done in sorted
+    position order so that random batches read through the files in a
+    single pass.
+
+    Args:
+        capacity    (int)  : maximum number of rows held
+        fields      (dict) : field name -> (row shape, dtype)
+        scratch_dir (str)  : directory for the files - default is a new
+                             temporary directory which is removed on close()
+    """
+    def __init__(self, capacity, fields, scratch_dir=None):
+        self.temporary = scratch_dir is None
+        if self.temporary:
+            scratch_dir = tempfile.mkdtemp(prefix='energy_py_memory_')
+        os.makedirs(scratch_dir, exist_ok=True)
+        self.scratch_dir = scratch_dir
+
+        super().__init__(capacity, fields)
+
+    def allocate(self, name, shape, dtype):
+        path = os.path.join(self.scratch_dir, '{}.npy'.format(name))
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def gather(self, positions, fields=None):
+        """
+        Gathers rows in sorted order then restores the requested order
+        """
+        if isinstance(positions, slice):
+            return super().gather(positions, fields)
+
+        positions = np.asarray(positions)
+        order = np.argsort(positions, kind='mergesort')
+        rows = super().gather(positions[order], fields)
+
+        restore = np.empty_like(order)
+        restore[order] = np.arange(order.shape[0])
+        return {name: arr[restore] for name, arr in rows.items()}
+
+    def flush(self):
+        """
+        Writes any changes held in the page cache to the files
+        """
+        for arr in self.arrays.values():
+            arr.flush()
+
+    def close(self):
+        """
+        Releases the memory maps - removes the files if we made them
+        """
+        super().close()
+        if self.temporary:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
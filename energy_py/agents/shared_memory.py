@@ -0,0 +1,254 @@
+"""
+Module for Shared_Replay_Memory - experience collected by many actor
+processes & sampled by a single learner process.
+"""
+
+import collections
+import ctypes
+import multiprocessing
+import time
+
+import numpy as np
+
+from energy_py.agents.returns import discounted_returns
+from energy_py.main.scripts.spaces import scaling_bounds
+
+
+class Shared_Replay_Memory(object):
+    """
+    A replay memory held in shared memory.
+
+    The memory is split into one segment per actor.  Each segment is a ring
+    buffer with two counters - only ever written by its actor, so actors
+    never need a lock
+        reserved - rows claimed, set before the actor writes any of them
+        written  - rows complete, set after the actor has written them
+    Once a segment has wrapped the rows being written overwrite the oldest
+    rows.  The learner reads written then reserved & samples only the
+    complete rows that no write in progress will overwrite.
+
+    A row can still be overwritten while the learner reads it if an actor
+    starts a new write during the read - make segments large relative to
+    the episode length & batch size to keep this rare.
+
+    Create the memory in the learner process & pass it to the actor
+    processes as an argument.
+
+    Args:
+        num_actors        (int)   :
+        memory_length     (int)   : rows held across all actors
+        observation_space (list)  :
+        action_space      (list)  :
+        reward_space      (space) :
+        discount_rate     (float) :
+        observation_dtype (dtype) : dtype the observations are stored as
+    """
+    def __init__(self, num_actors,
+                       memory_length,
+                       observation_space,
+                       action_space,
+                       reward_space,
+                       discount_rate,
+                       observation_dtype = np.float32):
+
+        self.num_actors        = int(num_actors)
+        self.segment_length    = int(memory_length) // self.num_actors
+        assert self.segment_length > 0
+
+        self.observation_space = observation_space
+        self.action_space      = action_space
+        self.reward_space      = reward_space
+        self.discount_rate     = discount_rate
+
+        self.observation_dim = len(observation_space)
+        self.action_dim      = len(action_space)
+        self.observation_low, self.observation_inv_range = scaling_bounds(observation_space)
+
+        obs_shape = (self.observation_dim,)
+        self.fields = collections.OrderedDict([
+                 ('observation',       (obs_shape, np.dtype(observation_dtype))),
+                 ('action',            ((self.action_dim,), np.dtype(np.float64))),
+                 ('reward',            ((), np.dtype(np.float64))),
+                 ('scaled_reward',     ((), np.dtype(np.float64))),
+                 ('next_observation',  (obs_shape, np.dtype(observation_dtype))),
+                 ('discounted_return', ((), np.dtype(np.float64))),
+                 ('step',              ((), np.dtype(np.int64))),
+                 ('episode',           ((), np.dtype(np.int64)))])
+
+        #  the shared blocks - one per field & one for the write counters
+        self.raw = collections.OrderedDict()
+        for name, (shape, dtype) in self.fields.items():
+            nbytes = self.num_actors * self.segment_length * int(np.prod(shape)) * dtype.itemsize
+            self.raw[name] = multiprocessing.RawArray(ctypes.c_byte, nbytes)
+        self.raw_written = multiprocessing.RawArray(ctypes.c_int64, self.num_actors)
+        self.raw_reserved = multiprocessing.RawArray(ctypes.c_int64, self.num_actors)
+
+        self.attach()
+
+        #  learner side counters
+        self.sampled = 0
+        self.last_time = time.time()
+        self.last_written = self.written.copy()
+        self.last_sampled = 0
+
+    def attach(self):
+        """
+        Creates the numpy views onto the shared blocks
+        """
+        self.arrays = collections.OrderedDict()
+        for name, (shape, dtype) in self.fields.items():
+            full_shape = (self.num_actors, self.segment_length) + tuple(shape)
+            self.arrays[name] = np.frombuffer(self.raw[name], dtype=dtype).reshape(full_shape)
+        self.written = np.frombuffer(self.raw_written, dtype=np.int64)
+        self.reserved = np.frombuffer(self.raw_reserved, dtype=np.int64)
+
+    def __getstate__(self):
+        #  numpy views can't be sent to another process - only the blocks
+        state = self.__dict__.copy()
+        del state['arrays']
+        del state['written']
+        del state['reserved']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    def __len__(self):
+        return int(np.minimum(self.written, self.segment_length).sum())
+
+    def scale_reward(self, reward):
+        low, high = self.reward_space.low, self.reward_space.high
+        if low == high:
+            return np.zeros_like(np.asarray(reward, dtype=np.float64))
+        return (np.asarray(reward, dtype=np.float64) - low) / (high - low)
+
+    def add_experience(self, actor, observation, action, reward, next_observation, step, episode):
+        """
+        Actor side - adds a single step of experience
+
+        The discounted return is not known - use add_episode for agents
+        that learn from returns
+        """
+        if next_observation is False or next_observation is None:
+            next_observation = 0
+
+        #  claim the row before writing it - see sample
+        self.reserved[actor] = self.written[actor] + 1
+        pos = self.written[actor] % self.segment_length
+        row = dict(observation=observation,
+                   action=action,
+                   reward=reward,
+                   scaled_reward=self.scale_reward(reward),
+                   next_observation=next_observation,
+                   discounted_return=np.nan,
+                   step=step,
+                   episode=episode)
+        for name, value in row.items():
+            self.arrays[name][actor, pos] = value
+
+        #  row is complete - make it visible to the learner
+        self.written[actor] += 1
+        return None
+
+    def add_episode(self, actor, observations, actions, rewards, next_observations, episode):
+        """
+        Actor side - adds a whole episode at once, with its discounted returns
+
+        Args:
+            observations      (np.array) : (episode_length, observation_dim)
+            actions           (np.array) : (episode_length, action_dim)
+            rewards           (np.array) : (episode_length,)
+            next_observations (np.array) : (episode_length, observation_dim)
+            episode           (int)      :
+        """
+        rewards = np.asarray(rewards, dtype=np.float64).reshape(-1)
+        length = rewards.shape[0]
+        assert length <= self.segment_length
+
+        scaled_rewards = self.scale_reward(rewards)
+        self.reserved[actor] = self.written[actor] + length
+        pos = (self.written[actor] + np.arange(length)) % self.segment_length
+        rows = dict(observation=observations,
+                    action=actions,
+                    reward=rewards,
+                    scaled_reward=scaled_rewards,
+                    next_observation=next_observations,
+                    discounted_return=discounted_returns(scaled_rewards, self.discount_rate),
+                    step=np.arange(length),
+                    episode=episode)
+        for name, value in rows.items():
+            self.arrays[name][actor, pos] = value
+
+        self.written[actor] += length
+        return None
+
+    def sample(self, batch_size):
+        """
+        Learner side - samples rows uniformly across all actors
+
+        Returns:
+            batch (dict) : field name -> array - observations are scaled
+        """
+        #  written before reserved - a later reserved only excludes more rows
+        written = self.written.copy()
+        reserved = self.reserved.copy()
+
+        #  complete rows that no write in progress is overwriting - the
+        #  rows (written - filled) to written of each segment
+        oldest = np.maximum(reserved - self.segment_length, 0)
+        filled = np.maximum(written - oldest, 0)
+        total = filled.sum()
+        assert total > 0
+
+        #  a uniform row across all filled rows -> (actor, position)
+        flat = np.random.randint(0, total, size=batch_size)
+        bounds = np.cumsum(filled)
+        actors = np.searchsorted(bounds, flat, side='right')
+        rows = written[actors] - filled[actors] + flat - (bounds - filled)[actors]
+        positions = rows % self.segment_length
+
+        batch = {name: arr[actors, positions] for name, arr in self.arrays.items()}
+        for name in ('observation', 'next_observation'):
+            batch[name] = (batch[name].astype(np.float64) - self.observation_low) * self.observation_inv_range
+
+        self.sampled += batch_size
+        return batch
+
+    def get_random_batch(self, batch_size):
+        """
+        Learner side - same interface as Agent_Memory.get_random_batch
+        """
+        batch = self.sample(batch_size)
+        observations = batch['observation'].reshape(-1, self.observation_dim)
+        actions = batch['action'].reshape(-1, self.action_dim)
+        returns = batch['discounted_return'].reshape(-1, 1)
+        return observations, actions, returns
+
+    def throughput(self):
+        """
+        Learner side - rates since the last call
+
+        Returns:
+            rates (dict) :
+                actor_steps_per_s     - np.array of steps/s for each actor
+                total_steps_per_s     - steps/s across all actors
+                learner_samples_per_s - rows sampled/s by the learner
+                replay_ratio          - rows sampled per row added
+        """
+        now = time.time()
+        written = self.written.copy()
+        elapsed = max(now - self.last_time, 1e-12)
+
+        actor_rates = (written - self.last_written) / elapsed
+        learner_rate = (self.sampled - self.last_sampled) / elapsed
+        total_rate = actor_rates.sum()
+
+        self.last_time = now
+        self.last_written = written
+        self.last_sampled = self.sampled
+
+        return {'actor_steps_per_s': actor_rates,
+                'total_steps_per_s': total_rate,
+                'learner_samples_per_s': learner_rate,
+                'replay_ratio': learner_rate / total_rate if total_rate > 0 else np.nan}
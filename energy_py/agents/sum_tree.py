@@ -0,0 +1,110 @@
+"""
+Module for the Sum_Tree used for prioritized experience replay.
+"""
+
+import numpy as np
+
+
+class Sum_Tree(object):
+    """
+    A binary tree where each parent holds the sum of its children.
+
+    The tree is held in a single flat numpy array (no node objects)
+        tree[1]            = root = sum of all priorities
+        tree[2i], tree[2i+1] = children of node i
+        tree[offset + pos]   = leaf holding the priority of buffer position pos
+
+    Updates & samples are batched - we loop over the log2(capacity) levels
+    of the tree and vectorize across the batch.
+
+    Args:
+        capacity (int) : number of leaves (i.e. the memory length)
+    """
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+
+        #  leaves start at the first power of two >= capacity
+        self.offset = 1
+        while self.offset < self.capacity:
+            self.offset *= 2
+        self.depth = int(np.log2(self.offset))
+
+        self.tree = np.zeros(2 * self.offset)
+
+    def reset(self):
+        self.tree[:] = 0
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def get(self, positions):
+        """
+        The priorities held at buffer positions
+        """
+        return self.tree[self.offset + np.asarray(positions)]
+
+    def update(self, positions, priorities):
+        """
+        Sets the priority of buffer positions - O(log n) per position
+
+        Args:
+            positions  (np.array) : buffer positions
+            priorities (np.array) : new priorities (broadcast against positions)
+        """
+        nodes = self.offset + np.asarray(positions, dtype=np.int64).reshape(-1)
+        assert np.all(nodes < self.offset + self.capacity)
+        self.tree[nodes] = priorities
+
+        #  a single position (i.e. adding experience) is cheaper as scalars
+        if nodes.shape[0] == 1:
+            node = int(nodes[0])
+            while node > 1:
+                node //= 2
+                self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+            return None
+
+        #  recalculate the parents of the changed nodes one level at a time
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Finds the leaves whose slice of the cumulative priority contains
+        each value - a leaf is found with probability priority / total
+
+        Args:
+            values (np.array) : values in [0, total)
+
+        Returns:
+            positions (np.array) : buffer positions
+        """
+        values = np.array(values, dtype=np.float64).reshape(-1)
+        nodes = np.ones(values.shape[0], dtype=np.int64)
+
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+
+            #  never step into an empty subtree (can happen through rounding)
+            go_right = (values >= left_sum) & (self.tree[left + 1] > 0)
+            go_right |= left_sum <= 0
+
+            values = values - left_sum * go_right
+            nodes = left + go_right
+
+        return nodes - self.offset
+
+    def sample(self, batch_size):
+        """
+        Stratified sampling - one sample from each of batch_size equal
+        slices of the total priority
+
+        Returns:
+            positions (np.array) : buffer positions
+        """
+        assert self.total > 0
+        segment = self.total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        return self.find(values)
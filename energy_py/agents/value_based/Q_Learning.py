@@ -1,11 +1,311 @@
+"""
+Q-Learning with a neural network (DQN).
+
+The continuous action spaces are discretized into a grid of joint actions.
+The Q-network outputs the value of every action in the grid, so a single
+forward pass gives the greedy action for a batch of observations.
+
+Q-Learning is off-policy - we learn from minibatches sampled from the
+agent memory (uniformly or by priority), so each step of experience is
+learnt from many times.  This needs far fewer env steps than on-policy
+REINFORCE.
+
+The bootstrapped targets use a target network that is synced with the
+online network every target_update_steps gradient steps.
+"""
+
+import collections
+
+import numpy as np
 
 from energy_py.agents.agent_core import Base_Agent
+from energy_py.agents.numpy_machinery import Numpy_Q_Network
+from energy_py.main.scripts.spaces import action_grid_indexes, make_action_grid
+
+#  set by _tf when the first tensorflow Q_Learner is made
+tf = None
+fc_layer = None
+
+
+def _tf():
+    """
+    Imports TensorFlow on first use - not needed by the numpy backend
+    """
+    global tf, fc_layer
+    if tf is None:
+        try:
+            import tensorflow
+            from energy_py.agents.tensorflow_machinery import fc_layer as tf_fc_layer
+        except ImportError:
+            raise ImportError('TensorFlow is not installed - use backend=\'numpy\'')
+        tf, fc_layer = tensorflow, tf_fc_layer
+    return tf
+
 
 class Q_Learner(Base_Agent):
+    """
+    DQN agent over a discretized action grid.
+
+    backend = 'tensorflow' : Q-networks are TensorFlow graphs
+              'numpy'      : the same networks in NumPy (Numpy_Q_Network)
+                             - no TensorFlow needed, the session args are
+                             ignored.
 
-        def __init__(self, env,
-                           epsilon_decay_steps,
-                           batch_size    = 64):
+    Args:
+        env                 (object) :
+        epsilon_decay_steps (int)    :
+        learning_rate       (float)  :
+        batch_size          (int)    :
+        num_action_steps    (int)    : grid values for each continuous action
+        target_update_steps (int)    : gradient steps between target network syncs
+        prioritized         (bool)   : sample experience by TD error
+        memory_length       (int)    :
+        discount_rate       (float)  :
+        backend             (str)    :
+    """
+    def __init__(self, env,
+                       epsilon_decay_steps,
+                       learning_rate       = 0.001,
+                       batch_size          = 64,
+                       num_action_steps    = 5,
+                       target_update_steps = 1000,
+                       prioritized         = False,
+                       memory_length       = int(1e5),
+                       discount_rate       = 0.95,
+                       backend             = 'tensorflow'):
 
         #  passing the environment to the Base_Agent class
-        super().__init__(env, epsilon_decay_steps)
+        super().__init__(env, epsilon_decay_steps,
+                         memory_length=memory_length,
+                         discount_rate=discount_rate,
+                         memory_kwargs={'prioritized': prioritized})
+
+        self.learning_rate       = learning_rate
+        self.batch_size          = batch_size
+        self.target_update_steps = target_update_steps
+        self.prioritized         = prioritized
+        self.backend             = backend
+
+        #  the discrete joint actions the Q-network chooses between
+        self.action_grid, self.action_values = make_action_grid(self.action_space,
+                                                                num_action_steps)
+        self.num_grid_actions = self.action_grid.shape[0]
+
+        #  gradient steps taken - used to sync the target network
+        self.train_steps = 0
+
+        if self.backend == 'numpy':
+            self.q_network = Numpy_Q_Network(self.observation_dim,
+                                             self.num_grid_actions,
+                                             learning_rate=self.learning_rate)
+            return None
+
+        if self.backend != 'tensorflow':
+            raise ValueError('unknown backend {}'.format(self.backend))
+        _tf()
+
+        #  initialize the TensorFlow machinery
+        with tf.name_scope('q_network'):
+            self.observation = tf.placeholder(tf.float32,
+                                              [None, self.observation_dim],
+                                              'observation')
+            self.make_graph()
+
+    def make_network(self, scope):
+        """
+        Helper function for make_graph
+
+        A three layer fully-connected network outputting one Q value per
+        action in the grid
+        """
+        obs_dim, hidden_dim = self.observation_dim, self.observation_dim * 2
+
+        with tf.variable_scope(scope):
+            with tf.variable_scope('input_layer'):
+                input_layer = fc_layer(self.observation, [obs_dim, obs_dim], [obs_dim], tf.nn.relu)
+
+            with tf.variable_scope('hidden_layer_1'):
+                hidden_layer_1 = fc_layer(input_layer, [obs_dim, hidden_dim], [hidden_dim], tf.nn.relu)
+
+            with tf.variable_scope('hidden_layer_2'):
+                hidden_layer_2 = fc_layer(hidden_layer_1, [hidden_dim, hidden_dim], [hidden_dim], tf.nn.relu)
+
+            with tf.variable_scope('output_layer'):
+                q_values = fc_layer(hidden_layer_2, [hidden_dim, self.num_grid_actions], [self.num_grid_actions])
+
+        return q_values
+
+    def make_graph(self):
+        """
+        Makes the online & target Q-networks, the loss & the sync op
+        """
+        self.q_values = self.make_network('online')
+        self.target_q_values = self.make_network('target')
+
+        #  copies the online network parameters into the target network
+        online_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='online')
+        target_vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='target')
+        self.update_target_op = tf.group(*[target.assign(online)
+                                           for online, target in zip(online_vars, target_vars)])
+
+        with tf.variable_scope('learning'):
+            self.action_index = tf.placeholder(tf.int32, [None], 'action_index')
+            self.target = tf.placeholder(tf.float32, [None], 'target')
+            self.weights = tf.placeholder(tf.float32, [None], 'weights')
+
+            #  the Q value of the action taken in each sample
+            mask = tf.one_hot(self.action_index, self.num_grid_actions)
+            taken_q = tf.reduce_sum(self.q_values * mask, axis=1)
+            self.td_error = taken_q - self.target
+
+            #  Huber loss weighted by the importance sampling weights
+            abs_error = tf.abs(self.td_error)
+            huber = tf.where(abs_error < 1.0,
+                             0.5 * tf.square(self.td_error),
+                             abs_error - 0.5)
+            self.loss = tf.reduce_mean(self.weights * huber)
+
+            self.optimizer = tf.train.AdamOptimizer(self.learning_rate)
+            self.train_step_op = self.optimizer.minimize(self.loss, var_list=online_vars)
+
+        return None
+
+    def predict(self, scaled_observations, session, target=False):
+        """
+        Q values of every action in the grid - (num_obs, num_grid_actions)
+        """
+        if self.backend == 'numpy':
+            return self.q_network.predict(scaled_observations, target)
+
+        q_values = self.target_q_values if target else self.q_values
+        return session.run(q_values, {self.observation : scaled_observations})
+
+    def action_indexes(self, actions):
+        """
+        Index in the action grid of each action - (num_actions,)
+        """
+        return action_grid_indexes(actions, self.action_values)
+
+    def _act(self, observation, session, epsilon):
+        """
+        Epsilon greedy action for a single observation
+        """
+        return self._act_batch(np.asarray(observation).reshape(1, self.observation_dim),
+                               session, epsilon).reshape(self.num_actions)
+
+    def _act_batch(self, observations, session, epsilon):
+        """
+        Epsilon greedy actions for a batch of observations with a single
+        forward pass of the Q-network
+
+        Returns:
+            actions (np.array) : shape (num_observations, num_actions)
+        """
+        num_obs = observations.shape[0]
+        scaled_observations = self.memory.scale_array(observations,
+                                                      self.observation_space)
+
+        indexes = self.predict(scaled_observations, session).argmax(axis=1)
+
+        explore = np.random.uniform(size=num_obs) <= epsilon
+        if explore.any():
+            indexes[explore] = np.random.randint(self.num_grid_actions,
+                                                 size=int(explore.sum()))
+
+        return self.action_grid[indexes].copy()
+
+    def train_step(self, observations, action_indexes, targets, weights, session):
+        """
+        A single gradient step - returns the loss & the TD errors
+        """
+        if self.backend == 'numpy':
+            return self.q_network.train_step(observations, action_indexes, targets, weights)
+
+        feed_dict = {self.observation : observations,
+                     self.action_index : action_indexes,
+                     self.target : targets,
+                     self.weights : weights}
+
+        _, loss, td_error = session.run([self.train_step_op, self.loss, self.td_error], feed_dict)
+        return loss, td_error
+
+    def update_target_network(self, session=None):
+        """
+        Syncs the target network with the online network
+        """
+        if self.backend == 'numpy':
+            return self.q_network.update_target()
+
+        session.run(self.update_target_op)
+        return None
+
+    def learn_transitions(self, session=None, steps=1):
+        """
+        Takes gradient steps on minibatches of transitions from memory
+
+        With prioritized memory the priorities of the sampled experience
+        are updated with the new TD errors.
+
+        Args:
+            session (tf.Session) :
+            steps   (int)        : number of gradient steps
+
+        Returns:
+            losses (list) : loss for each gradient step
+        """
+        losses = []
+        if len(self.memory) == 0:
+            return losses
+
+        for _ in range(steps):
+            (observations, actions, rewards, next_observations,
+             dones, weights, positions) = self.memory.get_transition_batch(self.batch_size,
+                                                                           prioritized=self.prioritized)
+
+            #  bootstrap from the target network - except on terminal steps
+            next_q = self.predict(next_observations, session, target=True).max(axis=1)
+            targets = rewards + self.discount_rate * next_q * (1 - dones)
+
+            loss, td_errors = self.train_step(observations,
+                                              self.action_indexes(actions),
+                                              targets,
+                                              weights,
+                                              session)
+            losses.append(float(loss))
+
+            if self.prioritized:
+                self.memory.update_priorities(positions, td_errors)
+
+            self.train_steps += 1
+            if self.train_steps % self.target_update_steps == 0:
+                self.update_target_network(session)
+
+        return losses
+
+    def _reset(self):
+        self.train_steps = 0
+        return None
+
+    def _get_brain_state(self, session):
+        """
+        All parameters including the target network & optimizer state
+        """
+        state = collections.OrderedDict()
+        if self.backend == 'numpy':
+            state.update(self.q_network.get_state())
+        else:
+            variables = tf.global_variables()
+            state.update(zip([var.op.name for var in variables],
+                             session.run(variables)))
+
+        state['train_steps'] = np.array(self.train_steps)
+        return state
+
+    def _set_brain_state(self, state, session):
+        self.train_steps = int(state['train_steps'])
+        if self.backend == 'numpy':
+            return self.q_network.set_state(state)
+
+        for var in tf.global_variables():
+            var.load(state[var.op.name], session)
+        return None
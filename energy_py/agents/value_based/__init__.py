@@ -0,0 +1,4 @@
+from energy_py.agents.value_based.Q_Learning import Q_Learner
+from energy_py.agents.value_based.tabular_q_learning import Tabular_Q_Learner
+
+__all__ = ['Q_Learner', 'Tabular_Q_Learner']
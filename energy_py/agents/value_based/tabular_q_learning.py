@@ -0,0 +1,215 @@
+"""
+Tabular Q-Learning over binned observations.
+
+Selected observation columns (i.e. hour, price & charge) are binned with
+np.digitize & the bin of each column is combined into a single state
+index.  Q values are held in a dense NumPy table of
+    (num_states, num_grid_actions)
+
+Updates are batched - the TD errors of a whole batch of transitions are
+scattered into the table at once.  Useful as a fast baseline & a sanity
+check for the neural network agents.
+"""
+
+import collections
+
+import numpy as np
+
+from energy_py.agents.agent_core import Base_Agent
+from energy_py.main.scripts.spaces import action_grid_indexes, make_action_grid
+
+
+def uniform_bin_edges(space, num_bins):
+    """
+    Interior bin edges for a single observation space
+
+    Continuous spaces are split into num_bins equal width bins.  Discrete
+    spaces get one bin per value (num_bins is ignored).
+    """
+    if space.type == 'discrete':
+        values = space.discrete_space
+        return (values[1:] + values[:-1]) / 2
+
+    return np.linspace(space.low, space.high, num_bins + 1)[1:-1]
+
+
+def quantile_bin_edges(values, num_bins):
+    """
+    Interior bin edges so that each bin holds the same share of values
+
+    i.e. to bin electricity prices into quantiles from the time series
+    """
+    quantiles = np.linspace(0, 1, num_bins + 1)[1:-1]
+    return np.unique(np.percentile(np.asarray(values, dtype=np.float64), 100 * quantiles))
+
+
+class Tabular_Q_Learner(Base_Agent):
+    """
+    Q-Learning with a dense Q-table over binned observations
+
+    Observations are binned in raw (unscaled) units.
+
+    Args:
+        env                 (object) :
+        epsilon_decay_steps (int)    :
+        observation_columns (list)   : indexes of the observation columns to bin
+                                       (default all)
+        num_bins            (int)    : bins for each continuous column
+        bin_edges           (dict)   : column -> interior bin edges - overrides
+                                       the uniform bins (i.e. quantile_bin_edges)
+        num_action_steps    (int)    : grid values for each continuous action
+        learning_rate       (float)  : step size of the TD update
+        discount_rate       (float)  :
+        memory_length       (int)    :
+        max_states          (int)    : guard against tables that won't fit in RAM
+    """
+    def __init__(self, env,
+                       epsilon_decay_steps,
+                       observation_columns = None,
+                       num_bins            = 10,
+                       bin_edges           = None,
+                       num_action_steps    = 5,
+                       learning_rate       = 0.1,
+                       discount_rate       = 0.95,
+                       memory_length       = int(1e6),
+                       max_states          = int(1e7)):
+
+        #  passing the environment to the Base_Agent class
+        super().__init__(env, epsilon_decay_steps,
+                         memory_length=memory_length,
+                         discount_rate=discount_rate)
+
+        self.learning_rate = learning_rate
+
+        if observation_columns is None:
+            observation_columns = list(range(self.observation_dim))
+        self.observation_columns = list(observation_columns)
+
+        #  interior edges of the bins for each column
+        if bin_edges is None:
+            bin_edges = {}
+        self.bin_edges = [np.asarray(bin_edges[col], dtype=np.float64) if col in bin_edges
+                          else uniform_bin_edges(self.observation_space[col], num_bins)
+                          for col in self.observation_columns]
+        self.state_shape = tuple(edges.shape[0] + 1 for edges in self.bin_edges)
+        self.num_states = int(np.prod(self.state_shape))
+
+        #  the discrete joint actions
+        self.action_grid, self.action_values = make_action_grid(self.action_space,
+                                                                num_action_steps)
+        self.num_grid_actions = self.action_grid.shape[0]
+
+        if self.num_states * self.num_grid_actions > max_states:
+            raise ValueError('Q-table of {} states x {} actions is larger than '
+                             'max_states - bin fewer columns'.format(self.num_states,
+                                                                     self.num_grid_actions))
+
+        self.q_table = np.zeros((self.num_states, self.num_grid_actions))
+
+    def state_indexes(self, observations):
+        """
+        Row of the Q-table for each raw observation - (num_obs,)
+        """
+        observations = np.asarray(observations, dtype=np.float64).reshape(-1, self.observation_dim)
+        bins = [np.digitize(observations[:, col], edges)
+                for col, edges in zip(self.observation_columns, self.bin_edges)]
+        return np.ravel_multi_index(bins, self.state_shape)
+
+    def _act(self, observation, session, epsilon):
+        """
+        Epsilon greedy action for a single observation
+        """
+        return self._act_batch(np.asarray(observation).reshape(1, self.observation_dim),
+                               session, epsilon).reshape(self.num_actions)
+
+    def _act_batch(self, observations, session, epsilon):
+        """
+        Epsilon greedy actions for a batch of observations
+
+        Returns:
+            actions (np.array) : shape (num_observations, num_actions)
+        """
+        num_obs = observations.shape[0]
+        indexes = self.q_table[self.state_indexes(observations)].argmax(axis=1)
+
+        explore = np.random.uniform(size=num_obs) <= epsilon
+        if explore.any():
+            indexes[explore] = np.random.randint(self.num_grid_actions,
+                                                 size=int(explore.sum()))
+
+        return self.action_grid[indexes].copy()
+
+    def update(self, observations, actions, rewards, next_observations, dones):
+        """
+        A batched TD update of the Q-table from raw transitions
+
+        The TD errors are computed against the table before the update.
+        Where a (state, action) appears many times in the batch the mean TD
+        error is applied, so the step size doesn't grow with the batch.
+
+        Returns:
+            td_errors (np.array) : (num_samples,)
+        """
+        states = self.state_indexes(observations)
+        next_states = self.state_indexes(next_observations)
+        action_indexes = action_grid_indexes(actions, self.action_values)
+
+        #  bootstrap from the best next action - except on terminal steps
+        next_q = self.q_table[next_states].max(axis=1)
+        targets = np.asarray(rewards).reshape(-1) + self.discount_rate * next_q * (1 - np.asarray(dones).reshape(-1))
+        td_errors = targets - self.q_table[states, action_indexes]
+
+        #  sum the TD errors & counts over only the cells in the batch - so
+        #  the cost is O(batch) whatever the size of the table
+        cells = states * self.num_grid_actions + action_indexes
+        cells, inverse = np.unique(cells, return_inverse=True)
+        sums = np.bincount(inverse, weights=td_errors)
+        counts = np.bincount(inverse)
+
+        self.q_table.flat[cells] += self.learning_rate * sums / counts
+        return td_errors
+
+    def learn_memory(self, epochs=1, chunk_size=65536):
+        """
+        Sweeps over all of the transitions held in memory in shuffled chunks
+
+        Returns:
+            mean_abs_td (list) : mean absolute TD error of each chunk
+        """
+        errors = []
+        positions = self.memory.buffer.chronological()
+        for epoch in range(epochs):
+            order = np.random.permutation(positions)
+            for start in range(0, order.shape[0], chunk_size):
+                transitions = self.memory.get_transitions(order[start:start + chunk_size],
+                                                          scaled=False)
+                errors.append(float(np.mean(np.abs(self.update(*transitions)))))
+
+        return errors
+
+    def learn_transitions(self, session=None, steps=1, batch_size=1024):
+        """
+        TD updates on minibatches sampled uniformly from memory
+
+        Returns:
+            mean_abs_td (list) : mean absolute TD error of each batch
+        """
+        errors = []
+        if len(self.memory) == 0:
+            return errors
+
+        for _ in range(steps):
+            batch = self.memory.get_transition_batch(batch_size, scaled=False)
+            errors.append(float(np.mean(np.abs(self.update(*batch[:5])))))
+        return errors
+
+    def _reset(self):
+        self.q_table[...] = 0
+        return None
+
+    def _get_brain_state(self, session):
+        return collections.OrderedDict([('q_table', self.q_table.copy())])
+
+    def _set_brain_state(self, state, session):
+        self.q_table[...] = state['q_table']
+        return None
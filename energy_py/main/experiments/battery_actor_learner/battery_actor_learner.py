@@ -0,0 +1,63 @@
+"""
+This experiment script trains a REINFORCE agent on the battery environment
+with many actor processes - see main/scripts/actor_learner.py
+
+Arguments are number of updates, episode length & number of actors
+    python battery_actor_learner.py 100 3000 4
+
+Each update learns from one episode per actor.
+"""
+
+import sys
+
+import numpy as np
+
+from energy_py.agents.policy_based.reinforce import REINFORCE_Agent
+from energy_py.envs.battery.battery_env import Battery_Env
+from energy_py.main.scripts.actor_learner import Actor_Learner
+from energy_py.main.scripts.figure_renderer import start_renderer
+from energy_py.main.scripts.visualizers import Eternity_Visualizer
+
+UPDATES = int(sys.argv[1])
+EPISODE_LENGTH = int(sys.argv[2])
+NUM_ACTORS = int(sys.argv[3])
+EPOCHS = 4
+
+ENV_KWARGS = {'lag'            : 0,
+              'episode_length' : EPISODE_LENGTH,
+              'episode_start'  : 'random',
+              'power_rating'   : 2,  #  in MW
+              'capacity'       : 4,  #  in MWh
+              'verbose'        : 0}
+
+if __name__ == '__main__':
+    #  figures are rendered in a background process - started before
+    #  the actor processes
+    start_renderer()
+
+    print('running {} updates with {} actors'.format(UPDATES, NUM_ACTORS))
+
+    env = Battery_Env(**ENV_KWARGS)
+    agent = REINFORCE_Agent(env,
+                            epsilon_decay_steps = EPISODE_LENGTH * UPDATES / 2,
+                            learning_rate = 0.01,
+                            batch_size = 64,
+                            backend = 'numpy')
+
+    with Actor_Learner(agent, Battery_Env, ENV_KWARGS,
+                       num_actors=NUM_ACTORS,
+                       epochs=EPOCHS,
+                       seed=42) as trainer:
+        for update in range(UPDATES):
+            stats = trainer.update()
+            print('update {} - actor steps/s {} - total steps/s {:.0f} - '
+                  'mean policy lag {:.1f}'.format(update,
+                                                  np.round(stats['actor_steps_per_s']),
+                                                  stats['total_steps_per_s'],
+                                                  stats['policy_lag'].mean()))
+
+    episode = stats['episodes'][-1]
+
+    #  finally collect data from the agent & environment
+    global_history = Eternity_Visualizer(episode, agent, env)
+    outputs = global_history.output_results()
@@ -0,0 +1,69 @@
+"""
+This experiment script uses a DQN agent (Q_Learner) to control the battery
+environment.
+
+Arguments are number of episodes & episode length.  After each episode we
+take one gradient step per STEPS_PER_UPDATE env steps on minibatches
+sampled from the whole memory.
+    python battery_dqn.py 100 3000
+"""
+
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from energy_py.agents.value_based.Q_Learning import Q_Learner
+from energy_py.envs.battery.battery_env import Battery_Env
+from energy_py.main.scripts.experiment_blocks import run_single_episode
+from energy_py.main.scripts.figure_renderer import start_renderer
+from energy_py.main.scripts.visualizers import Eternity_Visualizer
+
+EPISODES = int(sys.argv[1])
+EPISODE_LENGTH = int(sys.argv[2])
+STEPS_PER_UPDATE = 4
+
+
+if __name__ == '__main__':
+    #  figures are rendered in a background process - started before
+    #  any TensorFlow session or threads
+    start_renderer()
+
+    print('running {} episodes of length {}'.format(EPISODES, EPISODE_LENGTH))
+
+    env = Battery_Env(lag            = 0,
+                      episode_length = EPISODE_LENGTH,
+                      episode_start  = 'random',
+                      power_rating   = 2,  #  in MW
+                      capacity       = 4,  #  in MWh
+                      verbose        = 0)
+    print('made env')
+
+    agent = Q_Learner(env,
+                      epsilon_decay_steps = EPISODE_LENGTH * EPISODES / 2,
+                      learning_rate       = 0.001,
+                      batch_size          = 64,
+                      num_action_steps    = 5,
+                      target_update_steps = 1000,
+                      prioritized         = True)
+    print('made agent')
+
+    #  creating the TensorFlow session for this experiment
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        agent.update_target_network(sess)
+
+        for episode in range(1, EPISODES):
+            agent, env, sess = run_single_episode(episode,
+                                                   agent,
+                                                   env,
+                                                   sess)
+
+            #  learn from minibatches of transitions across all held experience
+            losses = agent.learn_transitions(sess, steps=EPISODE_LENGTH // STEPS_PER_UPDATE)
+            agent.memory.losses.append(float(np.mean(losses)))
+            print('episode {} - mean loss is {}'.format(episode, np.mean(losses)))
+
+    #  finally collect data from the agent & environment
+    global_history = Eternity_Visualizer(episode, agent, env)
+    outputs = global_history.output_results()
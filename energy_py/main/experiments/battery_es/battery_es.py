@@ -0,0 +1,53 @@
+"""
+This experiment script trains the REINFORCE policy network on the battery
+environment with evolution strategies - see main/scripts/evolution_strategies.py
+
+Arguments are number of generations, episode length & population size
+    python battery_es.py 100 3000 50
+
+The trained policy is exported to results/battery_es_policy.npz
+"""
+
+import os
+import sys
+
+from energy_py.agents.policy_based.reinforce import REINFORCE_Agent
+from energy_py.envs.battery.battery_env import Battery_Env
+from energy_py.main.scripts.evolution_strategies import Evolution_Strategies
+from energy_py.main.scripts.utils import ensure_dir
+
+GENERATIONS = int(sys.argv[1])
+EPISODE_LENGTH = int(sys.argv[2])
+POPULATION_SIZE = int(sys.argv[3])
+POLICY_PATH = os.path.join('results', 'battery_es_policy.npz')
+
+ENV_KWARGS = {'lag'            : 0,
+              'episode_length' : EPISODE_LENGTH,
+              'episode_start'  : 'random',
+              'power_rating'   : 2,  #  in MW
+              'capacity'       : 4,  #  in MWh
+              'verbose'        : 0}
+
+if __name__ == '__main__':
+    print('running {} generations of {}'.format(GENERATIONS, POPULATION_SIZE))
+
+    env = Battery_Env(**ENV_KWARGS)
+    agent = REINFORCE_Agent(env,
+                            epsilon_decay_steps = 1,
+                            backend = 'numpy')
+
+    with Evolution_Strategies(agent, Battery_Env, ENV_KWARGS,
+                              population_size=POPULATION_SIZE,
+                              sigma=0.1,
+                              learning_rate=0.01,
+                              seed=42) as es:
+        for generation in range(GENERATIONS):
+            stats = es.step()
+            print('generation {} - mean return {:.1f} - max return {:.1f} - '
+                  '{:.1f} s'.format(generation,
+                                    stats['mean_return'],
+                                    stats['max_return'],
+                                    stats['seconds']))
+
+    ensure_dir(POLICY_PATH)
+    agent.export_policy(POLICY_PATH)
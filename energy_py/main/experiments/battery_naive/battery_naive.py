@@ -16,24 +16,31 @@ Code below runs a single episode & saves results.
 from energy_py.agents.naive.naive_battery import Naive_Battery_Agent
 from energy_py.envs.battery.battery_env import Battery_Env
 from energy_py.main.scripts.experiment_blocks import run_single_episode
+from energy_py.main.scripts.figure_renderer import start_renderer
 from energy_py.main.scripts.visualizers import Eternity_Visualizer
 
 EPISODE_LENGTH = 'maximum'
 EPISODE_START = 0
 
-env = Battery_Env(lag            = 0,
-                  episode_length = EPISODE_LENGTH,
-                  episode_start  = EPISODE_START,
-                  power_rating   = 2,  #  in MW
-                  capacity       = 4,  #  in MWh
-                  verbose        = 0)
 
-assert env.lag == 0  # must be zero for naive agents
+if __name__ == '__main__':
+    #  figures are rendered in a background process - started before
+    #  any TensorFlow session or threads
+    start_renderer()
 
-agent = Naive_Battery_Agent(env=env)
-episode = 1
-agent, env, _ = run_single_episode(episode,
-                                   agent,
-                                   env)
+    env = Battery_Env(lag            = 0,
+                      episode_length = EPISODE_LENGTH,
+                      episode_start  = EPISODE_START,
+                      power_rating   = 2,  #  in MW
+                      capacity       = 4,  #  in MWh
+                      verbose        = 0)
 
-outputs = Eternity_Visualizer(episode, agent, env).output_results()
+    assert env.lag == 0  # must be zero for naive agents
+
+    agent = Naive_Battery_Agent(env=env)
+    episode = 1
+    agent, env, _ = run_single_episode(episode,
+                                       agent,
+                                       env)
+
+    outputs = Eternity_Visualizer(episode, agent, env).output_results()
@@ -2,50 +2,114 @@
 This experiment script uses a REINFORCE agent to control the battery environment.
 
 Experiment runs through the entire length of the state time series CSV.
+
+Arguments are number of episodes, episode length & optionally the number
+of environments.  With more than one environment each round runs one
+episode per environment & learns from all of them using shuffled
+minibatches (EPOCHS passes over the experience).
+
+A checkpoint is written every CHECKPOINT_EVERY episodes.  Add --resume to
+continue from the latest checkpoint without repeating completed episodes
+    python battery_reinforce.py 100 3000 --resume
 """
 
+import os
 import sys
 
 import tensorflow as tf
 
 from energy_py.agents.policy_based.reinforce import REINFORCE_Agent
 from energy_py.envs.battery.battery_env import Battery_Env
-from energy_py.main.scripts.experiment_blocks import run_single_episode
+from energy_py.main.scripts.checkpoint import Checkpointer, latest_checkpoint, restore_checkpoint
+from energy_py.main.scripts.experiment_blocks import run_single_episode, run_parallel_episodes
+from energy_py.main.scripts.figure_renderer import start_renderer
 from energy_py.main.scripts.visualizers import Eternity_Visualizer
-args = sys.argv
+args = [arg for arg in sys.argv if not arg.startswith('--')]
+RESUME = '--resume' in sys.argv
 
 EPISODES = int(args[1])
 EPISODE_LENGTH = int(args[2])
+NUM_ENVS = int(args[3]) if len(args) > 3 else 1
+EPOCHS = 4
+CHECKPOINT_EVERY = 10
+CHECKPOINT_DIR = os.path.join('results', 'checkpoints')
+
+
+if __name__ == '__main__':
+    #  figures are rendered in a background process - started before
+    #  any TensorFlow session or threads
+    start_renderer()
+
+    print('running {} episodes of length {}'.format(EPISODES, EPISODE_LENGTH))
+
+    envs = [Battery_Env(lag            = 0,
+                        episode_length = EPISODE_LENGTH,
+                        episode_start  = 'random',
+                        power_rating   = 2,  #  in MW
+                        capacity       = 4,  #  in MWh
+                        verbose        = 0) for _ in range(NUM_ENVS)]
+    env = envs[0]
+    print('made {} envs'.format(NUM_ENVS))
+    agent = REINFORCE_Agent(env,
+                            epsilon_decay_steps = EPISODE_LENGTH * EPISODES / 2,
+                            learning_rate = 0.01,
+                            batch_size = 64 )
+    print('made agent')
+    #  writes checkpoints in the background
+    checkpointer = Checkpointer(CHECKPOINT_DIR)
+
+    #  creating the TensorFlow session for this experiment
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+
+        #  the last completed episode - updated after every episode
+        last_episode = 0
+        checkpoint = latest_checkpoint(CHECKPOINT_DIR)
+        if RESUME and checkpoint:
+            last_episode = restore_checkpoint(checkpoint, agent, sess)
+            print('resuming from {} at episode {}'.format(checkpoint, last_episode + 1))
+        start = last_episode + 1
+
+        if NUM_ENVS == 1:
+            for episode in range(start, EPISODES):
+                agent, env, sess = run_single_episode(episode,
+                                                       agent,
+                                                       env,
+                                                       sess)
+
+                #  get a batch to learn from
+                observations, actions, returns = agent.memory.get_episode_batch(episode)
+                #  train the model
+                loss = agent.learn(observations, actions, returns, sess)
+                last_episode = episode
+
+                if episode % CHECKPOINT_EVERY == 0:
+                    checkpointer.save(episode, agent, sess)
+
+        else:
+            for first in range(start, EPISODES, NUM_ENVS):
+                episodes = list(range(first, min(first + NUM_ENVS, EPISODES)))
+                agent, _, sess = run_parallel_episodes(episodes,
+                                                       agent,
+                                                       envs[:len(episodes)],
+                                                       sess)
+
+                #  shuffled minibatches over all of this rounds episodes
+                losses = agent.learn_episodes(episodes, sess, epochs=EPOCHS)
+                last_episode = episodes[-1]
+                #  episodes[i] ran in envs[i] - the visualizer needs this env
+                env = envs[len(episodes) - 1]
+
+                #  checkpoint once a round has passed a multiple of CHECKPOINT_EVERY
+                if episodes[-1] // CHECKPOINT_EVERY > (first - 1) // CHECKPOINT_EVERY:
+                    checkpointer.save(episodes[-1], agent, sess)
+
+    checkpointer.close()
 
-print('running {} episodes of length {}'.format(EPISODES, EPISODE_LENGTH))
-
-env = Battery_Env(lag            = 0,
-                  episode_length = EPISODE_LENGTH,
-                  episode_start  = 'random',
-                  power_rating   = 2,  #  in MW
-                  capacity       = 4,  #  in MWh
-                  verbose        = 0)
-print('made env')
-agent = REINFORCE_Agent(env,
-                        epsilon_decay_steps = EPISODE_LENGTH * EPISODES / 2,
-                        learning_rate = 0.01,
-                        batch_size = 64 )
-print('made agent')
-#  creating the TensorFlow session for this experiment
-with tf.Session() as sess:
-    sess.run(tf.global_variables_initializer())
-
-    for episode in range(1, EPISODES):
-        agent, env, sess = run_single_episode(episode,
-                                               agent,
-                                               env,
-                                               sess)
-
-        #  get a batch to learn from
-        observations, actions, returns = agent.memory.get_episode_batch(episode)
-        #  train the model
-        loss = agent.learn(observations, actions, returns, sess)
-
-#  finally collect data from the agent & environment
-global_history = Eternity_Visualizer(episode, agent, env)
-outputs = global_history.output_results()
+    #  finally collect data from the agent & environment - the env only holds
+    #  data if an episode was run (not when resuming a finished experiment)
+    if last_episode >= start:
+        global_history = Eternity_Visualizer(last_episode, agent, env)
+        outputs = global_history.output_results()
+    else:
+        print('no episodes left to run after episode {}'.format(last_episode))
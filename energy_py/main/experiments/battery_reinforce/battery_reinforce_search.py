@@ -0,0 +1,42 @@
+"""
+This experiment script searches REINFORCE hyperparameters on the battery
+environment with successive halving - see main/scripts/hyperparameter_search.py
+
+Arguments are number of configurations & the episodes of the first rung
+    python battery_reinforce_search.py 27 4
+
+Every trial's config & learning curve is written to
+results/reinforce_search.json
+"""
+
+import os
+import sys
+
+from energy_py.envs.battery.battery_env import Battery_Env
+from energy_py.main.scripts.hyperparameter_search import Successive_Halving
+
+NUM_CONFIGS = int(sys.argv[1])
+MIN_EPISODES = int(sys.argv[2])
+
+ENV_KWARGS = {'lag'            : 0,
+              'episode_start'  : 'random',
+              'power_rating'   : 2,  #  in MW
+              'capacity'       : 4,  #  in MWh
+              'verbose'        : 0}
+
+SPACE = {'learning_rate'       : (1e-4, 1e-1),
+         'epsilon_decay_steps' : [1000, 10000, 50000],
+         'hidden_dim'          : [8, 16, 32, 64],
+         'batch_size'          : 64,
+         'episode_length'      : [288, 2016, 3000]}
+
+if __name__ == '__main__':
+    search = Successive_Halving(Battery_Env, ENV_KWARGS, SPACE,
+                                num_configs=NUM_CONFIGS,
+                                min_episodes=MIN_EPISODES,
+                                eta=3,
+                                threads_per_worker=1,
+                                results_path=os.path.join('results', 'reinforce_search.json'),
+                                seed=42)
+    best = search.run()
+    print('best config is {} - score {:.2f}'.format(best['config'], best['score']))
@@ -0,0 +1,358 @@
+"""
+Parallel actor-learner training.
+
+N actor processes each run their own env with a copy of the policy
+network & send whole episodes to a single learner.  The learner adds the
+episodes to the agent memory, learns from them (REINFORCE_Agent.learn_episodes)
+& publishes the new policy weights.  Actors refresh their copy of the
+weights every refresh_every episodes.
+
+Actors act with the NumPy policy network (no TensorFlow in the actor
+processes) - the learner can use either REINFORCE backend.
+
+Weights are published through a block of shared memory with a version
+counter.  The version an actor acted with is sent with each episode, so
+the learner can report the policy lag (how many updates behind the
+learner the actor was).
+
+Actor processes are spawned, so env_class must be importable & scripts
+using Actor_Learner need a __main__ guard.
+"""
+
+import ctypes
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+
+from energy_py.agents.numpy_machinery import Numpy_Gaussian_Policy
+from energy_py.main.scripts.spaces import scaling_bounds
+
+
+class Shared_Weights(object):
+    """
+    Policy weights held in shared memory - one writer (the learner) & many
+    readers (the actors).
+
+    A sequence counter is odd while the weights are being written.  Readers
+    retry if the counter was odd or changed during their copy, so they
+    never see a half written set of weights & the writer never waits.
+
+    Args:
+        params (dict) : name -> np.array - sets the names & shapes
+    """
+    def __init__(self, params):
+        self.names = list(params.keys())
+        self.shapes = [np.shape(params[name]) for name in self.names]
+        self.sizes = [int(np.prod(shape)) for shape in self.shapes]
+
+        self.raw = multiprocessing.RawArray(ctypes.c_double, sum(self.sizes))
+        self.raw_sequence = multiprocessing.RawArray(ctypes.c_int64, 1)
+        self.attach()
+
+        self.publish(params)
+
+    def attach(self):
+        """
+        Creates the numpy views onto the shared blocks
+        """
+        self.flat = np.frombuffer(self.raw, dtype=np.float64)
+        self.sequence = np.frombuffer(self.raw_sequence, dtype=np.int64)
+
+    def __getstate__(self):
+        #  numpy views can't be sent to another process - only the blocks
+        state = self.__dict__.copy()
+        del state['flat']
+        del state['sequence']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.attach()
+
+    @property
+    def version(self):
+        """
+        Number of times the weights have been published since the first
+        publish in __init__ - the initial weights are version 0
+        """
+        return int(self.sequence[0]) // 2 - 1
+
+    def flatten(self, params):
+        """
+        Concatenates params (name -> np.array) into a single vector
+        """
+        return np.concatenate([np.asarray(params[name], dtype=np.float64).reshape(-1)
+                               for name in self.names])
+
+    def unflatten(self, flat):
+        """
+        Splits a single vector back into params (name -> np.array)
+        """
+        params, start = {}, 0
+        for name, shape, size in zip(self.names, self.shapes, self.sizes):
+            params[name] = flat[start:start + size].reshape(shape)
+            start += size
+        return params
+
+    def publish(self, params):
+        """
+        Learner side - writes a new version of the weights
+        """
+        self.sequence[0] += 1
+        self.flat[:] = self.flatten(params)
+        self.sequence[0] += 1
+        return None
+
+    def read_flat(self):
+        """
+        Actor side - a consistent copy of the latest weights as one vector
+
+        Returns:
+            version (int)      :
+            flat    (np.array) :
+        """
+        while True:
+            before = int(self.sequence[0])
+            if before % 2 == 0:
+                flat = self.flat.copy()
+                if int(self.sequence[0]) == before:
+                    return before // 2 - 1, flat
+            time.sleep(0)
+
+    def read(self):
+        """
+        Actor side - a consistent copy of the latest weights
+
+        Returns:
+            version (int)  :
+            params  (dict) : name -> np.array
+        """
+        version, flat = self.read_flat()
+        return version, self.unflatten(flat)
+
+
+def run_actor(actor,
+              env_class,
+              env_kwargs,
+              weights,
+              episodes,
+              stop,
+              refresh_every = 1,
+              seed          = None):
+    """
+    The actor process - runs episodes until stop is set
+
+    Each episode is put onto the episodes queue as a dict of arrays along
+    with the version of the weights used & the time taken.
+
+    Args:
+        actor         (int)            : index of this actor
+        env_class     (class)          : i.e. Battery_Env
+        env_kwargs    (dict)           : args to make the env
+        weights       (Shared_Weights) :
+        episodes      (Queue)          : episodes are sent to the learner here
+        stop          (Event)          :
+        refresh_every (int)            : episodes between weight refreshes
+        seed          (int)            : random seed for this actor
+    """
+    if seed is not None:
+        np.random.seed(seed)
+
+    env = env_class(**env_kwargs)
+    observation_dim = len(env.observation_space)
+    num_actions = len(env.action_space)
+
+    low, inv_range = scaling_bounds(env.observation_space)
+    policy = Numpy_Gaussian_Policy(observation_dim,
+                                   num_actions,
+                                   action_low=[space.low for space in env.action_space],
+                                   action_high=[space.high for space in env.action_space])
+
+    count = 0
+    while not stop.is_set():
+        if count % refresh_every == 0:
+            #  the shapes come from the learner (i.e. any hidden_dim)
+            version, policy.params = weights.read()
+
+        start = time.time()
+        observations, actions, rewards, next_observations = [], [], [], []
+        observation, done = env.reset(), False
+        while done is False:
+            scaled = (np.asarray(observation, dtype=np.float64) - low) * inv_range
+            action = policy.sample(scaled.reshape(1, observation_dim)).reshape(num_actions)
+            next_observation, reward, done, info = env.step(action, count)
+
+            observations.append(observation)
+            actions.append(action)
+            rewards.append(reward)
+            #  envs signal the terminal next_observation with False
+            if next_observation is False or next_observation is None:
+                next_observations.append(np.zeros(observation_dim))
+            else:
+                next_observations.append(next_observation)
+            observation = next_observation
+
+        episode = {'actor': actor,
+                   'version': version,
+                   'seconds': time.time() - start,
+                   'observations': np.array(observations, dtype=np.float64),
+                   'actions': np.array(actions, dtype=np.float64),
+                   'rewards': np.array(rewards, dtype=np.float64),
+                   'next_observations': np.array(next_observations, dtype=np.float64)}
+
+        #  give up on the put if we are stopped while the queue is full
+        while not stop.is_set():
+            try:
+                episodes.put(episode, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        count += 1
+
+    #  don't wait to flush episodes the learner will never read
+    episodes.cancel_join_thread()
+    return None
+
+
+class Actor_Learner(object):
+    """
+    Trains a REINFORCE_Agent with many actor processes
+
+    Usage
+        with Actor_Learner(agent, Battery_Env, env_kwargs, num_actors=4) as trainer:
+            for _ in range(updates):
+                stats = trainer.update()
+
+    Args:
+        agent               (REINFORCE_Agent) : the learner
+        env_class           (class)           : env made in each actor process
+        env_kwargs          (dict)            : args to make the env
+        num_actors          (int)             :
+        session             (tf.Session)      : only for the TensorFlow backend
+        episodes_per_update (int)             : episodes learnt from per update
+                                                (default num_actors)
+        refresh_every       (int)             : actor episodes between weight refreshes
+        epochs              (int)             : passes over each update's experience
+        queue_size          (int)             : episodes held waiting for the learner
+                                                (default 2 * num_actors) - bounds
+                                                the policy lag
+        seed                (int)             : actor i is seeded with seed + i
+    """
+    def __init__(self, agent,
+                       env_class,
+                       env_kwargs,
+                       num_actors,
+                       session             = None,
+                       episodes_per_update = None,
+                       refresh_every       = 1,
+                       epochs              = 4,
+                       queue_size          = None,
+                       seed                = None):
+
+        self.agent      = agent
+        self.session    = session
+        self.num_actors = int(num_actors)
+        self.episodes_per_update = episodes_per_update or self.num_actors
+        self.epochs     = epochs
+
+        #  actors are spawned (not forked) - the learner may hold a
+        #  TensorFlow session & threads
+        context = multiprocessing.get_context('spawn')
+
+        self.weights = Shared_Weights(agent.get_policy_params(session))
+        self.episodes = context.Queue(maxsize=queue_size or 2 * self.num_actors)
+        self.stop = context.Event()
+
+        self.processes = []
+        for actor in range(self.num_actors):
+            actor_seed = None if seed is None else seed + actor
+            process = context.Process(target=run_actor,
+                                      args=(actor, env_class, env_kwargs,
+                                            self.weights, self.episodes, self.stop,
+                                            refresh_every, actor_seed),
+                                      daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        #  new episodes are numbered after those already in the agent memory
+        self.episode_count = max(list(agent.memory.episode_index) + [0])
+        self.start_time = time.time()
+        self.actor_steps = np.zeros(self.num_actors)
+        self.actor_seconds = np.zeros(self.num_actors)
+
+    def get_episode(self):
+        """
+        Helper function for update - waits for an episode from any actor
+
+        Raises if an actor process has died rather than waiting forever
+        """
+        while True:
+            try:
+                return self.episodes.get(timeout=1)
+            except queue.Empty:
+                for actor, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        raise RuntimeError('actor {} exited with code {}'.format(actor,
+                                                                                 process.exitcode))
+
+    def update(self):
+        """
+        Learns from the next episodes_per_update episodes & publishes the
+        new weights
+
+        Returns:
+            stats (dict) :
+                episodes          - episode numbers learnt from
+                losses            - loss for each gradient step
+                policy_lag        - np.array of updates each episode was behind
+                actor_steps_per_s - np.array of env steps/s for each actor
+                total_steps_per_s - env steps/s across all actors (wall clock)
+                version           - version of the weights after this update
+        """
+        received = [self.get_episode() for _ in range(self.episodes_per_update)]
+
+        numbers, lags = [], []
+        for episode in received:
+            self.episode_count += 1
+            numbers.append(self.episode_count)
+            lags.append(self.weights.version - episode['version'])
+
+            self.agent.memory.add_episode(episode['observations'],
+                                          episode['actions'],
+                                          episode['rewards'],
+                                          episode['next_observations'],
+                                          self.episode_count)
+
+            self.actor_steps[episode['actor']] += episode['rewards'].shape[0]
+            self.actor_seconds[episode['actor']] += episode['seconds']
+
+        self.agent.memory.process_episodes(numbers)
+        losses = self.agent.learn_episodes(numbers, self.session, epochs=self.epochs)
+        self.weights.publish(self.agent.get_policy_params(self.session))
+
+        elapsed = max(time.time() - self.start_time, 1e-12)
+        return {'episodes': numbers,
+                'losses': losses,
+                'policy_lag': np.array(lags),
+                'actor_steps_per_s': self.actor_steps / np.maximum(self.actor_seconds, 1e-12),
+                'total_steps_per_s': self.actor_steps.sum() / elapsed,
+                'version': self.weights.version}
+
+    def close(self):
+        """
+        Stops & joins the actor processes
+        """
+        self.stop.set()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
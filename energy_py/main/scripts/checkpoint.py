@@ -0,0 +1,212 @@
+"""
+Periodic checkpoints of an experiment & resuming from them.
+
+A checkpoint is a directory
+    agent.npz   - agent parameters & optimizer state (get_brain_state)
+    memory/     - the agent memory (Agent_Memory.save layout)
+    state.json  - episode counter & the Epsilon_Greedy state
+    rng.npz     - state of the numpy global random number generator (used
+                  by the envs for random episode starts & by the agents)
+
+Checkpoints are written by a background thread.  The agent parameters &
+small state are copied in the training thread - the memory rows are
+copied chunk by chunk by the background thread (Agent_Memory.write_dump),
+so training continues while the checkpoint is written.
+"""
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+#  checkpoint directories are named checkpoint_<episode>
+PREFIX = 'checkpoint_'
+
+
+class Checkpointer(object):
+    """
+    Writes checkpoints of the agent in a background thread
+
+    If a checkpoint is requested while the previous one is still being
+    written, the newer checkpoint replaces any checkpoint still waiting -
+    save never blocks on disk.
+
+    If writing a checkpoint fails the error is kept & raised by the next
+    save, wait or close - the thread carries on with later checkpoints.
+
+    Args:
+        directory (str) : where to write the checkpoints
+        keep      (int) : number of most recent checkpoints to keep
+    """
+    def __init__(self, directory, keep=2):
+        self.directory = directory
+        self.keep      = keep
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.pending = None
+        self.condition = threading.Condition()
+        self.writing = False
+        self.closed = False
+        self.error = None
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def save(self, episode, agent, session=None):
+        """
+        Snapshots the agent & queues the snapshot for writing
+
+        Args:
+            episode (int)        : the last completed episode
+            agent   (Base_Agent) :
+            session (tf.Session) :
+        """
+        self.raise_error()
+        brain = agent.get_brain_state(session)
+        memory_dump = agent.memory.dump()
+
+        greedy = agent.epsilon_greedy
+        state = {'episode': int(episode),
+                 'epsilon_greedy': {'steps': int(greedy.steps),
+                                    'epsilon': float(greedy.epsilon),
+                                    'mode': greedy.mode}}
+
+        name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        rng = {'keys': keys, 'pos': pos,
+               'has_gauss': has_gauss, 'cached_gaussian': cached_gaussian}
+
+        with self.condition:
+            self.pending = (episode, brain, agent.memory, memory_dump, state, rng)
+            self.condition.notify()
+        return None
+
+    def worker(self):
+        """
+        The background thread - writes the most recent pending snapshot
+        """
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return None
+                snapshot, self.pending = self.pending, None
+                self.writing = True
+
+            try:
+                self.write(*snapshot)
+            except Exception as error:
+                #  kept for the training thread - see raise_error
+                with self.condition:
+                    self.error = error
+            finally:
+                with self.condition:
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def raise_error(self):
+        """
+        Raises (once) the error of a failed checkpoint write
+        """
+        with self.condition:
+            error, self.error = self.error, None
+        if error is not None:
+            raise RuntimeError('writing a checkpoint failed') from error
+        return None
+
+    def write(self, episode, brain, memory, memory_dump, state, rng):
+        """
+        Writes a snapshot into a temporary directory & renames it into place
+        """
+        final = os.path.join(self.directory, '{}{}'.format(PREFIX, episode))
+        temp = final + '.tmp'
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+
+        np.savez(os.path.join(temp, 'agent.npz'), **brain)
+        memory.write_dump(os.path.join(temp, 'memory'), memory_dump)
+        np.savez(os.path.join(temp, 'rng.npz'), **rng)
+        with open(os.path.join(temp, 'state.json'), 'w') as handle:
+            json.dump(state, handle, indent=2)
+
+        shutil.rmtree(final, ignore_errors=True)
+        os.rename(temp, final)
+
+        for old in list_checkpoints(self.directory)[:-self.keep]:
+            shutil.rmtree(old, ignore_errors=True)
+        return None
+
+    def wait(self):
+        """
+        Blocks until all queued checkpoints are written
+        """
+        with self.condition:
+            while (self.pending is not None or self.writing) and self.thread.is_alive():
+                self.condition.wait(timeout=1)
+        self.raise_error()
+
+    def close(self):
+        """
+        Writes any queued checkpoint & stops the background thread
+        """
+        try:
+            self.wait()
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify()
+            self.thread.join()
+
+
+def list_checkpoints(directory):
+    """
+    Complete checkpoints in directory - oldest first
+    """
+    if not os.path.exists(directory):
+        return []
+
+    checkpoints = []
+    for name in os.listdir(directory):
+        suffix = name[len(PREFIX):]
+        if name.startswith(PREFIX) and suffix.isdigit():
+            checkpoints.append((int(suffix), os.path.join(directory, name)))
+    return [path for _, path in sorted(checkpoints)]
+
+
+def latest_checkpoint(directory):
+    """
+    The most recent complete checkpoint in directory (None if there isn't one)
+    """
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def restore_checkpoint(path, agent, session=None):
+    """
+    Restores the agent, memory, exploration schedule & random state
+
+    For TensorFlow agents run the variable initializer before restoring.
+
+    Returns:
+        episode (int) : the last completed episode - resume from episode + 1
+    """
+    with open(os.path.join(path, 'state.json')) as handle:
+        state = json.load(handle)
+
+    with np.load(os.path.join(path, 'agent.npz')) as brain:
+        agent.set_brain_state({name: brain[name] for name in brain.files}, session)
+
+    agent.memory.load(os.path.join(path, 'memory'), mmap=False)
+
+    greedy = agent.epsilon_greedy
+    greedy.steps = state['epsilon_greedy']['steps']
+    greedy.epsilon = state['epsilon_greedy']['epsilon']
+    greedy.mode = state['epsilon_greedy']['mode']
+
+    with np.load(os.path.join(path, 'rng.npz')) as rng:
+        np.random.set_state(('MT19937', rng['keys'], int(rng['pos']),
+                             int(rng['has_gauss']), float(rng['cached_gaussian'])))
+
+    return state['episode']
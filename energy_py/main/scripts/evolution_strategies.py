@@ -0,0 +1,240 @@
+"""
+Evolution strategies (ES) training of the policy network.
+
+Each generation the policy parameters are perturbed with Gaussian noise &
+every perturbation is evaluated on env episodes in a process pool.  The
+parameters move towards the perturbations that did well.
+
+Only seeds & scalar returns are exchanged with the workers
+    - the current parameters are published once per generation through
+      shared memory (Shared_Weights)
+    - each task is a (noise seed, sign, episode seed) - the worker rebuilds
+      the perturbation from the noise seed
+    - each worker returns the total reward of its episodes
+The learner rebuilds the same perturbations from the seeds for the update.
+
+Perturbations are antithetic (+noise & -noise share a seed) & all members
+of a generation see the same episodes (common random numbers) - both
+reduce the variance of the update.
+
+Episodes are evaluated with the mean action of the Gaussian policy (the
+exploration comes from the parameter noise) using the same single
+observation inference path as Policy_Artifact.act.
+
+Workers are spawned, so env_class must be importable & scripts need a
+__main__ guard.
+"""
+
+import time
+
+import numpy as np
+
+from energy_py.agents.numpy_machinery import LAYERS, adam_update
+from energy_py.main.scripts.actor_learner import Shared_Weights
+from energy_py.main.scripts.hyperparameter_search import make_pool
+from energy_py.main.scripts.spaces import scaling_bounds
+
+#  state of each worker process - set by init_worker
+WORKER = {}
+
+
+def init_worker(env_class, env_kwargs, weights):
+    """
+    Pool initializer - makes the env once per worker process
+    """
+    env = env_class(**env_kwargs)
+    low, inv_range = scaling_bounds(env.observation_space)
+
+    WORKER['env'] = env
+    WORKER['weights'] = weights
+    WORKER['observation_low'] = low
+    WORKER['observation_inv_range'] = inv_range
+    WORKER['action_low'] = np.array([space.low for space in env.action_space])
+    WORKER['action_high'] = np.array([space.high for space in env.action_space])
+    return None
+
+
+def run_policy_episode(env, layers, observation_low, observation_inv_range,
+                       action_low, action_high, episode_seed):
+    """
+    Total reward of one episode acting with the mean of the policy
+
+    Args:
+        layers       (list) : (W transposed, b) for each layer
+        episode_seed (int)  : seeds the env (i.e. a random episode start)
+    """
+    np.random.seed(episode_seed)
+    observation, done = env.reset(), False
+
+    total = 0.0
+    while done is False:
+        hidden = (observation - observation_low) * observation_inv_range
+        for W_T, b in layers[:-1]:
+            hidden = np.maximum(W_T.dot(hidden) + b, 0)
+        W_T, b = layers[-1]
+        action = (W_T.dot(hidden) + b)[0::2]
+        action = np.minimum(np.maximum(action, action_low), action_high)
+
+        observation, reward, done, info = env.step(action, 0)
+        total += reward
+    return total
+
+
+def evaluate_perturbation(task):
+    """
+    Worker side - total reward of a perturbation of the current weights
+
+    Args:
+        task (tuple) : noise_seed, sign, sigma, episode_seeds
+
+    Returns:
+        total_reward (float) : summed over episode_seeds
+    """
+    noise_seed, sign, sigma, episode_seeds = task
+    weights = WORKER['weights']
+
+    version, flat = weights.read_flat()
+    flat += sign * sigma * np.random.RandomState(noise_seed).standard_normal(flat.shape[0])
+    params = weights.unflatten(flat)
+
+    layers = [(np.ascontiguousarray(params['{}/W'.format(layer)].T),
+               params['{}/b'.format(layer)]) for layer in LAYERS]
+
+    return sum(run_policy_episode(WORKER['env'], layers,
+                                  WORKER['observation_low'],
+                                  WORKER['observation_inv_range'],
+                                  WORKER['action_low'],
+                                  WORKER['action_high'],
+                                  seed) for seed in episode_seeds)
+
+
+def centered_ranks(returns):
+    """
+    Fitness shaping - returns replaced by their rank scaled to [-0.5, 0.5]
+
+    Makes the update invariant to the scale of the rewards & robust to
+    outlier episodes
+    """
+    ranks = np.empty(returns.shape[0])
+    ranks[np.argsort(returns)] = np.arange(returns.shape[0])
+    return ranks / max(returns.shape[0] - 1, 1) - 0.5
+
+
+class Evolution_Strategies(object):
+    """
+    Trains the policy network of an agent with evolution strategies
+
+    Usage
+        with Evolution_Strategies(agent, Battery_Env, env_kwargs) as es:
+            for _ in range(generations):
+                stats = es.step()
+
+    The agent must have get_policy_params & set_policy_params (i.e.
+    REINFORCE_Agent) - the agent holds the trained parameters after every
+    step.
+
+    Args:
+        agent             (REINFORCE_Agent) :
+        env_class         (class)           : env made in each worker process
+        env_kwargs        (dict)            : args to make the env
+        population_size   (int)             : perturbations per generation (even)
+        sigma             (float)           : stdev of the parameter noise
+        learning_rate     (float)           : Adam learning rate
+        episodes_per_eval (int)             : episodes each perturbation is evaluated on
+        num_workers       (int)             : processes in the pool (default all cores)
+        session           (tf.Session)      : only for the TensorFlow backend
+        seed              (int)             :
+    """
+    def __init__(self, agent,
+                       env_class,
+                       env_kwargs,
+                       population_size   = 50,
+                       sigma             = 0.1,
+                       learning_rate     = 0.01,
+                       episodes_per_eval = 1,
+                       num_workers       = None,
+                       session           = None,
+                       seed              = None):
+
+        if population_size % 2 != 0:
+            raise ValueError('population_size must be even for antithetic sampling')
+
+        self.agent             = agent
+        self.session           = session
+        self.population_size   = population_size
+        self.sigma             = sigma
+        self.learning_rate     = learning_rate
+        self.episodes_per_eval = episodes_per_eval
+
+        self.random_state = np.random.RandomState(seed)
+
+        params = agent.get_policy_params(session)
+        self.weights = Shared_Weights(params)
+        self.theta = self.weights.flatten(params)
+
+        #  Adam optimizer state - held for the single flat vector
+        self.m = {'theta': np.zeros_like(self.theta)}
+        self.v = {'theta': np.zeros_like(self.theta)}
+        self.t = 0
+
+        #  spawned workers with one thread each - see make_pool
+        self.pool = make_pool(num_workers,
+                              initializer=init_worker,
+                              initargs=(env_class, env_kwargs, self.weights))
+
+    def step(self):
+        """
+        Evaluates one generation & updates the parameters
+
+        Returns:
+            stats (dict) :
+                mean_return - mean total reward over the population
+                max_return  - best total reward in the population
+                seconds     - time taken to evaluate the generation
+        """
+        num_pairs = self.population_size // 2
+        noise_seeds = self.random_state.randint(0, 2 ** 31 - 1, size=num_pairs)
+        episode_seeds = [int(seed) for seed in self.random_state.randint(0, 2 ** 31 - 1,
+                                                                         size=self.episodes_per_eval)]
+
+        tasks = [(int(seed), sign, self.sigma, episode_seeds)
+                 for seed in noise_seeds for sign in (1, -1)]
+
+        start = time.time()
+        returns = np.array(self.pool.map(evaluate_perturbation, tasks))
+        seconds = time.time() - start
+
+        #  antithetic pairs - the +noise & -noise returns for each seed
+        shaped = centered_ranks(returns).reshape(num_pairs, 2)
+        gradient = np.zeros_like(self.theta)
+        for seed, (plus, minus) in zip(noise_seeds, shaped):
+            noise = np.random.RandomState(int(seed)).standard_normal(self.theta.shape[0])
+            gradient += (plus - minus) * noise
+        gradient /= self.population_size * self.sigma
+
+        #  Adam minimizes - so step along the negative gradient of the return
+        self.t += 1
+        adam_update({'theta': self.theta}, {'theta': -gradient},
+                    self.m, self.v, self.t, self.learning_rate)
+
+        params = self.weights.unflatten(self.theta)
+        self.weights.publish(params)
+        self.agent.set_policy_params(params, self.session)
+
+        return {'mean_return': float(returns.mean()),
+                'max_return': float(returns.max()),
+                'seconds': seconds}
+
+    def close(self):
+        """
+        Stops the worker processes
+        """
+        self.pool.close()
+        self.pool.join()
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
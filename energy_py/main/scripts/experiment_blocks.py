@@ -1,6 +1,9 @@
 """
 """
 
+import numpy as np
+
+
 def run_single_episode(episode_number,
                        agent,
                        env,
@@ -19,7 +22,7 @@ def run_single_episode(episode_number,
         #  take one step through the environment
         next_observation, reward, done, info = env.step(action, episode_number)
         #  store the expWWerience
-        agent.memory.add_experience(observation, action, reward, next_observation, step, episode_number)
+        agent.memory.add_experience(observation, action, reward, next_observation, step, episode_number, done)
         step += 1
         observation = next_observation
 
@@ -27,3 +30,50 @@ def run_single_episode(episode_number,
     agent.memory.process_episode(episode_number)
     return agent, env, sess
 
+
+def run_parallel_episodes(episode_numbers,
+                          agent,
+                          envs,
+                          sess=None):
+    """
+    Helper function to run one episode in each of many environments
+
+    The envs step in lockstep - the actions for all envs still running are
+    selected with a single agent.act_batch call.
+
+    Experience for each env is held until its episode is done & then added
+    to the agent memory, so that each episode is contiguous in memory.
+
+    Args:
+        episode_numbers (list) : one episode number per env
+        agent           (Base_Agent) :
+        envs            (list) : environment objects
+        sess            (tf.Session) :
+    """
+    assert len(episode_numbers) == len(envs)
+
+    observations = [env.reset() for env in envs]
+    histories = [[] for _ in envs]
+    running = list(range(len(envs)))
+
+    while running:
+        #  select actions for all of the running envs at once
+        actions = agent.act_batch(np.array([observations[i] for i in running]), sess)
+
+        still_running = []
+        for i, action in zip(running, actions):
+            next_observation, reward, done, info = envs[i].step(action, episode_numbers[i])
+            histories[i].append((observations[i], action, reward, next_observation, done))
+            observations[i] = next_observation
+
+            if done:
+                for step, (obs, act, rew, next_obs, dn) in enumerate(histories[i]):
+                    agent.memory.add_experience(obs, act, rew, next_obs, step, episode_numbers[i], dn)
+                histories[i] = []
+            else:
+                still_running.append(i)
+        running = still_running
+
+    #  now all episodes are done - process them in the agent memory
+    agent.memory.process_episodes(episode_numbers)
+    return agent, envs, sess
@@ -0,0 +1,230 @@
+"""
+A config driven runner for many experiments at once.
+
+    python -m energy_py.main.scripts.experiment_runner config.json
+
+The config is a JSON file
+    {
+     "output_dir": "nightly",
+     "num_workers": 4,
+     "threads_per_worker": 1,
+     "experiments": [
+        {"name": "reinforce",
+         "env": {"class": "energy_py.envs.battery.battery_env.Battery_Env",
+                 "params": {"lag": 0, "episode_length": 2016, ...}},
+         "agent": {"class": "energy_py.agents.policy_based.reinforce.REINFORCE_Agent",
+                   "params": {"epsilon_decay_steps": 100000, "backend": "numpy"}},
+         "episodes": 100,
+         "seeds": [0, 1, 2],
+         "learn": {"method": "episode"},
+         "outputs": false,
+         "figures": "inline"}
+        ]
+    }
+
+Each (experiment, seed) is a run.  Runs are spread over a process pool -
+each run gets its own output directory
+    <output_dir>/<experiment name>/seed_<seed>/
+& is run with that directory as the working directory, so the relative
+'results/' paths of the visualizers stay inside the run.
+
+Each run writes summary.json (config, learning curve, score, time & any
+error).  The runner writes <output_dir>/summary.json with every run & the
+score of each experiment across its seeds.
+
+figures sets the figure renderer for the outputs - 'inline' or 'off'.  Runs
+are already in worker processes, so there is no 'background' rendering.
+
+learn methods
+    episode     - agent.learn on each episode (i.e. REINFORCE)
+    transitions - agent.learn_transitions with steps per episode (i.e. Q_Learner)
+    none        - no learning (i.e. naive agents)
+"""
+
+import importlib
+import json
+import os
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from energy_py.main.scripts.hyperparameter_search import WORKER, make_pool
+
+#  fraction of the episodes at the end of a run used to score it
+SCORE_FRACTION = 0.1
+
+
+def import_object(path):
+    """
+    Imports an object from its dotted path - i.e. package.module.Class
+    """
+    module_name, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), name)
+
+
+def load_config(path):
+    """
+    Reads a config & expands it into one dict per run
+    """
+    with open(path) as handle:
+        config = json.load(handle)
+
+    runs = []
+    for experiment in config['experiments']:
+        for seed in experiment.get('seeds', [0]):
+            run = dict(experiment)
+            run['seed'] = seed
+            run['run_dir'] = os.path.abspath(os.path.join(config.get('output_dir', 'experiments'),
+                                                          experiment['name'],
+                                                          'seed_{}'.format(seed)))
+            runs.append(run)
+    return config, runs
+
+
+def train(run):
+    """
+    Helper function for run_experiment - makes the env & agent & trains
+
+    Returns:
+        curve (list) : total reward of each episode
+    """
+    from energy_py.main.scripts.experiment_blocks import run_single_episode
+    from energy_py.main.scripts.figure_renderer import set_renderer
+    from energy_py.main.scripts.visualizers import Eternity_Visualizer
+
+    env = import_object(run['env']['class'])(**run['env'].get('params', {}))
+
+    #  a previous run in this worker may have built a TensorFlow graph
+    if 'tensorflow' in sys.modules:
+        sys.modules['tensorflow'].reset_default_graph()
+
+    session = None
+    agent = import_object(run['agent']['class'])(env, **run['agent'].get('params', {}))
+
+    if getattr(agent, 'backend', None) == 'tensorflow':
+        import tensorflow as tf
+        threads = WORKER.get('threads', 1)
+        session = tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                   inter_op_parallelism_threads=1))
+        session.run(tf.global_variables_initializer())
+        if hasattr(agent, 'update_target_network'):
+            agent.update_target_network(session)
+
+    learn = run.get('learn', {})
+    method = learn.get('method', 'episode')
+    if method not in ('episode', 'transitions', 'none'):
+        raise ValueError('unknown learn method {}'.format(method))
+
+    curve = []
+    try:
+        for episode in range(1, run['episodes'] + 1):
+            agent, env, session = run_single_episode(episode, agent, env, session)
+
+            if method == 'episode':
+                observations, actions, returns = agent.memory.get_episode_batch(episode)
+                agent.learn(observations, actions, returns, session)
+            elif method == 'transitions':
+                losses = agent.learn_transitions(session, steps=learn.get('steps', 1))
+                agent.memory.losses.append(float(np.mean(losses)) if losses else np.nan)
+
+            curve.append(float(agent.memory.episode_stats[episode][0]))
+
+        if run.get('outputs', False):
+            set_renderer(run.get('figures', 'inline'))
+            Eternity_Visualizer(run['episodes'], agent, env).output_results()
+    finally:
+        #  pool workers exit without running atexit finalizers - a memmap
+        #  memory would leave its temporary directory behind
+        agent.memory.close()
+        if session is not None:
+            session.close()
+    return curve
+
+
+def run_experiment(run):
+    """
+    Worker side - a single run in its own output directory
+
+    Errors are recorded in the summary rather than raised, so one failed
+    run doesn't stop the others.
+
+    Returns:
+        summary (dict) : also written to <run_dir>/summary.json
+    """
+    os.makedirs(run['run_dir'], exist_ok=True)
+    owd = os.getcwd()
+    os.chdir(run['run_dir'])
+
+    start = time.time()
+    summary = {'name': run['name'],
+               'seed': run['seed'],
+               'run_dir': run['run_dir'],
+               'config': {key: run[key] for key in ('env', 'agent', 'episodes', 'learn')
+                          if key in run}}
+    try:
+        np.random.seed(run['seed'])
+        curve = train(run)
+        count = max(1, int(np.ceil(len(curve) * SCORE_FRACTION)))
+        summary.update({'status': 'ok',
+                        'curve': curve,
+                        'score': float(np.mean(curve[-count:])) if curve else None})
+    except Exception:
+        summary.update({'status': 'error',
+                        'error': traceback.format_exc()})
+    finally:
+        summary['seconds'] = time.time() - start
+        with open('summary.json', 'w') as handle:
+            json.dump(summary, handle, indent=2)
+        os.chdir(owd)
+
+    return summary
+
+
+def run_experiments(config_path):
+    """
+    Runs every (experiment, seed) in a config across a process pool
+
+    Returns:
+        summary (dict) : also written to <output_dir>/summary.json
+    """
+    config, runs = load_config(config_path)
+
+    start = time.time()
+    pool = make_pool(config.get('num_workers'), config.get('threads_per_worker', 1))
+    try:
+        results = pool.map(run_experiment, runs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    experiments = {}
+    for result in results:
+        scores = experiments.setdefault(result['name'], [])
+        if result['status'] == 'ok' and result['score'] is not None:
+            scores.append(result['score'])
+
+    summary = {'config': os.path.abspath(config_path),
+               'seconds': time.time() - start,
+               'experiments': {name: {'mean_score': float(np.mean(scores)) if scores else None,
+                                      'std_score': float(np.std(scores)) if scores else None,
+                                      'completed_runs': len(scores)}
+                               for name, scores in experiments.items()},
+               'runs': [{key: result.get(key) for key in ('name', 'seed', 'status', 'score',
+                                                          'seconds', 'run_dir')}
+                        for result in results]}
+
+    output_dir = config.get('output_dir', 'experiments')
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as handle:
+        json.dump(summary, handle, indent=2)
+
+    return summary
+
+
+if __name__ == '__main__':
+    summary = run_experiments(sys.argv[1])
+    for name, stats in sorted(summary['experiments'].items()):
+        print('{} - mean score {} over {} runs'.format(name, stats['mean_score'],
+                                                       stats['completed_runs']))
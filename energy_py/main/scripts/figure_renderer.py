@@ -0,0 +1,315 @@
+"""
+Rendering of figures off the training process.
+
+Visualizers build a figure job - a dict of the data & spec of a figure -
+& hand it to a Figure_Renderer.  A job holds only numpy arrays, so it is
+cheap to send to another process.
+
+Renderer modes
+    background - jobs are rendered in a separate process with the Agg
+                 backend.  Training only waits if queue_size jobs are
+                 already waiting
+    inline     - jobs are rendered immediately in this process
+    off        - jobs are dropped (i.e. headless training)
+
+Every figure is closed once it is saved, so long runs don't hold one
+figure per episode in memory.
+
+The renderer used by the visualizers is set with set_renderer.  Experiment
+scripts call start_renderer at the top of their __main__ guard - a
+background renderer unless the ENERGY_PY_FIGURES env var sets another
+mode.  Otherwise the mode is read from ENERGY_PY_FIGURES ('inline' if not
+set) when the first figure is made.
+
+The background process is spawned (not forked) - forking a process that
+already runs TensorFlow sessions or threads can deadlock the child.  A
+spawned process imports the __main__ module again, so scripts that render
+in the background need a __main__ guard.
+
+A job
+    {'series': OrderedDict of name -> (index, values) np.arrays,
+     'xlabel': str, 'ylabel': str, 'xlim': [start, end], 'ylim': list,
+     'path': str or None}
+Each line has its own index - downsampling keeps different points of each
+column (see min_max_downsample).
+"""
+
+import atexit
+import ctypes
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+
+import numpy as np
+
+from energy_py.main.scripts.utils import ensure_dir
+
+MODES = ['background', 'inline', 'off']
+
+
+def draw_time_series(job):
+    """
+    Draws the time series figure of a job
+
+    Returns:
+        fig (matplotlib.figure.Figure) :
+    """
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
+    start, end = job['xlim']
+    dates = isinstance(start, (np.datetime64, pd.Timestamp))
+    if dates:
+        start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+
+    #  make the figure & axes objects
+    fig, ax = plt.subplots(1, 1, figsize=(20, 20))
+    for col, (index, data) in job['series'].items():
+        if dates:
+            #  older matplotlib can't plot datetime64 directly
+            index = pd.to_datetime(index).to_pydatetime()
+        ax.plot(index, data, label=col)
+    ax.set_xlabel(job['xlabel'])
+    ax.set_ylabel(job['ylabel'])
+    ax.legend()
+
+    if job['ylim']:
+        ax.set_ylim(job['ylim'])
+    ax.set_xlim([start, end])
+
+    return fig
+
+
+def min_max_downsample(values, max_points):
+    """
+    Positions of the points to plot for a long series - the min & max of
+    each of max_points / 2 equal buckets, plus the first & last points
+
+    Unlike striding or averaging this keeps every peak & trough, so the
+    plot looks the same as plotting every point.  NaNs are ignored.
+
+    Args:
+        values     (np.array) : 1D
+        max_points (int)      :
+
+    Returns:
+        positions (np.array) : sorted integer positions into values
+    """
+    num_points = values.shape[0]
+    if max_points is None or num_points <= max_points:
+        return np.arange(num_points)
+
+    size = int(np.ceil(num_points / max(max_points // 2, 1)))
+    num_buckets = int(np.ceil(num_points / size))
+    padded = np.full(num_buckets * size, np.nan)
+    padded[:num_points] = values
+    buckets = padded.reshape(num_buckets, size)
+
+    offsets = np.arange(num_buckets) * size
+    lows = np.argmin(np.where(np.isnan(buckets), np.inf, buckets), axis=1) + offsets
+    highs = np.argmax(np.where(np.isnan(buckets), -np.inf, buckets), axis=1) + offsets
+
+    positions = np.concatenate([[0, num_points - 1], lows, highs])
+    return np.unique(np.minimum(positions, num_points - 1))
+
+
+def render(job):
+    """
+    Draws a job, saves it to job['path'] & closes the figure
+    """
+    import matplotlib.pyplot as plt
+
+    fig = draw_time_series(job)
+    try:
+        ensure_dir(job['path'])
+        fig.savefig(job['path'])
+    finally:
+        plt.close(fig)
+    return None
+
+
+def run_renderer(jobs, done, errors):
+    """
+    The background process - renders jobs until it gets None
+
+    Args:
+        jobs   (Queue)    : figure jobs
+        done   (RawValue) : count of jobs finished (rendered or failed)
+        errors (Queue)    : (path, traceback) of each failed job
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        try:
+            render(job)
+        except Exception:
+            errors.put((job['path'], traceback.format_exc()))
+        done.value += 1
+    return None
+
+
+class Figure_Renderer(object):
+    """
+    Renders figure jobs - see module docstring
+
+    Usage
+        with Figure_Renderer('background') as renderer:
+            set_renderer(renderer)
+            ...  training & visualizers
+        #  all figures are saved here
+
+    Args:
+        mode       (str) : 'background', 'inline' or 'off'
+        queue_size (int) : jobs waiting for the background process before
+                           submit blocks - bounds the memory held by jobs
+    """
+    def __init__(self, mode='background', queue_size=8):
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(MODES))
+        self.mode = mode
+        self.submitted = 0
+        self.process = None
+
+        if self.mode == 'background':
+            #  jobs are plain numpy payloads - nothing needs to be inherited
+            context = multiprocessing.get_context('spawn')
+
+            self.jobs = context.Queue(maxsize=queue_size)
+            self.errors = context.Queue()
+            self.done = context.RawValue(ctypes.c_int64, 0)
+            self.process = context.Process(target=run_renderer,
+                                           args=(self.jobs, self.done, self.errors),
+                                           daemon=True)
+            self.process.start()
+
+    def submit(self, job):
+        """
+        Renders a job according to the mode
+
+        Returns:
+            fig (matplotlib.figure.Figure) : only for inline mode (closed)
+        """
+        if self.mode == 'off':
+            return None
+
+        if self.mode == 'inline':
+            import matplotlib.pyplot as plt
+            fig = draw_time_series(job)
+            if job['path']:
+                ensure_dir(job['path'])
+                fig.savefig(job['path'])
+            plt.close(fig)
+            return fig
+
+        #  a figure that isn't saved has nothing to render
+        if not job['path']:
+            return None
+
+        #  only wait for space in the queue while the process is alive
+        while True:
+            self.check_alive()
+            try:
+                self.jobs.put(job, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.submitted += 1
+        return None
+
+    def check_alive(self):
+        if self.process is not None and not self.process.is_alive():
+            raise RuntimeError('figure renderer exited with code {}'.format(self.process.exitcode))
+
+    def wait(self):
+        """
+        Blocks until every submitted job is rendered
+
+        Failed jobs are printed rather than raised - a figure shouldn't
+        stop training
+
+        Returns:
+            failed (list) : paths of the jobs that failed since the last wait
+        """
+        if self.process is None:
+            return []
+
+        while self.done.value < self.submitted:
+            self.check_alive()
+            time.sleep(0.01)
+
+        failed = []
+        while True:
+            try:
+                path, error = self.errors.get_nowait()
+            except queue.Empty:
+                break
+            print('figure {} failed\n{}'.format(path, error))
+            failed.append(path)
+        return failed
+
+    def close(self):
+        """
+        Waits for the submitted jobs & stops the background process
+        """
+        if self.process is None:
+            return None
+        if self.process.is_alive():
+            self.wait()
+            self.jobs.put(None)
+            self.process.join()
+        self.process = None
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#  the renderer used by the visualizers - see get_renderer
+RENDERER = {}
+
+
+def set_renderer(renderer):
+    """
+    Sets the renderer used by the visualizers
+
+    Args:
+        renderer (Figure_Renderer or str) : a renderer or a mode
+    """
+    if not isinstance(renderer, Figure_Renderer):
+        renderer = Figure_Renderer(renderer)
+        #  we made it - so we make sure its figures are saved on exit
+        atexit.register(renderer.close)
+    RENDERER['renderer'] = renderer
+    return renderer
+
+
+def start_renderer(default='background'):
+    """
+    Sets the renderer for an experiment script - the mode is read from the
+    ENERGY_PY_FIGURES env var (i.e. 'off' for headless training)
+
+    Call inside the __main__ guard before any TensorFlow session, threads
+    or processes are started
+    """
+    return set_renderer(os.environ.get('ENERGY_PY_FIGURES', default))
+
+
+def get_renderer():
+    """
+    The renderer used by the visualizers - made from the ENERGY_PY_FIGURES
+    env var on first use
+    """
+    if 'renderer' not in RENDERER:
+        set_renderer(os.environ.get('ENERGY_PY_FIGURES', 'inline'))
+    return RENDERER['renderer']
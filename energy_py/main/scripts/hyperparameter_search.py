@@ -0,0 +1,363 @@
+"""
+Hyperparameter search for REINFORCE_Agent with successive halving.
+
+Configurations are sampled from a search space & trained in a process
+pool.  All configurations start with a small budget of episodes - after
+each rung only the best 1 / eta are promoted & trained further, so little
+compute is spent on bad configurations.
+
+Promoted trials continue from where they stopped (agent parameters &
+exploration schedule are passed back from the worker) rather than
+starting again.
+
+hyperband runs several successive halving brackets that trade off the
+number of configurations against the starting budget.
+
+Every trial's learning curve (total reward per episode) is recorded &
+written to a JSON file after each rung.
+
+Search space
+    a list  - a value is chosen uniformly
+    a tuple - (low, high) sampled log-uniformly (i.e. learning rates)
+    other   - fixed
+
+Keys are passed to REINFORCE_Agent (learning_rate, epsilon_decay_steps,
+batch_size, hidden_dim) except episode_length, which is passed to the env.
+"""
+
+import json
+import math
+import multiprocessing
+import os
+
+import numpy as np
+
+from energy_py.main.scripts.utils import ensure_dir
+
+#  set in the worker processes - BLAS & TensorFlow thread pools are sized
+#  from these when they are first imported
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+#  search space keys that are passed to the env rather than the agent
+ENV_KEYS = ['episode_length']
+
+
+def sample_config(space, random_state):
+    """
+    Samples a single configuration from a search space - see module docstring
+    """
+    config = {}
+    for name, values in sorted(space.items()):
+        if isinstance(values, list):
+            value = values[random_state.randint(len(values))]
+        elif isinstance(values, tuple):
+            low, high = values
+            value = float(np.exp(random_state.uniform(np.log(low), np.log(high))))
+        else:
+            value = values
+
+        #  numpy scalars aren't JSON serializable
+        config[name] = value.item() if isinstance(value, np.generic) else value
+    return config
+
+
+#  state of each worker process - set by init_worker
+WORKER = {}
+
+
+def init_worker(threads):
+    """
+    Pool initializer - limits the threads used by each worker
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    WORKER['threads'] = threads
+    return None
+
+
+def run_trial(task):
+    """
+    Worker side - trains one configuration up to a total number of episodes
+
+    Args:
+        task (tuple) : trial_id, config, env_class, env_kwargs, total_episodes,
+                       state, backend, seed
+                       state is None for a new trial or the state returned
+                       by the previous rung
+
+    Returns:
+        result (dict) : trial_id, curve (total reward of each new episode) & state
+    """
+    (trial_id, config, env_class, env_kwargs,
+     total_episodes, state, backend, seed) = task
+
+    from energy_py.agents.policy_based.reinforce import REINFORCE_Agent
+    from energy_py.main.scripts.experiment_blocks import run_single_episode
+
+    np.random.seed(seed)
+
+    env_kwargs = dict(env_kwargs)
+    env_kwargs.update({key: config[key] for key in ENV_KEYS if key in config})
+    env = env_class(**env_kwargs)
+
+    agent_kwargs = {key: value for key, value in config.items() if key not in ENV_KEYS}
+    agent_kwargs.setdefault('epsilon_decay_steps', 10000)
+
+    session = None
+    if backend == 'tensorflow':
+        import tensorflow as tf
+        #  each trial in a worker gets a fresh graph
+        tf.reset_default_graph()
+
+    agent = REINFORCE_Agent(env, backend=backend, **agent_kwargs)
+
+    if backend == 'tensorflow':
+        threads = WORKER.get('threads', 1)
+        session = tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                   inter_op_parallelism_threads=1))
+        session.run(tf.global_variables_initializer())
+
+    done = 0
+    if state is not None:
+        agent.set_brain_state(state['brain'], session)
+        agent.epsilon_greedy.steps = state['epsilon_steps']
+        done = state['episodes']
+
+    curve = []
+    for episode in range(done + 1, total_episodes + 1):
+        agent, env, session = run_single_episode(episode, agent, env, session)
+        observations, actions, returns = agent.memory.get_episode_batch(episode)
+        agent.learn(observations, actions, returns, session)
+        curve.append(agent.memory.episode_stats[episode][0])
+
+        #  REINFORCE learns from each episode once - keep memory small
+        agent.memory.reset()
+
+    state = {'brain': agent.get_brain_state(session),
+             'epsilon_steps': agent.epsilon_greedy.steps,
+             'episodes': total_episodes}
+    if session is not None:
+        session.close()
+
+    return {'trial_id': trial_id, 'curve': curve, 'state': state}
+
+
+class Successive_Halving(object):
+    """
+    Successive halving over configurations of REINFORCE_Agent
+
+    Usage
+        search = Successive_Halving(Battery_Env, env_kwargs, space, num_configs=27)
+        best = search.run()
+
+    Rung r trains the surviving trials up to min_episodes * eta ** r
+    episodes in total.
+
+    Args:
+        env_class          (class) : env made in each worker
+        env_kwargs         (dict)  : args to make the env
+        space              (dict)  : search space - see module docstring
+        num_configs        (int)   : configurations sampled for the first rung
+        min_episodes       (int)   : episodes per trial in the first rung
+        eta                (int)   : 1 / eta of the trials are promoted
+        max_episodes       (int)   : budget of a single trial (limits the rungs)
+        score_fraction     (float) : trials are scored on the mean total reward
+                                     of the last fraction of their curve
+        num_workers        (int)   : processes in the pool (default all cores)
+        threads_per_worker (int)   : BLAS & TensorFlow threads in each worker
+        backend            (str)   : REINFORCE_Agent backend
+        results_path       (str)   : JSON file for the trials (None = don't write)
+        seed               (int)   :
+    """
+    def __init__(self, env_class,
+                       env_kwargs,
+                       space,
+                       num_configs        = 27,
+                       min_episodes       = 4,
+                       eta                = 3,
+                       max_episodes       = None,
+                       score_fraction     = 0.5,
+                       num_workers        = None,
+                       threads_per_worker = 1,
+                       backend            = 'numpy',
+                       results_path       = None,
+                       seed               = None):
+
+        self.env_class          = env_class
+        self.env_kwargs         = env_kwargs
+        self.space              = space
+        self.num_configs        = num_configs
+        self.min_episodes       = min_episodes
+        self.eta                = eta
+        self.max_episodes       = max_episodes
+        self.score_fraction     = score_fraction
+        self.num_workers        = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.backend            = backend
+        self.results_path       = results_path
+
+        self.random_state = np.random.RandomState(seed)
+
+        #  trial_id -> config, curve & score of each trial
+        self.trials = []
+
+    def score(self, curve):
+        """
+        Mean of the last score_fraction of a learning curve
+        """
+        count = max(1, int(math.ceil(len(curve) * self.score_fraction)))
+        return float(np.mean(curve[-count:]))
+
+    def run(self, pool=None):
+        """
+        Runs all of the rungs
+
+        Args:
+            pool (multiprocessing.Pool) : a pool to use (default makes one)
+
+        Returns:
+            best (dict) : the trial with the best score in the last rung
+        """
+        first = len(self.trials)
+        for _ in range(self.num_configs):
+            self.trials.append({'trial_id': len(self.trials),
+                                'config': sample_config(self.space, self.random_state),
+                                'curve': [],
+                                'rungs': [],
+                                'episodes': 0,
+                                'score': None})
+        survivors = list(range(first, len(self.trials)))
+        states = {trial_id: None for trial_id in survivors}
+
+        own_pool = pool is None
+        if own_pool:
+            pool = make_pool(self.num_workers, self.threads_per_worker)
+
+        try:
+            rung, budget = 0, self.min_episodes
+            while True:
+                tasks = [(trial_id, self.trials[trial_id]['config'], self.env_class,
+                          self.env_kwargs, budget, states[trial_id], self.backend,
+                          int(self.random_state.randint(0, 2 ** 31 - 1)))
+                         for trial_id in survivors]
+
+                for result in pool.map(run_trial, tasks):
+                    trial = self.trials[result['trial_id']]
+                    trial['curve'].extend(float(reward) for reward in result['curve'])
+                    trial['episodes'] = budget
+                    trial['score'] = self.score(trial['curve'])
+                    trial['rungs'].append(rung)
+                    states[result['trial_id']] = result['state']
+
+                self.write()
+                print('rung {} - {} trials of {} episodes - best score {:.2f}'.format(
+                    rung, len(survivors), budget,
+                    max(self.trials[trial_id]['score'] for trial_id in survivors)))
+
+                #  promote the best 1 / eta
+                ranked = sorted(survivors, key=lambda trial_id: self.trials[trial_id]['score'],
+                                reverse=True)
+                next_budget = budget * self.eta
+                if len(ranked) <= 1 or (self.max_episodes is not None and next_budget > self.max_episodes):
+                    break
+                survivors = ranked[:max(1, len(ranked) // self.eta)]
+                states = {trial_id: states[trial_id] for trial_id in survivors}
+                rung, budget = rung + 1, next_budget
+        finally:
+            if own_pool:
+                pool.close()
+                pool.join()
+
+        return self.trials[ranked[0]]
+
+    def write(self):
+        """
+        Writes every trial (config, learning curve & score) to results_path
+        """
+        if self.results_path is None:
+            return None
+
+        ensure_dir(self.results_path)
+        with open(self.results_path, 'w') as handle:
+            json.dump(self.trials, handle, indent=2)
+        return None
+
+
+def make_pool(num_workers=None, threads_per_worker=1, initializer=None, initargs=()):
+    """
+    A process pool with limited threads in each worker
+
+    The thread env vars are set while the workers start so that the
+    numerical libraries read them before their first import
+
+    Args:
+        initializer (callable) : run in each worker (default init_worker)
+        initargs    (tuple)    : args for initializer
+    """
+    if initializer is None:
+        initializer, initargs = init_worker, (threads_per_worker,)
+
+    saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads_per_worker)
+    try:
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(processes=num_workers,
+                            initializer=initializer,
+                            initargs=initargs)
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+    return pool
+
+
+def hyperband(env_class, env_kwargs, space, max_episodes, eta=3, **kwargs):
+    """
+    Runs successive halving brackets from many to few configurations
+
+    Bracket s starts num_configs = ceil((s_max + 1) / (s + 1) * eta ** s)
+    configurations at max_episodes * eta ** -s episodes each.
+
+    Args:
+        kwargs : passed to Successive_Halving (i.e. num_workers, results_path)
+
+    Returns:
+        best   (dict) : the best trial across all brackets
+        trials (list) : every trial of every bracket
+    """
+    results_path = kwargs.pop('results_path', None)
+    seed = kwargs.pop('seed', None)
+    s_max = int(math.floor(math.log(max_episodes) / math.log(eta) + 1e-9))
+
+    pool = make_pool(kwargs.pop('num_workers', None), kwargs.get('threads_per_worker', 1))
+    best, trials = None, []
+    try:
+        for s in reversed(range(s_max + 1)):
+            num_configs = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+            min_episodes = max(1, int(max_episodes * eta ** -s))
+
+            bracket_path = None
+            if results_path is not None:
+                root, ext = os.path.splitext(results_path)
+                bracket_path = '{}_bracket_{}{}'.format(root, s, ext)
+
+            search = Successive_Halving(env_class, env_kwargs, space,
+                                        num_configs=num_configs,
+                                        min_episodes=min_episodes,
+                                        eta=eta,
+                                        max_episodes=max_episodes,
+                                        results_path=bracket_path,
+                                        seed=None if seed is None else seed + s,
+                                        **kwargs)
+            bracket_best = search.run(pool)
+            trials.extend(search.trials)
+            if best is None or bracket_best['score'] > best['score']:
+                best = bracket_best
+    finally:
+        pool.close()
+        pool.join()
+
+    return best, trials
@@ -0,0 +1,299 @@
+"""
+A typed columnar store for experiment results.
+
+Tables are written as Parquet (or Feather with older pandas) when pyarrow
+is installed - otherwise as one .npy file per column.  Either way every
+column keeps its dtype, so results read back exactly & without parsing.
+
+Before writing, object columns are made typed
+    - array valued cells (i.e. observation, action) become one float
+      column per element - name_0, name_1 ...  False / None cells (i.e.
+      the terminal next_observation) become NaN
+    - numeric cells (i.e. decimal.Decimal) become float64
+    - anything else becomes a string
+
+The input time series is not copied into the results - it is referenced
+by the SHA-256 of its CSV & the index labels of the slice used.  See
+Results_Store.load_dataset.
+
+Layout of a store directory
+    manifest.json    - tables (format & columns) & dataset references
+    <table>.parquet  - or <table>.feather, or <table>/<i>.npy for column i
+"""
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+#  name of the column holding the dataframe index
+INDEX = '__index__'
+
+
+def default_format():
+    """
+    The fastest format available - 'parquet', 'feather' or 'numpy'
+    """
+    if pyarrow is not None:
+        if hasattr(pd.DataFrame, 'to_parquet'):
+            return 'parquet'
+        return 'feather'
+    return 'numpy'
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """
+    SHA-256 of a file - read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def typed_columns(df):
+    """
+    Converts a dataframe into typed 1D columns - see module docstring
+
+    The index is kept as the INDEX column (datetimes as datetime64[ns])
+
+    Returns:
+        columns (OrderedDict) : name -> np.array
+    """
+    columns = collections.OrderedDict()
+    index = df.index
+    if isinstance(index, pd.DatetimeIndex):
+        columns[INDEX] = index.values.astype('datetime64[ns]')
+    else:
+        columns[INDEX] = typed_array(np.asarray(index))
+
+    for name in df.columns:
+        values = np.asarray(df[name].values)
+        if values.dtype != object:
+            columns[str(name)] = values
+            continue
+
+        if any(np.ndim(cell) > 0 for cell in values):
+            for i, col in enumerate(expand_cells(values).T):
+                columns['{}_{}'.format(name, i)] = col
+        else:
+            columns[str(name)] = typed_array(values)
+
+    return columns
+
+
+def expand_cells(values):
+    """
+    Helper function for typed_columns
+
+    Array valued cells into a 2D float array - missing cells (False, None)
+    & short arrays are padded with NaN
+    """
+    cells = [np.asarray(cell, dtype=np.float64).reshape(-1)
+             if (np.ndim(cell) > 0) else None for cell in values]
+    width = max(cell.shape[0] for cell in cells if cell is not None)
+
+    expanded = np.full((len(cells), width), np.nan)
+    for i, cell in enumerate(cells):
+        if cell is not None:
+            expanded[i, :cell.shape[0]] = cell
+    return expanded
+
+
+def typed_array(values):
+    """
+    Helper function for typed_columns
+
+    Object cells as float64 if they are all numeric - otherwise strings
+    """
+    if values.dtype != object:
+        return values
+    try:
+        return np.array([np.nan if cell is None else float(cell) for cell in values])
+    except (TypeError, ValueError):
+        return np.array([str(cell) for cell in values])
+
+
+class Results_Store(object):
+    """
+    Reads & writes typed results tables in a directory
+
+    Reading is lazy & column selective - only the requested columns are
+    read, & with the numpy format columns are memory-mapped.
+
+    Usage (i.e. in a notebook)
+        store = Results_Store('results/store')
+        store.tables
+        store.columns('agent_steps')
+        df = store.read('agent_steps', columns=['reward', 'action_0'])
+        state_ts = store.load_dataset('state_ts_10')
+
+    Args:
+        path   (str) : the store directory
+        format (str) : 'parquet', 'feather' or 'numpy' (default is the
+                       fastest available)
+    """
+    def __init__(self, path, format=None):
+        self.path = os.path.expanduser(path)
+        self.format = format or default_format()
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as handle:
+                self.manifest = json.load(handle)
+        else:
+            self.manifest = {'tables': {}, 'datasets': {}}
+
+    @property
+    def tables(self):
+        return sorted(self.manifest['tables'])
+
+    def columns(self, table):
+        """
+        The column names of a table (excluding the index)
+        """
+        return [col for col in self.manifest['tables'][table]['columns'] if col != INDEX]
+
+    def write_manifest(self):
+        os.makedirs(self.path, exist_ok=True)
+        temp = self.manifest_path + '.tmp'
+        with open(temp, 'w') as handle:
+            json.dump(self.manifest, handle, indent=2)
+        os.replace(temp, self.manifest_path)
+        return None
+
+    def table_path(self, table, format):
+        if format == 'numpy':
+            return os.path.join(self.path, table)
+        return os.path.join(self.path, '{}.{}'.format(table, format))
+
+    def write(self, table, df):
+        """
+        Writes a dataframe as a typed table - replacing any table of that name
+        """
+        columns = typed_columns(df)
+        self.remove(table)
+        os.makedirs(self.path, exist_ok=True)
+        path = self.table_path(table, self.format)
+
+        if self.format == 'numpy':
+            os.makedirs(path)
+            names = list(columns)
+            for i, (name, values) in enumerate(columns.items()):
+                #  files are numbered - column names can hold any character
+                np.save(os.path.join(path, '{}.npy'.format(i)), values)
+        else:
+            frame = pd.DataFrame(columns)
+            names = list(frame.columns)
+            if self.format == 'parquet':
+                frame.to_parquet(path)
+            else:
+                frame.to_feather(path)
+
+        self.manifest['tables'][table] = {'format': self.format,
+                                          'columns': names,
+                                          'rows': int(df.shape[0]),
+                                          'index_name': df.index.name}
+        self.write_manifest()
+        return None
+
+    def read(self, table, columns=None):
+        """
+        Reads a table (or only some columns) as a dataframe
+
+        Args:
+            table   (str)  :
+            columns (list) : columns to read (default all)
+        """
+        info = self.manifest['tables'][table]
+        if columns is None:
+            columns = self.columns(table)
+        missing = set(columns) - set(info['columns'])
+        if missing:
+            raise KeyError('{} not in table {}'.format(sorted(missing), table))
+
+        wanted = [INDEX] + list(columns)
+        path = self.table_path(table, info['format'])
+        if info['format'] == 'numpy':
+            data = collections.OrderedDict((name, self.column(table, name)) for name in wanted)
+            frame = pd.DataFrame(data)
+        elif info['format'] == 'parquet':
+            frame = pd.read_parquet(path, columns=wanted)
+        else:
+            frame = pd.read_feather(path, columns=wanted)
+
+        frame = frame.set_index(INDEX)
+        frame.index.name = info['index_name']
+        return frame
+
+    def column(self, table, name):
+        """
+        A single column as a numpy array - memory-mapped for the numpy format
+        """
+        info = self.manifest['tables'][table]
+        path = self.table_path(table, info['format'])
+        if info['format'] == 'numpy':
+            i = info['columns'].index(name)
+            return np.load(os.path.join(path, '{}.npy'.format(i)), mmap_mode='r')
+
+        if name == INDEX:
+            return np.asarray(self.read(table, []).index)
+        return np.asarray(self.read(table, [name])[name])
+
+    def remove(self, table):
+        """
+        Removes a table if it exists
+        """
+        info = self.manifest['tables'].pop(table, None)
+        if info is None:
+            return None
+        path = self.table_path(table, info['format'])
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        return None
+
+    def reference_dataset(self, name, csv_path, first, last):
+        """
+        Records a slice of an input CSV by reference rather than copying it
+
+        Args:
+            name     (str) : i.e. 'state_ts_10'
+            csv_path (str) : the input dataset
+            first    (str) : index label of the first row of the slice
+            last     (str) : index label of the last row of the slice
+        """
+        self.manifest['datasets'][name] = {'path': os.path.abspath(csv_path),
+                                           'sha256': file_hash(csv_path),
+                                           'first': str(first),
+                                           'last': str(last)}
+        self.write_manifest()
+        return None
+
+    def load_dataset(self, name, check=True):
+        """
+        Reads a referenced slice of an input dataset
+
+        Args:
+            check (bool) : raise if the CSV has changed since it was referenced
+        """
+        info = self.manifest['datasets'][name]
+        if check and file_hash(info['path']) != info['sha256']:
+            raise ValueError('{} has changed since the results were written'.format(info['path']))
+
+        raw = pd.read_csv(info['path'], index_col=0)
+        labels = raw.index.astype(str)
+        first = np.flatnonzero(labels == info['first'])[0]
+        last = np.flatnonzero(labels == info['last'])[-1]
+        return raw.iloc[first:last + 1]
@@ -77,3 +77,88 @@ class Continuous_Space(Space):
 
     def _contains(self, x):
         return (x >= self.low) and (x <= self.high)
+
+
+def scaling_bounds(spaces):
+    """
+    Precomputes the vectors used to scale an array of values from a list
+    of spaces with a single broadcast
+
+        scaled = (array - low) * inv_range
+
+    Continuous spaces are normalized to [0, 1] - a constant space scales to 0
+    Discrete spaces are already dummy variables and are left as is
+
+    Args:
+        spaces (list) : one space object per column of the array
+
+    Returns:
+        low       (np.array) :
+        inv_range (np.array) : 1 / (high - low)
+    """
+    low = np.zeros(len(spaces))
+    inv_range = np.ones(len(spaces))
+
+    for i, space in enumerate(spaces):
+        if space.type == 'continuous':
+            low[i] = space.low
+            #  catch the constant value case
+            if space.high == space.low:
+                inv_range[i] = 0
+            else:
+                inv_range[i] = 1 / (space.high - space.low)
+
+        elif space.type != 'discrete':
+            raise ValueError('unknown space type {}'.format(space.type))
+
+    return low, inv_range
+
+
+def make_action_grid(spaces, num_steps=5):
+    """
+    Discretizes a list of action spaces into a grid of joint actions
+
+    Continuous spaces are split into num_steps evenly spaced values (both
+    bounds included) - discrete spaces use their discrete_space.  The grid
+    is every combination of these values, with the last space varying
+    fastest (so np.ravel_multi_index maps per space indexes to a row).
+
+    Args:
+        spaces    (list) : one space object per action
+        num_steps (int)  : values for each continuous space
+
+    Returns:
+        grid   (np.array) : (num_joint_actions, len(spaces))
+        values (list)     : the values used for each space
+    """
+    values = []
+    for space in spaces:
+        if space.type == 'continuous':
+            values.append(np.linspace(space.low, space.high, num_steps))
+        elif space.type == 'discrete':
+            values.append(np.asarray(space.discrete_space, dtype=np.float64))
+        else:
+            raise ValueError('unknown space type {}'.format(space.type))
+
+    mesh = np.meshgrid(*values, indexing='ij')
+    grid = np.stack([dim.reshape(-1) for dim in mesh], axis=1)
+    return grid, values
+
+
+def action_grid_indexes(actions, values):
+    """
+    Row of the action grid for each action - see make_action_grid
+
+    Actions are snapped to the nearest grid value in each dimension
+
+    Args:
+        actions (np.array) : (num_samples, len(values))
+        values  (list)     : values for each space from make_action_grid
+
+    Returns:
+        indexes (np.array) : (num_samples,)
+    """
+    actions = np.asarray(actions).reshape(-1, len(values))
+    per_dim = [np.abs(actions[:, [dim]] - vals).argmin(axis=1)
+               for dim, vals in enumerate(values)]
+    return np.ravel_multi_index(per_dim, tuple(vals.shape[0] for vals in values))
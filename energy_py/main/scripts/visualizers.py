@@ -2,14 +2,25 @@
 """
 
 import collections
-import itertools
 import os
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
+from energy_py.main.scripts.figure_renderer import draw_time_series, get_renderer, min_max_downsample
+from energy_py.main.scripts.results_store import Results_Store
 from energy_py.main.scripts.utils import ensure_dir
 
+#  most points plotted per line - a 20 inch figure is 2000 pixels wide at
+#  100 dpi & each downsampling bucket plots a min & a max
+MAX_POINTS = 4000
+
+#  steps (5 minutes each) shown by the xlim modes
+XLIM_STEPS = {'last_week': 7 * 24 * 12,
+              'last_month': 30 * 24 * 12,
+              'all': None}
+
 
 class Visualizer(object):
     """
@@ -44,49 +55,61 @@ class Visualizer(object):
                     ylabel,
                     xlim='all',
                     ylim=[],
-                    path=None):
-
-        fig = self.make_time_series_fig(df, cols, xlabel, ylabel, xlim, ylim)
-        if path:
-            self.save_fig(fig, path)
-        return fig
-
-    def make_time_series_fig(self, df, cols, xlabel, ylabel,  xlim='all', ylim=[]):
-        """
-        makes a time series figure from a dataframe and specified columns
+                    path=None,
+                    max_points=MAX_POINTS):
         """
+        Hands a time series figure to the figure renderer - see figure_renderer
 
-        #  make the figure & axes objects
-        fig, ax = plt.subplots(1, 1, figsize = (20, 20))
-        for col in cols:
-            data = df.loc[:, col].astype(float)
-            data.plot(kind='line', ax=ax, label=col)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.legend()
-
-        if ylim:
-            ax.set_ylim(ylim)
-
-        if xlim == 'last_week':
-            start = df.index[-7 * 24 * 12]
-            end = df.index[-1]
+        Returns:
+            fig (matplotlib.figure.Figure) : only when rendering inline
+        """
+        job = self.make_figure_job(df, cols, xlabel, ylabel, xlim, ylim, path, max_points)
+        return get_renderer().submit(job)
 
-        if xlim == 'last_month':
-            start = df.index[-30 * 24 * 12]
-            end = df.index[-1]
+    def make_figure_job(self, df, cols, xlabel, ylabel, xlim='all', ylim=[], path=None,
+                        max_points=MAX_POINTS):
+        """
+        The data & spec of a time series figure from a dataframe and
+        specified columns
 
-        if xlim == 'all':
-            start = df.index[0]
-            end = df.index[-1]
+        The dataframe is cut to the xlim first & then each column is
+        downsampled to at most max_points (None = plot every point) - so
+        the zoomed in views keep their full resolution
 
-        ax.set_xlim([start, end])
+        Args:
+            xlim       (str) : 'last_week', 'last_month' or 'all'
+            max_points (int) : most points plotted per column
+        """
+        steps = XLIM_STEPS[xlim]
+        if steps is not None:
+            df = df.iloc[-steps:]
+        index = np.asarray(df.index.values)
 
-        return fig
+        series = collections.OrderedDict()
+        for col in cols:
+            data = np.asarray(df.loc[:, col].astype(float).values)
+            positions = min_max_downsample(data, max_points)
+            series[col] = (index[positions], data[positions])
+
+        return {'series': series,
+                'xlabel': xlabel,
+                'ylabel': ylabel,
+                'xlim': [df.index[0], df.index[-1]],
+                'ylim': ylim,
+                'path': path}
+
+    def make_time_series_fig(self, df, cols, xlabel, ylabel,  xlim='all', ylim=[],
+                             max_points=MAX_POINTS):
+        """
+        makes a time series figure from a dataframe and specified columns
+        """
+        job = self.make_figure_job(df, cols, xlabel, ylabel, xlim, ylim, max_points=max_points)
+        return draw_time_series(job)
 
     def save_fig(self, fig, path):
         ensure_dir(path)
         fig.savefig(path)
+        plt.close(fig)
 
 
 class Env_Episode_Visualizer(Visualizer):
@@ -145,58 +168,51 @@ class Agent_Memory_Visualizer(Visualizer):
         super().__init__()
         self.base_path = os.path.join('results/')
 
-    def make_dataframes(self):
+    def make_dataframes(self, observations=False):
         """
         Helper function for self.output_results()
 
         Creates two dataframes
         'dataframe_steps'    = dataframe on a step frequency
         'dataframe_episodic' = dataframe on a episodic frequency
+
+        The step dataframe is built straight from the memory buffer (only
+        experience still held).  The episodic dataframe uses the statistics
+        kept as each episode was processed (every episode).
+
+        Args:
+            observations (bool) : include a column for each observation
         """
-        #  create lists on a step by step basis
         print('agent memory is making dataframes')
-        assert len(self.experiences) == len(self.scaled_experiences)
-
-        ep, stp, obs, act, rew, nxt_obs = [], [], [], [], [], []
-        scl_obs, scl_act, scl_rew, scl_nxt_obs, dis_ret = [], [], [], [], []
-        for exp, scaled_exp in itertools.zip_longest(self.experiences, self.scaled_experiences):
-            ep.append(exp.episode)
-            stp.append(exp.step)
-            obs.append(exp.observation)
-            act.append(exp.action)
-            rew.append(exp.reward)
-            nxt_obs.append(exp.next_observation)
-
-            scl_obs.append(scaled_exp.observation)
-            scl_act.append(scaled_exp.action)
-            scl_rew.append(scaled_exp.reward)
-            scl_nxt_obs.append(scaled_exp.next_observation)
-            dis_ret.append(scaled_exp.discounted_return)
-
-        df_dict = {
-                   'episode':ep,
-                   'step':stp,
-                   'observation':obs,
-                   'action':act,
-                   'reward':rew,
-                   'next_observation':nxt_obs,
-                   'scaled_reward':scl_rew,
-                   'discounted_return':dis_ret,
-                   'scaled_observation':scl_obs,
-                   'scaled_action':scl_act,
-                   'scaled_reward':scl_rew,
-                   'scaled_next_observation':scl_nxt_obs,
-                   }
-
-        dataframe_steps = pd.DataFrame.from_dict(df_dict)
-
-        dataframe_episodic = dataframe_steps.groupby(by=['episode'],
-                                                  axis=0).sum()
+        positions = self.buffer.chronological()
+        rows = self.buffer.gather(positions, ['episode', 'step', 'reward',
+                                              'scaled_reward', 'discounted_return'])
+
+        df_dict = collections.OrderedDict(rows)
+        actions = self.buffer.gather(positions, ['action'])['action']
+        for i in range(actions.shape[1]):
+            df_dict['action_{}'.format(i)] = actions[:, i]
+
+        if observations:
+            for prefix, obs in (('observation', self.get_observations(positions)),
+                                ('scaled_observation', self.get_scaled_observations(positions))):
+                for i in range(obs.shape[1]):
+                    df_dict['{}_{}'.format(prefix, i)] = obs[:, i]
+
+        dataframe_steps = pd.DataFrame(df_dict)
+        dataframe_steps.set_index('episode', drop=True, inplace=True)
 
-        if self.losses:
-            dataframe_episodic.loc[:, 'loss'] = self.losses
+        dataframe_episodic = pd.DataFrame(list(self.episode_stats.values()),
+                                          index=list(self.episode_stats.keys()),
+                                          columns=self.episode_stat_names)
+        dataframe_episodic.index.name = 'episode'
 
-        dataframe_steps.set_index('episode', drop=True, inplace=True)
+        #  one loss per episode - we align the most recent losses
+        if self.losses:
+            losses = np.full(dataframe_episodic.shape[0], np.nan)
+            recent = self.losses[-losses.shape[0]:] if losses.shape[0] else []
+            losses[losses.shape[0] - len(recent):] = recent
+            dataframe_episodic.loc[:, 'loss'] = losses
 
         return dataframe_steps,  dataframe_episodic
 
@@ -215,10 +231,21 @@ class Agent_Memory_Visualizer(Visualizer):
 class Eternity_Visualizer(Visualizer):
     """
     A class to join together data generated by the agent and environment
+
+    Dataframes are saved as typed tables in a Results_Store at
+    results/store - the env state time series is saved by reference to
+    its CSV rather than copied
+
+    Args:
+        episode      (int) :
+        agent        (obj) :
+        env          (obj) :
+        store_format (str) : Results_Store format (default the fastest available)
     """
     def __init__(self, episode,
                        agent,
-                       env):
+                       env,
+                       store_format=None):
         super().__init__()
 
         self.env = env
@@ -227,6 +254,8 @@ class Eternity_Visualizer(Visualizer):
 
         self.base_path_agent = os.path.join('results/')
         self.base_path_env = os.path.join('results/episodes')
+        self.store = Results_Store(os.path.join(self.base_path_agent, 'store'),
+                                   format=store_format)
 
         #  pull out the data
         print('Eternity visualizer is pulling data out of the agent')
@@ -254,10 +283,6 @@ class Eternity_Visualizer(Visualizer):
         """
         Generates results
         """
-        def save_df(df, path):
-            ensure_dir(path)
-            df.to_csv(path)
-
         print('saving the figures')
 
         #  iterate over the figure dictionary from the env visualizer
@@ -292,17 +317,18 @@ class Eternity_Visualizer(Visualizer):
                                                           path=os.path.join(self.base_path_agent, 'loss_per_episode.png'))
 
         print('saving env dataframe')
-        save_df(self.env_info['dataframe'],
-                os.path.join(self.base_path_env, 'env_history_{}.csv'.format(self.episode)))
+        self.store.write('env_history_{}'.format(self.episode), self.env_info['dataframe'])
 
         print('saving state dataframe')
-        save_df(self.state_ts,
-                os.path.join(self.base_path_env, 'state_ts_{}.csv'.format(self.episode)))
+        csv_path = getattr(self.env, 'csv_path', None)
+        if csv_path is not None and os.path.exists(csv_path):
+            self.store.reference_dataset('state_ts_{}'.format(self.episode), csv_path,
+                                         self.state_ts.index[0], self.state_ts.index[-1])
+        else:
+            self.store.write('state_ts_{}'.format(self.episode), self.state_ts)
 
         print('saving memory steps dataframe')
-        save_df(self.agent_memory['dataframe_steps'],
-                os.path.join(self.base_path_agent, 'agent_df_steps.csv'))
+        self.store.write('agent_steps', self.agent_memory['dataframe_steps'])
 
         print('saving memory episodic dataframe')
-        save_df(self.agent_memory['dataframe_episodic'],
-                os.path.join(self.base_path_agent, 'agent_df_episodic.csv'))
+        self.store.write('agent_episodic', self.agent_memory['dataframe_episodic'])